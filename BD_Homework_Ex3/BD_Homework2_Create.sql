@@ -1,3 +1,9 @@
+-- Схема музыкального каталога для новой пустой базы.
+-- На рабочей базе та же схема применяется версионными миграциями
+-- (BD_Homework_Ex4/migrations.py, компонент music; python cli.py migrate --music):
+-- примененные версии хранятся в schema_migrations, а индексы строятся
+-- CREATE INDEX CONCURRENTLY без блокировки записи в таблицы.
+
 create table if not exists Genres (
 id serial primary key not null,
 name varchar(100) not null
@@ -43,4 +49,17 @@ create table if not exists CollectionTracks (
 	collection_id integer not null references Collections(id),
 	track_id integer not null references Tracks(id),
 	constraint ct primary key (collection_id, track_id)
-);
\ No newline at end of file
+);
+
+-- Индексы для обратного поиска по таблицам связей и внешних ключей
+-- (первичные ключи ag, aa, ct покрывают поиск только по первому столбцу)
+create index if not exists idx_artistgenres_artist on ArtistGenres(artist_id);
+create index if not exists idx_albumartists_album on AlbumArtists(album_id);
+create index if not exists idx_collectiontracks_track on CollectionTracks(track_id);
+create index if not exists idx_tracks_album on Tracks(album_id);
+
+-- Индексы для фильтров и сортировок из запросов заданий 2 и 3
+create index if not exists idx_tracks_duration on Tracks(duration);
+create index if not exists idx_albums_release_year on Albums(release_year);
+create index if not exists idx_collections_release_year on Collections(release_year);
+create index if not exists idx_artists_name on Artists(name);
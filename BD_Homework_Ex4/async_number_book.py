@@ -0,0 +1,323 @@
+"""
+Асинхронный вариант функций number_book.py на драйвере asyncpg
+
+Функции принимают пул asyncpg вместо соединения, а в остальном повторяют
+синхронные: те же аргументы, те же возвращаемые значения (id клиента,
+True/False, список кортежей), те же сообщения.
+"""
+import asyncio
+import re
+
+import asyncpg
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+from number_book import (
+    _REPLACE_PHONES_CTES,
+    _invalidate_cache,
+    _unique_phones,
+    normalize_phone,
+)
+
+
+async def create_pool(dsn=None, min_size=1, max_size=10, **connect_kwargs):
+    """
+    Создание пула соединений asyncpg
+    dsn может быть URI (postgresql://...) или строкой вида "dbname=... user=..."
+    Возвращает пул или None, если подключиться не удалось
+    """
+    try:
+        if dsn and "://" not in dsn:
+            # asyncpg понимает только URI, поэтому разбираем строку libpq сами
+            options = parse_dsn(dsn)
+            if "dbname" in options:
+                options["database"] = options.pop("dbname")
+            connect_kwargs = {**options, **connect_kwargs}
+            dsn = None
+        return await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size, **connect_kwargs)
+    except Exception as e:
+        print(f"❌ Ошибка подключения к базе данных: {e}")
+        return None
+
+
+async def create_db(pool, dsn=None):
+    """
+    1. Функция, создающая структуру БД (таблицы)
+    Если миграции схемы клиентов уже применены (migrations.py), выполняется один запрос.
+    Иначе недостающие миграции применяет migrations.migrate (под advisory-блокировкой,
+    индексы - CONCURRENTLY) через соединение psycopg2 по строке dsn в отдельном
+    потоке. Без dsn схема не меняется: нужно выполнить python cli.py migrate
+    """
+    import migrations
+
+    try:
+        async with pool.acquire() as conn:
+            try:
+                applied = {(row["component"], row["version"])
+                           for row in await conn.fetch("SELECT component, version FROM schema_migrations")}
+            except asyncpg.UndefinedTableError:
+                applied = set()
+        if all((m.component, m.version) in applied for m in migrations.MIGRATIONS if m.component == "clients"):
+            return True
+
+        if dsn is None:
+            print("❌ Схема базы данных не актуальна: выполните python cli.py migrate "
+                  "или передайте create_db строку подключения dsn")
+            return False
+
+        def migrate():
+            conn = psycopg2.connect(dsn)
+            try:
+                return migrations.migrate(conn) is not None
+            finally:
+                conn.close()
+
+        # migrate ждет advisory-блокировку и строит индексы - не в цикле событий
+        if not await asyncio.get_running_loop().run_in_executor(None, migrate):
+            return False
+        print("✅ Структура базы данных создана успешно")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка при создании таблиц: {e}")
+        return False
+
+
+async def add_client(pool, first_name, last_name, email, phones=None):
+    """
+    2. Функция, позволяющая добавить нового клиента
+    """
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                client_id = await conn.fetchval(
+                    """
+                    INSERT INTO clients (first_name, last_name, email)
+                    VALUES ($1, $2, $3)
+                    RETURNING id
+                    """,
+                    first_name, last_name, email
+                )
+
+                # Добавляем телефоны, если они есть
+                if phones:
+                    await conn.executemany(
+                        "INSERT INTO phones (client_id, phone_number, phone_normalized) VALUES ($1, $2, $3) "
+                        "ON CONFLICT (client_id, phone_normalized) DO NOTHING",
+                        [(client_id, phone, normalize_phone(phone)) for phone in phones]
+                    )
+
+        _invalidate_cache(phones=phones or [])
+        print(f"✅ Клиент {first_name} {last_name} добавлен (ID: {client_id})")
+        return client_id
+
+    except asyncpg.UniqueViolationError:
+        print(f"❌ Ошибка: клиент с email '{email}' уже существует")
+        return None
+    except Exception as e:
+        print(f"❌ Ошибка: {e}")
+        return None
+
+
+async def add_phone(pool, client_id, phone):
+    """
+    3. Функция, позволяющая добавить телефон для существующего клиента
+    """
+    try:
+        async with pool.acquire() as conn:
+            # Проверка клиента и вставка одним запросом
+            inserted = await conn.fetchval(
+                """
+                INSERT INTO phones (client_id, phone_number, phone_normalized)
+                SELECT id, $2, $3 FROM clients WHERE id = $1
+                ON CONFLICT (client_id, phone_normalized) DO NOTHING
+                RETURNING id
+                """,
+                client_id, phone, normalize_phone(phone)
+            )
+            # Номер уже есть у клиента или клиента нет
+            exists = inserted or await conn.fetchval("SELECT 1 FROM clients WHERE id = $1", client_id)
+
+        if not inserted:
+            if exists:
+                print(f"ℹ️ Телефон {phone} уже есть у клиента с ID: {client_id}")
+                return True
+            print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+            return False
+        _invalidate_cache([client_id], [phone])
+
+        print(f"✅ Телефон {phone} добавлен клиенту с ID: {client_id}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка при добавлении телефона: {e}")
+        return False
+
+
+async def change_client(pool, client_id, first_name=None, last_name=None, email=None, phones=None):
+    """
+    4. Функция, позволяющая изменить данные о клиенте
+    Проверка существования, обновление данных и телефонов выполняются одним запросом
+    """
+    try:
+        params = [client_id]
+        updates = []
+        for column, value in (("first_name", first_name),
+                              ("last_name", last_name),
+                              ("email", email)):
+            if value is not None:
+                params.append(value)
+                updates.append(f"{column} = ${len(params)}")
+
+        if updates:
+            query = f"WITH target AS (UPDATE clients SET {', '.join(updates)} WHERE id = $1 RETURNING id)"
+        else:
+            query = "WITH target AS (SELECT id FROM clients WHERE id = $1 FOR UPDATE)"
+
+        # Обновляем телефоны, если они предоставлены: удаляются только
+        # отсутствующие в новом списке, добавляются только новые
+        if phones is not None:
+            params.extend(_unique_phones(phones))
+            query += ", " + (_REPLACE_PHONES_CTES
+                             .replace("%(numbers)s", f"${len(params) - 1}")
+                             .replace("%(normalized)s", f"${len(params)}"))
+
+        async with pool.acquire() as conn:
+            found = await conn.fetchval(query + " SELECT id FROM target", *params)
+
+        _invalidate_cache([client_id], phones or [])
+        if not found:
+            print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+            return False
+
+        print(f"✅ Данные клиента с ID {client_id} обновлены")
+        return True
+
+    except asyncpg.UniqueViolationError:
+        print(f"❌ Ошибка: email '{email}' уже используется другим клиентом")
+        return False
+    except Exception as e:
+        print(f"❌ Ошибка при обновлении клиента: {e}")
+        return False
+
+
+async def delete_phone(pool, client_id, phone):
+    """
+    5. Функция, позволяющая удалить телефон для существующего клиента
+    """
+    try:
+        async with pool.acquire() as conn:
+            # Проверка клиента и удаление телефона одним запросом
+            found, deleted = await conn.fetchrow(
+                """
+                WITH target AS (
+                    SELECT id FROM clients WHERE id = $1
+                ), deleted AS (
+                    DELETE FROM phones p
+                    USING target t
+                    WHERE p.client_id = t.id AND p.phone_normalized = $2
+                    RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM target), (SELECT COUNT(*) FROM deleted)
+                """,
+                client_id, normalize_phone(phone)
+            )
+
+        _invalidate_cache([client_id])
+        if not found:
+            print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+            return False
+        elif deleted > 0:
+            print(f"✅ Телефон {phone} удален у клиента с ID: {client_id}")
+            return True
+        else:
+            print(f"❌ Телефон {phone} не найден у клиента с ID: {client_id}")
+            return False
+
+    except Exception as e:
+        print(f"❌ Ошибка при удалении телефона: {e}")
+        return False
+
+
+async def delete_client(pool, client_id):
+    """
+    6. Функция, позволяющая удалить существующего клиента
+    """
+    try:
+        async with pool.acquire() as conn:
+            # Удаляем клиента (телефоны удалятся каскадно)
+            client = await conn.fetchrow(
+                "DELETE FROM clients WHERE id = $1 RETURNING first_name, last_name",
+                client_id
+            )
+
+        _invalidate_cache([client_id])
+        if not client:
+            print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+            return False
+
+        print(f"✅ Клиент '{client['first_name']} {client['last_name']}' (ID: {client_id}) удален")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка при удалении клиента: {e}")
+        return False
+
+
+async def find_client(pool, first_name=None, last_name=None, email=None, phone=None):
+    """
+    7. Функция, позволяющая найти клиента по его данным
+    Возвращает список кортежей (id, first_name, last_name, email, phones)
+    """
+    try:
+        query = """
+            SELECT DISTINCT c.id, c.first_name, c.last_name, c.email,
+                   COALESCE(
+                       STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at, p.id),
+                       'нет телефона'
+                   ) as phones
+            FROM clients c
+            LEFT JOIN phones p ON c.id = p.client_id
+            WHERE 1=1
+        """
+        params = []
+
+        # Добавляем условия поиска
+        for column, value in (("c.first_name", first_name),
+                              ("c.last_name", last_name),
+                              ("c.email", email)):
+            if value:
+                params.append(f'%{value}%')
+                query += f" AND {column} ILIKE ${len(params)}"
+
+        if phone:
+            params.append(f'%{phone}%')
+            digits = re.sub(r"\D", "", phone)
+            if digits:
+                # Номер может быть записан в любом формате - ищем и по цифрам
+                params.append(f'%{digits}%')
+                query += f" AND (p.phone_number ILIKE ${len(params) - 1} OR p.phone_normalized LIKE ${len(params)})"
+            else:
+                query += f" AND p.phone_number ILIKE ${len(params)}"
+
+        query += " GROUP BY c.id ORDER BY c.id"
+
+        async with pool.acquire() as conn:
+            results = [tuple(row) for row in await conn.fetch(query, *params)]
+
+        if results:
+            print(f"\n🔍 Найдено {len(results)} клиент(ов):")
+            print("-" * 70)
+            for client_id, first_name, last_name, email, phones in results:
+                print(f"  ID: {client_id}")
+                print(f"    Имя: {first_name} {last_name}")
+                print(f"    Email: {email}")
+                print(f"    Телефоны: {phones}")
+                print("    " + "-" * 40)
+        else:
+            print("\n🔍 Клиенты не найдены")
+        return results
+
+    except Exception as e:
+        print(f"❌ Ошибка при поиске клиентов: {e}")
+        return []
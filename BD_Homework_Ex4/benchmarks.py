@@ -0,0 +1,1439 @@
+"""
+Бенчмарки для number_book.py на локальном PostgreSQL
+
+Запуск:
+    python benchmarks.py --dsn "dbname=clients user=postgres host=localhost" async
+    python benchmarks.py --dsn "..." search --scales 10000 1000000 10000000
+    python benchmarks.py --dsn "..." writes --calls 1000
+    python benchmarks.py --dsn "..." prepared --calls 2000
+    python benchmarks.py --dsn "..." titles --scales 1000000 3000000
+    python benchmarks.py --dsn "..." plans --scales 10000 100000 1000000
+    python benchmarks.py --dsn "..." upsert --threads 8 --calls 500
+    python benchmarks.py --dsn "..." replicas --replica "port=5433 ..." --policy least_latency
+    python benchmarks.py --dsn "..." partitions --clients 1000000 --partitions 16
+    python benchmarks.py --dsn "..." changes --threads 4 --calls 200
+    python benchmarks.py --dsn "..." callerid --clients 100000 --changes 1000
+    python benchmarks.py --dsn "..." multiget --sizes 1 100 10000
+
+Команда plans - регрессионная проверка: завершается с кодом 1, если план
+запроса перешел на последовательное чтение большой таблицы или задержка
+превысила бюджет. Команда upsert также завершается с кодом 1, если при
+одновременном добавлении клиентов потерялись телефоны или возникли
+взаимные блокировки, а команда replicas - если чтение своих записей не
+нашло только что добавленного клиента или чтения ушли не на тот сервер,
+команда changes - если подписчик потока изменений пропустил события,
+команда callerid - если ответы индекса определителя номера разошлись с базой,
+а команда titles - если -исключение в поиске по названиям не отсекло трек.
+
+DSN по умолчанию берется из переменной окружения NUMBER_BOOK_DSN.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import music_catalog
+import number_book
+import prepared
+from db_pool import ConnectionPool
+
+DEFAULT_DSN = os.environ.get("NUMBER_BOOK_DSN", "dbname=clients user=postgres host=localhost port=5432")
+
+
+@contextlib.contextmanager
+def _quiet():
+    """
+    Подавление вывода print из функций number_book на время замера
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _percentile(values, pct):
+    """
+    Перцентиль по списку значений (метод ближайшего ранга)
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _latencies_ms(func, args_list):
+    """
+    Время выполнения func(*args) для каждого набора аргументов, в миллисекундах
+    """
+    result = []
+    with _quiet():
+        for args in args_list:
+            started = time.perf_counter()
+            func(*args)
+            result.append((time.perf_counter() - started) * 1000)
+    return result
+
+
+_SYLLABLES = ["ка", "ло", "ми", "ва", "не", "ро", "ту", "са", "ди", "ко", "ре", "на",
+              "ли", "бо", "ше", "го", "ин", "ов", "ев", "ан"]
+
+
+def _fake_name(rng, capitalize=True):
+    """
+    Случайное "имя" из 2-4 слогов для синтетических данных
+    """
+    name = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return name.capitalize() if capitalize else name
+
+
+def _seed_clients(dsn, count):
+    """
+    Дозаполнение таблицы clients синтетическими клиентами до count записей
+    """
+    with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+        with _quiet():
+            number_book.create_db(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM clients")
+            existing = cur.fetchone()[0]
+        conn.commit()
+        if existing >= count:
+            return
+        rng = random.Random(existing)
+        rows = (
+            (_fake_name(rng), _fake_name(rng) + "ов", f"bench{i}@example.com", [f"+7900{i:07d}"])
+            for i in range(existing, count)
+        )
+        number_book.import_clients(conn, rows)
+
+
+def bench_async(dsn, concurrency_levels=(1, 10, 100), requests=2000, pool_size=20, clients=10000):
+    """
+    Запросов в секунду для find_client: синхронный путь (потоки + пул psycopg2)
+    против асинхронного (asyncio + пул asyncpg) при разном числе одновременных вызовов
+    """
+    import async_number_book
+
+    _seed_clients(dsn, clients)
+    emails = [f"bench{i}@example.com" for i in range(0, clients, max(1, clients // requests))]
+
+    def run_sync(concurrency):
+        counter = iter(range(requests))
+        lock = threading.Lock()
+        size = min(concurrency, pool_size)
+
+        with ConnectionPool(dsn, minconn=size, maxconn=size) as pool:
+            def worker():
+                while True:
+                    with lock:
+                        i = next(counter, None)
+                    if i is None:
+                        return
+                    with pool.connection() as conn:
+                        number_book.find_client(conn, email=emails[i % len(emails)])
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return requests / (time.perf_counter() - started)
+
+    async def run_async(concurrency):
+        counter = iter(range(requests))
+        size = min(concurrency, pool_size)
+        pool = await async_number_book.create_pool(dsn, min_size=size, max_size=size)
+
+        async def worker():
+            for i in counter:
+                await async_number_book.find_client(pool, email=emails[i % len(emails)])
+
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return requests / (time.perf_counter() - started)
+        finally:
+            await pool.close()
+
+    print(f"find_client: {requests} запросов, пул до {pool_size} соединений")
+    print(f"{'вызовов':>8} {'sync, rps':>12} {'async, rps':>12}")
+    for concurrency in concurrency_levels:
+        with _quiet():
+            sync_rps = run_sync(concurrency)
+            async_rps = asyncio.run(run_async(concurrency))
+        print(f"{concurrency:>8} {sync_rps:>12.0f} {async_rps:>12.0f}")
+
+
+def _has_trigram_indexes(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        found = cur.fetchone() is not None
+    conn.rollback()
+    return found
+
+
+def _with_typo(rng, word):
+    """
+    Слово с одной опечаткой: перестановка двух соседних букв
+    """
+    if len(word) < 3:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def bench_search(dsn, scales=(10000, 1000000, 10000000), queries=200):
+    """
+    p50/p99 задержки поиска по фамилии на разных объемах таблицы clients:
+    текущий find_client (ILIKE '%...%' без триграммных индексов), тот же
+    запрос с индексами pg_trgm и нечеткий search_clients с опечатками.
+
+    Для замера "без индексов" триграммные индексы удаляются внутри транзакции,
+    которая затем откатывается, поэтому запускать стоит на тестовой базе.
+    """
+    trigram_indexes = ["idx_clients_first_name_trgm", "idx_clients_last_name_trgm",
+                       "idx_clients_email_trgm", "idx_phones_number_trgm"]
+    rng = random.Random(42)
+
+    print(f"{'клиентов':>10} {'вариант':<24} {'p50, мс':>9} {'p99, мс':>9}")
+    for scale in scales:
+        _seed_clients(dsn, scale)
+
+        with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("ANALYZE clients")
+                cur.execute("ANALYZE phones")
+                cur.execute("SELECT MAX(id) FROM clients")
+                max_id = cur.fetchone()[0]
+                cur.execute(
+                    "SELECT last_name FROM clients WHERE id = ANY(%s)",
+                    ([rng.randint(1, max_id) for _ in range(queries)],)
+                )
+                names = [row[0] for row in cur.fetchall()]
+            conn.autocommit = False
+
+            substrings = [(conn, None, name[1:5]) for name in names]
+            typos = [(conn, _with_typo(rng, name)) for name in names]
+            trigram = _has_trigram_indexes(conn)
+
+            # Текущий запрос: без триграммных индексов (удаляются и откатываются)
+            with conn.cursor() as cur:
+                for index in trigram_indexes:
+                    cur.execute(f"DROP INDEX IF EXISTS {index}")
+            baseline = _latencies_ms(number_book.find_client, substrings)
+            conn.rollback()
+
+            rows = [("find_client, seq scan", baseline)]
+            if trigram:
+                rows.append(("find_client + pg_trgm", _latencies_ms(number_book.find_client, substrings)))
+                rows.append(("search_clients (опечатки)", _latencies_ms(number_book.search_clients, typos)))
+                conn.rollback()
+
+            for title, latencies in rows:
+                print(f"{scale:>10} {title:<24} {_percentile(latencies, 50):>9.2f} "
+                      f"{_percentile(latencies, 99):>9.2f}")
+            if not trigram:
+                print(f"{scale:>10} расширение pg_trgm не установлено, индексные варианты пропущены")
+
+
+class _CountingCursor(psycopg2.extensions.cursor):
+    """
+    Курсор, считающий запросы к серверу (каждый execute - один обмен с сервером)
+    """
+    statements = 0
+
+    def execute(self, query, vars=None):
+        _CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+
+def _legacy_add_phone(conn, client_id, phone):
+    """
+    Прежняя реализация add_phone: отдельная проверка клиента, затем вставка
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
+        if not cur.fetchone():
+            return False
+        cur.execute(
+            "INSERT INTO phones (client_id, phone_number, phone_normalized) VALUES (%s, %s, %s)",
+            (client_id, phone, number_book.normalize_phone(phone))
+        )
+    conn.commit()
+    return True
+
+
+def _legacy_change_client(conn, client_id, last_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
+        if not cur.fetchone():
+            return False
+        cur.execute("UPDATE clients SET last_name = %s WHERE id = %s", (last_name, client_id))
+    conn.commit()
+    return True
+
+
+def _legacy_delete_phone(conn, client_id, phone):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
+        if not cur.fetchone():
+            return False
+        cur.execute(
+            "DELETE FROM phones WHERE client_id = %s AND phone_normalized = %s",
+            (client_id, number_book.normalize_phone(phone))
+        )
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def _legacy_delete_client(conn, client_id):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id, first_name, last_name FROM clients WHERE id = %s", (client_id,))
+        if not cur.fetchone():
+            return False
+        cur.execute("DELETE FROM clients WHERE id = %s", (client_id,))
+    conn.commit()
+    return True
+
+
+def bench_writes(dsn, calls=1000):
+    """
+    Задержка и число запросов к серверу на вызов для add_phone, change_client,
+    delete_phone и delete_client: прежняя схема "SELECT, затем запись" против
+    одного запроса с CTE/RETURNING
+    """
+    variants = [
+        ("add_phone", _legacy_add_phone, lambda conn, cid: number_book.add_phone(conn, cid, "+7 900 000-00-01")),
+        ("change_client", _legacy_change_client, lambda conn, cid: number_book.change_client(conn, cid, last_name="Новая")),
+        ("delete_phone", _legacy_delete_phone, lambda conn, cid: number_book.delete_phone(conn, cid, "+7 900 000-00-01")),
+        ("delete_client", _legacy_delete_client, number_book.delete_client),
+    ]
+    legacy_args = {
+        "add_phone": lambda cid: (cid, "+7 900 000-00-01"),
+        "change_client": lambda cid: (cid, "Новая"),
+        "delete_phone": lambda cid: (cid, "+7 900 000-00-01"),
+        "delete_client": lambda cid: (cid,),
+    }
+
+    with ConnectionPool(dsn, minconn=1, maxconn=1, cursor_factory=_CountingCursor) as pool, \
+            pool.connection() as conn:
+        with _quiet():
+            number_book.create_db(conn)
+
+        def make_clients(tag):
+            rows = [(f"Bench{i}", "Writes", f"writes-{tag}-{time.time_ns()}-{i}@example.com") for i in range(calls)]
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO clients (first_name, last_name, email) "
+                    "SELECT * FROM unnest(%s::text[], %s::text[], %s::text[]) RETURNING id",
+                    ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+                )
+                ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            return ids
+
+        legacy_ids = make_clients("legacy")
+        new_ids = make_clients("new")
+
+        print(f"{calls} вызовов каждой операции")
+        print(f"{'операция':<14} {'вариант':<10} {'запросов/вызов':>15} {'p50, мс':>9} {'p99, мс':>9}")
+        for name, legacy, current in variants:
+            for title, func, args_list in (
+                    ("прежний", legacy, [(conn,) + legacy_args[name](cid) for cid in legacy_ids]),
+                    ("CTE", current, [(conn, cid) for cid in new_ids])):
+                _CountingCursor.statements = 0
+                latencies = _latencies_ms(func, args_list)
+                per_call = _CountingCursor.statements / len(args_list)
+                print(f"{name:<14} {title:<10} {per_call:>15.1f} {_percentile(latencies, 50):>9.3f} "
+                      f"{_percentile(latencies, 99):>9.3f}")
+
+
+class _RecordingCursor(psycopg2.extensions.cursor):
+    """
+    Курсор, запоминающий текст выполненных запросов с подставленными параметрами
+    """
+    statements = []
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            if self.query is not None:
+                _RecordingCursor.statements.append(self.query.decode())
+
+
+_TITLE_WORDS = ["my", "love", "night", "song", "blue", "dream", "heart", "fire",
+                "мой", "ночь", "песня", "любовь", "город", "дождь", "небо", "ты"]
+
+
+def _database_counters(conn):
+    """
+    Счетчики взаимных блокировок и откатов текущей базы из pg_stat_database
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_stat_clear_snapshot()")
+        cur.execute("SELECT deadlocks, xact_rollback FROM pg_stat_database WHERE datname = current_database()")
+        row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def bench_upsert(dsn, threads=8, emails=20, phones=200, calls=500, batch=8):
+    """
+    Нагрузочная проверка add_client(on_conflict=...): потоки одновременно добавляют
+    одних и тех же клиентов со случайными подмножествами общих номеров (в разной
+    записи и в случайном порядке), часть вызовов - add_phone. В конце проверяется,
+    что на каждый email пришелся один id, у клиента есть все номера из успешных
+    вызовов и не было взаимных блокировок и откатов. Возвращает список нарушений
+    """
+    tag = time.time_ns()
+    addresses = [f"upsert-{tag}-{i}@example.com" for i in range(emails)]
+    digits = {email: [f"9{i % 100:02d}{tag % 10 ** 4:04d}{j:03d}" for j in range(phones)]
+              for i, email in enumerate(addresses)}
+    formats = (lambda d: f"+7 {d[:3]} {d[3:6]}-{d[6:8]}-{d[8:]}", lambda d: "8" + d, lambda d: f"7 ({d[:3]}) {d[3:]}")
+
+    lock = threading.Lock()
+    expected = {email: set() for email in addresses}
+    client_ids = {email: set() for email in addresses}
+    failures = []
+
+    with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+        with _quiet():
+            number_book.create_db(conn)
+        before = _database_counters(conn)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            worker_conn = psycopg2.connect(dsn)
+            try:
+                for _ in range(calls):
+                    email = rng.choice(addresses)
+                    chosen = rng.sample(digits[email], rng.randint(1, min(batch, phones)))
+                    numbers = [rng.choice(formats)(d) for d in chosen]
+                    with lock:
+                        known = next(iter(client_ids[email]), None)
+                    if known is not None and rng.random() < 0.2:
+                        numbers = numbers[:1]
+                        ok = number_book.add_phone(worker_conn, known, numbers[0])
+                        result = known
+                    else:
+                        mode = rng.choice(("nothing", "update"))
+                        result = number_book.add_client(worker_conn, "Upsert", f"Поток{seed}", email, numbers,
+                                                        on_conflict=mode)
+                        ok = result is not None
+                    with lock:
+                        if ok:
+                            client_ids[email].add(result)
+                            expected[email].update(number_book.normalize_phone(phone) for phone in numbers)
+                        else:
+                            failures.append(f"вызов для {email} завершился ошибкой")
+            finally:
+                worker_conn.close()
+
+        workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+        started = time.perf_counter()
+        with _quiet():
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        # Статистика завершившихся соединений попадает в pg_stat_database не сразу
+        time.sleep(1.0)
+        after = _database_counters(conn)
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.email, ARRAY_AGG(p.phone_normalized)
+                FROM clients c
+                JOIN phones p ON p.client_id = c.id
+                WHERE c.email = ANY(%s)
+                GROUP BY c.email
+                """,
+                (addresses,)
+            )
+            stored = {email: set(numbers) for email, numbers in cur.fetchall()}
+            cur.execute("DELETE FROM clients WHERE email = ANY(%s)", (addresses,))
+        conn.commit()
+
+    lost = sum(len(expected[email] - stored.get(email, set())) for email in addresses)
+    split = [email for email in addresses if len(client_ids[email]) > 1]
+    deadlocks, rollbacks = after[0] - before[0], after[1] - before[1]
+    if lost:
+        failures.append(f"потеряно телефонов: {lost}")
+    if split:
+        failures.append(f"несколько id на один email: {len(split)}")
+    if deadlocks:
+        failures.append(f"взаимных блокировок: {deadlocks}")
+    if rollbacks:
+        failures.append(f"откатов транзакций: {rollbacks}")
+
+    total = threads * calls
+    print(f"add_client с on_conflict: {threads} потоков, {total} вызовов на {emails} email, "
+          f"{total / elapsed:.0f} вызовов/сек")
+    print(f"потеряно телефонов: {lost}, взаимных блокировок: {deadlocks}, откатов: {rollbacks}")
+    for failure in failures[:20]:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Нарушений нет")
+    return failures
+
+
+def bench_replicas(dsn, replica_dsns, calls=200, policy="round_robin", max_lag=5.0):
+    """
+    Проверка маршрутизации (routing.ReplicaRouter) на основном сервере и репликах:
+    каждый добавленный клиент сразу читается в той же сессии (чтение своих
+    записей) и без сессии (может попасть на отстающую реплику), затем при
+    нулевом допустимом отставании все чтения должны уйти на основной сервер.
+    Возвращает список нарушений
+    """
+    from routing import ReplicaRouter
+
+    failures = []
+    tag = time.time_ns()
+    with ReplicaRouter(dsn, replica_dsns, policy=policy, max_lag=max_lag) as router:
+        with router.writer() as conn:
+            with _quiet():
+                number_book.create_db(conn)
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_is_in_recovery()")
+                if cur.fetchone()[0]:
+                    failures.append("основной сервер находится в режиме восстановления (это реплика)")
+            conn.rollback()
+
+        session = router.session()
+        stale = 0
+        read_latencies = []
+        with _quiet():
+            for i in range(calls):
+                email = f"replica-{tag}-{i}@example.com"
+                router.run(number_book.add_client, "Реплика", "Проверка", email, session=session)
+                started = time.perf_counter()
+                if not router.run(number_book.lookup_client, email=email, session=session):
+                    failures.append(f"чтение своей записи не нашло {email}")
+                read_latencies.append((time.perf_counter() - started) * 1000)
+                if not router.run(number_book.lookup_client, email=email):
+                    stale += 1
+
+        replica_reads = sum(node["reads"] for node in router.stats()[1:])
+        if router.replicas and any(node.healthy for node in router.replicas) and not replica_reads:
+            failures.append("ни одно чтение не ушло на реплики")
+
+        # Нулевой порог: любое отставание (даже ожидаемое) переводит чтения на основной сервер
+        router.max_lag = -1.0
+        primary_reads = router.primary.reads
+        with _quiet():
+            for i in range(min(calls, 20)):
+                router.run(number_book.lookup_client, email=f"replica-{tag}-{i}@example.com")
+        if router.primary.reads - primary_reads != min(calls, 20):
+            failures.append("при превышении порога отставания чтения не ушли на основной сервер")
+
+        print(f"{calls} записей и {2 * calls} чтений, политика {policy}, порог отставания {max_lag} с")
+        print(f"{'сервер':<10} {'доступен':>9} {'отставание, с':>14} {'отклик, мс':>11} {'чтений':>7} {'записей':>8}")
+        for node in router.stats():
+            latency = f"{node['latency_ms']:.2f}" if node["latency_ms"] is not None else "-"
+            print(f"{node['name']:<10} {'да' if node['healthy'] else 'нет':>9} {node['lag']:>14.3f} "
+                  f"{latency:>11} {node['reads']:>7} {node['writes']:>8}")
+        print(f"чтение своих записей: p50 {_percentile(read_latencies, 50):.3f} мс, "
+              f"p99 {_percentile(read_latencies, 99):.3f} мс")
+        print(f"чтений без сессии, не увидевших только что добавленного клиента: {stale}")
+
+        with router.writer() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM clients WHERE email LIKE %s", (f"replica-{tag}-%",))
+            conn.commit()
+
+    for failure in failures[:20]:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Нарушений нет")
+    return failures
+
+
+def _plan_stats(cur, query):
+    """
+    Время выполнения (мс) и число запущенных параллельных процессов по EXPLAIN ANALYZE
+    """
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query)
+    plan = cur.fetchone()[0][0]
+    workers = 0
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        workers += node.get("Workers Launched", 0)
+        nodes.extend(node.get("Plans", []))
+    return plan["Execution Time"], workers
+
+
+def bench_partitions(dsn, clients=1000000, partitions=16, lookups=500, keep=False):
+    """
+    Обычные таблицы clients/phones против секционированных (partitioning.py)
+    на одинаковых синтетических данных: параллельное чтение и группировка,
+    время VACUUM после обновления 10% телефонов и задержка точного поиска.
+
+    Данные создаются в схемах bench_heap и bench_part базы dsn (keep=True
+    оставляет их); секционированная схема получается онлайн-переходом, его
+    время тоже выводится. Для базы включаются enable_partitionwise_*.
+    """
+    import data_generator
+    import partitioning
+
+    queries = [
+        ("группировка GROUP BY c.id", """
+            SELECT c.id, COUNT(p.id), STRING_AGG(p.phone_number, ', ')
+            FROM clients c LEFT JOIN phones p ON p.client_id = c.id
+            GROUP BY c.id
+        """),
+        ("чтение phones LIKE '%...%'", "SELECT COUNT(*) FROM phones WHERE phone_normalized LIKE '%1234%'"),
+    ]
+    results = {}
+    for layout in ("heap", "part"):
+        schema = f"bench_{layout}"
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute(f"CREATE SCHEMA {schema}")
+        conn.close()
+
+        conn = psycopg2.connect(dsn, options=f"-c search_path={schema}")
+        result = results[layout] = {"migration": None}
+        with _quiet():
+            number_book.create_db(conn)
+            data_generator.generate_clients(conn, clients)
+            if layout == "part":
+                started = time.perf_counter()
+                if partitioning.migrate_to_partitioned(conn, partitions, drop_legacy=True) is None:
+                    print("❌ Не удалось перейти на секционированные таблицы")
+                    return
+                result["migration"] = time.perf_counter() - started
+        conn.close()
+
+        # Новое соединение: enable_partitionwise_* заданы для базы и действуют в новых сессиях
+        conn = psycopg2.connect(dsn, options=f"-c search_path={schema}")
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE clients")
+            cur.execute("VACUUM ANALYZE phones")
+            for title, query in queries:
+                runs = [_plan_stats(cur, query) for _ in range(3)]
+                result[title] = min(runs)
+
+            cur.execute("UPDATE phones SET created_at = created_at WHERE id % 10 = 0")
+            started = time.perf_counter()
+            cur.execute("VACUUM phones")
+            result["vacuum"] = time.perf_counter() - started
+            # Единица работы autovacuum - одна таблица, для секционированной - одна секция
+            cur.execute("UPDATE phones SET created_at = created_at WHERE id % 10 = 1")
+            target = "phones_p0" if layout == "part" else "phones"
+            started = time.perf_counter()
+            cur.execute(f"VACUUM {target}")
+            result["vacuum_unit"] = time.perf_counter() - started
+
+            cur.execute("""
+                SELECT c.id, c.email, p.phone_number
+                FROM clients c JOIN phones p ON p.client_id = c.id
+                ORDER BY random() LIMIT %s
+            """, (lookups,))
+            sample = cur.fetchall()
+        conn.autocommit = False
+
+        cases = [
+            ("lookup_client id", number_book.lookup_client, [(conn, cid) for cid, _, _ in sample]),
+            ("lookup_client email", number_book.lookup_client, [(conn, None, email) for _, email, _ in sample]),
+            ("find_client_by_phone", number_book.find_client_by_phone, [(conn, phone) for _, _, phone in sample]),
+        ]
+        for title, func, args_list in cases:
+            result[title] = _latencies_ms(func, args_list)
+            conn.rollback()
+        conn.close()
+
+        if not keep:
+            conn = psycopg2.connect(dsn)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA {schema} CASCADE")
+            conn.close()
+
+    heap, part = results["heap"], results["part"]
+    print(f"{clients} клиентов, {partitions} секций; онлайн-переход занял {part['migration']:.1f} с")
+    print(f"{'замер':<30} {'обычные':>18} {'секционированные':>18}")
+    for title, _ in queries:
+        cells = [f"{r[title][0]:.0f} мс, {r[title][1]} проц." for r in (heap, part)]
+        print(f"{title:<30} {cells[0]:>18} {cells[1]:>18}")
+    print(f"{'VACUUM phones, с':<30} {heap['vacuum']:>18.2f} {part['vacuum']:>18.2f}")
+    print(f"{'VACUUM одной таблицы/секции, с':<30} {heap['vacuum_unit']:>18.2f} {part['vacuum_unit']:>18.2f}")
+    for title, _, _ in cases:
+        cells = [f"{_percentile(r[title], 50):.3f} / {_percentile(r[title], 99):.3f}" for r in (heap, part)]
+        print(f"{title + ', p50/p99 мс':<30} {cells[0]:>18} {cells[1]:>18}")
+
+
+class _FeedCollector:
+    """
+    Подписчик change_feed в отдельном потоке: полученные события с временем получения
+    """
+
+    def __init__(self, dsn, consumer, batch_size=500):
+        self.dsn = dsn
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.events = []  # (время получения, Change)
+        self._loop = None
+        self._task = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        import change_feed
+
+        async def consume():
+            async for batch in change_feed.subscribe(self.dsn, self.consumer, self.batch_size, poll_interval=0.2):
+                received = time.perf_counter()
+                self.events.extend((received, change) for change in batch)
+
+        async def main():
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.ensure_future(consume())
+            self._ready.set()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+        asyncio.run(main())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join()
+
+    def wait_for(self, predicate, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.05)
+        return predicate()
+
+
+def bench_changes(dsn, threads=4, calls=200):
+    """
+    Проверка потока изменений (change_feed.py): одновременные записи, в том
+    числе длинная транзакция, которая фиксируется позже более новых событий;
+    принудительный разрыв соединения подписчика; перезапуск подписчика с
+    сохраненной позиции. Все события добавленных клиентов должны прийти хотя бы
+    раз. Выводит задержку от фиксации до получения и цену записи в журнал.
+    Возвращает список нарушений
+    """
+    failures = []
+    tag = time.time_ns()
+    consumer = f"bench-{tag}"
+    with ConnectionPool(dsn, minconn=1, maxconn=threads + 2) as pool:
+        with pool.connection() as conn, _quiet():
+            number_book.create_db(conn)
+
+        collector = _FeedCollector(dsn, consumer).start()
+        committed = {}  # id клиента -> время фиксации
+        lock = threading.Lock()
+
+        def writer(index):
+            with pool.connection() as conn:
+                for i in range(calls):
+                    client_id = number_book.add_client(conn, "Поток", "Изменений", f"feed-{tag}-{index}-{i}@example.com",
+                                                       [f"+7955{index:02d}{i:05d}"])
+                    with lock:
+                        committed[client_id] = time.perf_counter()
+                    if i % 10 == 5:
+                        number_book.change_client(conn, client_id, last_name="Изменен")
+
+        def long_transaction():
+            # Событие с меньшим txid фиксируется позже событий других потоков
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("INSERT INTO clients (first_name, last_name, email) VALUES (%s, %s, %s) RETURNING id",
+                                ("Долгая", "Транзакция", f"feed-{tag}-long@example.com"))
+                    client_id = cur.fetchone()[0]
+                    time.sleep(1.0)
+                conn.commit()
+                with lock:
+                    committed[client_id] = time.perf_counter()
+
+        workers = [threading.Thread(target=long_transaction)]
+        workers += [threading.Thread(target=writer, args=(index,)) for index in range(threads)]
+        # redirect_stdout действует на все потоки, поэтому вывод подавляется здесь, а не в потоках
+        with _quiet():
+            for worker in workers:
+                worker.start()
+            time.sleep(0.5)
+            # Обрыв соединения подписчика посреди записи
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE application_name = %s",
+                                (f"change_feed:{consumer}",))
+                    terminated = cur.rowcount
+                conn.rollback()
+            for worker in workers:
+                worker.join()
+        if not terminated:
+            failures.append("не найдено соединение подписчика для разрыва")
+
+        def received_clients():
+            return {change.client_id for _, change in collector.events
+                    if change.entity == "client" and change.op == "I"}
+
+        with _quiet():
+            collector.wait_for(lambda: set(committed) <= received_clients())
+            collector.stop()
+        missing = set(committed) - received_clients()
+        if missing:
+            failures.append(f"не получены события {len(missing)} добавленных клиентов")
+        keys = [(change.txid, change.id) for _, change in collector.events]
+        duplicates = len(keys) - len(set(keys))
+        if keys != sorted(keys):
+            failures.append("события получены не в порядке позиции (txid, id)")
+
+        latencies = [(received - committed[change.client_id]) * 1000 for received, change in collector.events
+                     if change.entity == "client" and change.op == "I" and change.client_id in committed]
+
+        # Перезапуск: постоянный подписчик продолжает с сохраненной позиции
+        with pool.connection() as conn, _quiet():
+            restarted_ids = [number_book.add_client(conn, "После", "Перезапуска", f"feed-{tag}-restart-{i}@example.com")
+                             for i in range(20)]
+        restarted = _FeedCollector(dsn, consumer).start()
+        with _quiet():
+            restarted.wait_for(lambda: len(restarted.events) >= 20, timeout=5.0)
+            time.sleep(0.5)
+            restarted.stop()
+        got = [change.client_id for _, change in restarted.events if change.entity == "client"]
+        if got != restarted_ids:
+            failures.append(f"после перезапуска получено {len(got)} событий клиентов вместо {len(restarted_ids)}")
+
+        # Цена записи в журнал: add_client с триггерами журнала и без них
+        overhead = {}
+        with pool.connection() as conn:
+            for title, enabled in (("без журнала", False), ("с журналом", True)):
+                with conn.cursor() as cur:
+                    for table in ("clients", "phones"):
+                        cur.execute(f"ALTER TABLE {table} {'ENABLE' if enabled else 'DISABLE'} TRIGGER "
+                                    f"{table}_log_change")
+                conn.commit()
+                args_list = [(conn, "Цена", "Журнала", f"feed-{tag}-{title}-{i}@example.com", ["+79000000000"])
+                             for i in range(calls)]
+                overhead[title] = _latencies_ms(number_book.add_client, args_list)
+
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM clients WHERE email LIKE %s", (f"feed-{tag}-%",))
+                cur.execute("DELETE FROM phonebook_change_consumers WHERE consumer = %s", (consumer,))
+            conn.commit()
+
+    print(f"{len(committed)} клиентов из {threads} потоков и длинной транзакции, "
+          f"получено событий: {len(collector.events)}, повторов: {duplicates}")
+    print(f"от фиксации до получения: p50 {_percentile(latencies, 50):.1f} мс, p99 {_percentile(latencies, 99):.1f} мс")
+    for title, values in overhead.items():
+        print(f"add_client {title}: p50 {_percentile(values, 50):.3f} мс, p99 {_percentile(values, 99):.3f} мс")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Нарушений нет")
+    return failures
+
+
+def bench_callerid(dsn, clients=100000, lookups=1000, changes=1000):
+    """
+    Индекс определителя номера (caller_id_index.py) против запросов к базе:
+    p50/p99 точного поиска по номеру через find_client, lookup_client и файл
+    индекса; время полной и инкрементальной сборки. Проверяет, что ответы
+    индекса совпадают с базой после изменений, а читатель во время подмены
+    файла не видит ошибок. Возвращает список нарушений
+    """
+    import tempfile
+
+    import caller_id_index
+
+    _seed_clients(dsn, clients)
+    failures = []
+    rng = random.Random(7)
+    tag = time.time_ns()
+    path = os.path.join(tempfile.mkdtemp(prefix="callerid-"), "callerid.idx")
+    consumer = f"caller-id:bench-{tag}"
+
+    def expected(cur, phones):
+        cur.execute(
+            "SELECT p.phone_normalized, c.id, c.first_name || ' ' || c.last_name FROM phones p "
+            "JOIN clients c ON c.id = p.client_id WHERE p.phone_normalized = ANY(%s)",
+            (phones,)
+        )
+        result = {}
+        for phone, client_id, name in cur.fetchall():
+            result.setdefault(phone, set()).add((phone, client_id, name))
+        return result
+
+    def verify(index, cur, phones, stage):
+        truth = expected(cur, phones)
+        wrong = sum(1 for phone in phones if set(index.lookup(phone)) != truth.get(phone, set()))
+        if wrong:
+            failures.append(f"{stage}: ответ индекса не совпал с базой для {wrong} из {len(phones)} номеров")
+
+    with ConnectionPool(dsn, minconn=1, maxconn=2) as pool, pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT phone_normalized FROM phones ORDER BY random() LIMIT %s", (lookups,))
+            phones = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+
+        with _quiet():
+            full = caller_id_index.build_caller_id_index(conn, path, full=True, consumer=consumer)
+        if full is None:
+            return ["полная сборка индекса не удалась"]
+        index = caller_id_index.CallerIdIndex(path, check_interval=None)
+        with conn.cursor() as cur:
+            verify(index, cur, phones, "после полной сборки")
+        conn.rollback()
+
+        timings = [
+            ("find_client(phone)", _latencies_ms(number_book.find_client,
+                                                 [(conn, None, None, None, phone) for phone in phones])),
+            ("lookup_client(phone)", _latencies_ms(number_book.lookup_client,
+                                                   [(conn, None, None, phone) for phone in phones])),
+            ("CallerIdIndex.lookup", _latencies_ms(lambda phone: index.lookup(phone), [(phone,) for phone in phones])),
+        ]
+        conn.rollback()
+
+        # Изменения между сборками: новые клиенты, переименования, удаления
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM clients ORDER BY random() LIMIT %s", (changes,))
+            sample = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+        touched = []
+        with _quiet():
+            for i, client_id in enumerate(sample):
+                if i % 3 == 0:
+                    number_book.change_client(conn, client_id, last_name=_fake_name(rng) + "ин")
+                elif i % 3 == 1:
+                    number_book.delete_client(conn, client_id)
+                new_phone = f"+7955{tag % 1000:03d}{i:05d}"
+                number_book.add_client(conn, "Новый", "Абонент", f"callerid-{tag}-{i}@example.com", [new_phone])
+                touched.append(number_book.normalize_phone(new_phone))
+        with conn.cursor() as cur:
+            cur.execute("SELECT phone_normalized FROM phones WHERE client_id = ANY(%s)", (sample,))
+            touched += [row[0] for row in cur.fetchall()]
+        conn.rollback()
+
+        # Читатель в другом потоке ищет номера, пока файл подменяется
+        stop = threading.Event()
+        reader_errors = []
+
+        def reader():
+            own = caller_id_index.CallerIdIndex(path, check_interval=0.0)
+            while not stop.is_set():
+                try:
+                    for phone in phones[:50]:
+                        own.lookup(phone)
+                except Exception as e:
+                    reader_errors.append(e)
+                    return
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        with _quiet():
+            incremental = caller_id_index.build_caller_id_index(conn, path, consumer=consumer)
+        stop.set()
+        thread.join()
+        if reader_errors:
+            failures.append(f"ошибка читателя во время подмены файла: {reader_errors[0]}")
+        if incremental is None or incremental["mode"] != "incremental":
+            failures.append("повторная сборка не была инкрементальной")
+
+        old_records = len(index)
+        if not index.reload():
+            failures.append("reload() не заметил новый файл")
+        with conn.cursor() as cur:
+            verify(index, cur, touched + phones, "после инкрементальной сборки")
+            cur.execute("DELETE FROM clients WHERE email LIKE %s", (f"callerid-{tag}-%",))
+            cur.execute("DELETE FROM phonebook_change_consumers WHERE consumer = %s", (consumer,))
+        conn.commit()
+        index.close()
+
+    print(f"{clients} клиентов, записей в индексе: {old_records} -> {incremental and incremental['records']}, "
+          f"файл {full['bytes'] / 1048576:.1f} МБ")
+    print(f"полная сборка: {full['seconds']:.2f} с, инкрементальная ({len(sample)} клиентов изменено): "
+          f"{incremental and incremental['seconds']:.2f} с")
+    print(f"{'поиск по номеру':<22} {'p50, мс':>9} {'p99, мс':>9}")
+    for title, values in timings:
+        print(f"{title:<22} {_percentile(values, 50):>9.4f} {_percentile(values, 99):>9.4f}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Нарушений нет")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+    return failures
+
+
+def bench_multiget(dsn, sizes=(1, 100, 10000), clients=100000, runs=5, find_limit=100):
+    """
+    Получение N известных клиентов: один вызов get_clients против цикла
+    lookup_client по id и цикла find_client по email (только для N <= find_limit:
+    find_client ищет подстроку ILIKE и на больших N занял бы минуты).
+    Выводит p50 времени получения всей пачки
+    """
+    _seed_clients(dsn, clients)
+    rng = random.Random(25)
+
+    with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, email FROM clients ORDER BY random() LIMIT %s", (max(sizes),))
+            sample = cur.fetchall()
+        conn.rollback()
+
+        def timed(func):
+            result = []
+            with _quiet():
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    func()
+                    result.append((time.perf_counter() - started) * 1000)
+            conn.rollback()
+            return _percentile(result, 50)
+
+        print(f"{clients} клиентов, p50 из {runs} запусков, мс на пачку")
+        print(f"{'N':>6} {'get_clients':>12} {'lookup_client x N':>18} {'find_client x N':>16}")
+        for size in sizes:
+            batch = rng.sample(sample, min(size, len(sample)))
+            ids = [client_id for client_id, _ in batch]
+            multi = timed(lambda: number_book.get_clients(conn, ids))
+            looped = timed(lambda: [number_book.lookup_client(conn, client_id) for client_id in ids])
+            found = (timed(lambda: [number_book.find_client(conn, email=email) for _, email in batch])
+                     if size <= find_limit else None)
+            print(f"{size:>6} {multi:>12.2f} {looped:>18.2f} {f'{found:.2f}' if found is not None else '-':>16}")
+
+
+def _seed_music(conn, tracks):
+    """
+    Заполнение каталога синтетическими данными: tracks треков, альбомов и
+    исполнителей в 10 и 20 раз меньше. Таблицы каталога предварительно очищаются.
+    """
+    albums = max(10, tracks // 10)
+    artists = max(10, tracks // 20)
+    collections = max(10, tracks // 100)
+    words = "ARRAY[" + ", ".join(f"'{word}'" for word in _TITLE_WORDS) + "]"
+    # Редкое слово из трех слогов (8000 вариантов) - каждое встречается примерно в tracks / 8000 названиях
+    syllables = "ARRAY[" + ", ".join(f"'{syllable}'" for syllable in _SYLLABLES) + "]"
+    rare_word = " || ".join(
+        f"({syllables})[1 + (g::bigint * 7919 %% 8000) / {step} %% {len(_SYLLABLES)}]" for step in (1, 20, 400)
+    )
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            TRUNCATE collectiontracks, collections, albumartists, artistgenres,
+                     tracks, albums, artists, genres, year_track_stats
+            RESTART IDENTITY CASCADE
+        """)
+        cur.execute("INSERT INTO genres (name) SELECT 'Genre ' || g FROM generate_series(1, 50) g")
+        cur.execute("""
+            INSERT INTO artists (name)
+            SELECT CASE WHEN g = 1 THEN 'The Beatles'
+                        WHEN g %% 5 = 0 THEN 'Artist' || g
+                        ELSE 'The Artist ' || g END
+            FROM generate_series(1, %s) g
+        """, (artists,))
+        cur.execute("""
+            INSERT INTO albums (title, release_year)
+            SELECT 'Album ' || g, 1960 + g %% 65 FROM generate_series(1, %s) g
+        """, (albums,))
+        cur.execute(f"""
+            INSERT INTO tracks (title, duration, album_id)
+            SELECT ({words})[1 + g %% {len(_TITLE_WORDS)}] || ' ' ||
+                   ({words})[1 + (g / 7) %% {len(_TITLE_WORDS)}] || ' ' || {rare_word},
+                   60 + (g::bigint * 7919) %% 540,
+                   1 + g %% %s
+            FROM generate_series(1, %s) g
+        """, (albums, tracks))
+        cur.execute("""
+            INSERT INTO collections (title, release_year)
+            SELECT 'Collection ' || g, 1990 + g %% 35 FROM generate_series(1, %s) g
+        """, (collections,))
+        cur.execute("""
+            INSERT INTO artistgenres (genre_id, artist_id)
+            SELECT DISTINCT 1 + (a * k) %% 50, a
+            FROM generate_series(1, %s) a, (VALUES (1), (7)) v(k)
+        """, (artists,))
+        cur.execute("""
+            INSERT INTO albumartists (artist_id, album_id)
+            SELECT 1 + a %% %s, a FROM generate_series(1, %s) a
+        """, (artists, albums))
+        cur.execute("""
+            INSERT INTO collectiontracks (collection_id, track_id)
+            SELECT c, 1 + (c * 10 + k) %% %s
+            FROM generate_series(1, %s) c, generate_series(0, 9) k
+        """, (tracks, collections))
+    conn.commit()
+
+
+def _seq_scans(plan):
+    """
+    Таблицы, которые план читает последовательно (Seq Scan), по всему дереву плана
+    """
+    found = set()
+    if plan.get("Node Type") == "Seq Scan":
+        found.add(plan["Relation Name"])
+    for child in plan.get("Plans", ()):
+        found |= _seq_scans(child)
+    return found
+
+
+def bench_plans(dsn, scales=(10000, 100000, 1000000), runs=20, budget_ms=50.0,
+                scan_budget_ms=5000.0, min_rows=50000):
+    """
+    Регрессионная проверка планов и задержек запросов каталога (задания 2 и 3)
+    и поиска клиентов на синтетических данных нескольких объемов.
+
+    Для каждого вызова запоминаются выполненные запросы и их планы (EXPLAIN).
+    Ошибкой считается Seq Scan по таблице, в которой не меньше min_rows строк,
+    если запрос не читает ее целиком по смыслу (список allowed_scans), и p95
+    задержки выше бюджета: budget_ms для индексных запросов и scan_budget_ms
+    для запросов, которым разрешено полное чтение.
+
+    Таблицы каталога очищаются и заполняются заново - запускать на тестовой базе.
+    Возвращает список нарушений (пустой - проверка пройдена).
+    """
+    failures = []
+
+    for scale in scales:
+        _seed_clients(dsn, scale)
+
+        with ConnectionPool(dsn, minconn=1, maxconn=1, cursor_factory=_RecordingCursor) as pool, \
+                pool.connection() as conn:
+            with _quiet():
+                music_catalog.create_music_db(conn)
+            _seed_music(conn, scale)
+
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("ANALYZE")
+                cur.execute("""
+                    SELECT relname FROM pg_class
+                    WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= %s
+                """, (min_rows,))
+                large = {row[0] for row in cur.fetchall()}
+                cur.execute("SELECT email, phone_normalized FROM clients c JOIN phones p ON p.client_id = c.id "
+                            "ORDER BY c.id DESC LIMIT 1")
+                email, phone = cur.fetchone()
+            conn.autocommit = False
+
+            trigram = _has_trigram_indexes(conn)
+            # Без pg_trgm поиск по подстроке в find_client читает таблицы целиком
+            substring_scans = set() if trigram else {"clients", "phones"}
+
+            # (название, функция, аргументы, таблицы, которые запрос читает целиком по смыслу)
+            cases = [
+                ("2.1 longest_tracks", music_catalog.longest_tracks, (), set()),
+                ("2.2 tracks_longer_than", music_catalog.tracks_longer_than, (210,), {"tracks"}),
+                ("2.3 collections_between", music_catalog.collections_between, (2018, 2020), set()),
+                ("2.4 single_word_artists", music_catalog.single_word_artists, (), {"artists"}),
+                ("2.5 tracks_with_word", music_catalog.tracks_with_word, ("my",), {"tracks"}),
+                ("3.1 artists_per_genre", music_catalog.artists_per_genre, (), set()),
+                ("3.2 track_count_for_years", music_catalog.track_count_for_years, (2019, 2020), set()),
+                ("3.3 avg_track_duration", music_catalog.avg_track_duration_per_album, (),
+                 {"albums", "album_track_stats"}),
+                ("3.4 artists_without_albums", music_catalog.artists_without_albums_in, (2020,),
+                 {"artists", "albumartists"}),
+                ("3.5 collections_with_artist", music_catalog.collections_with_artist, ("The Beatles",), set()),
+                ("find_client email", number_book.find_client, (None, None, email[:-4]), substring_scans),
+                ("find_client phone", number_book.find_client, (None, None, None, phone[-7:]), substring_scans),
+                ("lookup_client email", number_book.lookup_client, (None, email), set()),
+                ("find_client_by_phone prefix", number_book.find_client_by_phone, (phone[:-2], True, 100), set()),
+            ]
+
+            print(f"\n{scale} треков / клиентов, большие таблицы (>= {min_rows} строк): {', '.join(sorted(large))}")
+            print(f"{'запрос':<30} {'seq scan':<28} {'p50, мс':>9} {'p95, мс':>9}  результат")
+            for title, func, args, allowed_scans in cases:
+                _RecordingCursor.statements = []
+                with _quiet():
+                    func(conn, *args)
+                conn.rollback()
+
+                scans = set()
+                with conn.cursor() as cur:
+                    for statement in _RecordingCursor.statements:
+                        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                            cur.execute("EXPLAIN (FORMAT JSON) " + statement)
+                            scans |= _seq_scans(cur.fetchone()[0][0]["Plan"])
+                conn.rollback()
+
+                latencies = _latencies_ms(func, [(conn,) + args] * runs)
+                conn.rollback()
+                p95 = _percentile(latencies, 95)
+                budget = scan_budget_ms if allowed_scans else budget_ms
+
+                problems = []
+                unexpected = (scans & large) - allowed_scans
+                if unexpected:
+                    problems.append(f"seq scan: {', '.join(sorted(unexpected))}")
+                if p95 > budget:
+                    problems.append(f"p95 {p95:.1f} мс > бюджета {budget:.0f} мс")
+                for problem in problems:
+                    failures.append(f"{scale}: {title}: {problem}")
+
+                print(f"{title:<30} {', '.join(sorted(scans)) or '-':<28} {_percentile(latencies, 50):>9.2f} "
+                      f"{p95:>9.2f}  {'❌ ' + '; '.join(problems) if problems else '✅'}")
+
+    if failures:
+        print(f"\n❌ Нарушений: {len(failures)}")
+        for failure in failures:
+            print(f"  {failure}")
+    else:
+        print("\n✅ Планы и задержки в пределах бюджета")
+    return failures
+
+
+def bench_prepared(dsn, calls=2000, clients=10000):
+    """
+    p50/p99 задержки горячих функций с подготовленными запросами (PREPARE/EXECUTE)
+    и без них: разница - разбор и планирование запроса на каждом вызове
+    """
+    _seed_clients(dsn, clients)
+    rng = random.Random(42)
+
+    with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, email FROM clients ORDER BY random() LIMIT %s", (calls,))
+            sample = cur.fetchall()
+        conn.rollback()
+
+        def make_clients():
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO clients (first_name, last_name, email) "
+                    "SELECT 'Bench', 'Prepared', 'prepared-' || %s || '-' || g || '@example.com' "
+                    "FROM generate_series(1, %s) g RETURNING id",
+                    (time.time_ns(), calls)
+                )
+                ids = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            return ids
+
+        cases = [
+            ("lookup_client", number_book.lookup_client, lambda: [(conn, cid) for cid, _ in sample]),
+            ("find_client", number_book.find_client,
+             lambda: [(conn, None, None, email) for _, email in sample]),
+            ("add_phone", number_book.add_phone,
+             lambda: [(conn, cid, f"+7 901 {i:07d}") for i, cid in enumerate(make_clients())]),
+            ("change_client", number_book.change_client,
+             lambda: [(conn, cid, None, _fake_name(rng)) for cid, _ in sample]),
+            ("delete_client", number_book.delete_client, lambda: [(conn, cid) for cid in make_clients()]),
+        ]
+
+        print(f"{calls} вызовов каждой функции, {clients} клиентов")
+        print(f"{'функция':<15} {'вариант':<10} {'p50, мс':>9} {'p99, мс':>9} {'p50, %':>8}")
+        for name, func, make_args in cases:
+            results = []
+            for title, enabled in (("текст", False), ("PREPARE", True)):
+                if enabled:
+                    prepared.enable_prepared_statements()
+                else:
+                    prepared.disable_prepared_statements()
+                latencies = _latencies_ms(func, make_args())
+                conn.rollback()
+                results.append((title, latencies))
+            base = _percentile(results[0][1], 50)
+            for title, latencies in results:
+                p50 = _percentile(latencies, 50)
+                print(f"{name:<15} {title:<10} {p50:>9.3f} {_percentile(latencies, 99):>9.3f} "
+                      f"{(p50 - base) / base * 100 if base else 0:>+8.1f}")
+        prepared.enable_prepared_statements()
+
+
+def bench_titles(dsn, scales=(1000000, 3000000), queries=50, limit=20):
+    """
+    p50/p99 поиска треков по слову в названии: запрос задания 2.5 (четыре
+    шаблона LOWER(title) LIKE) против полнотекстового search_titles с
+    GIN-индексом. Частое слово ("my") встречается примерно в каждом восьмом
+    названии, редкие - примерно в tracks / 8000.
+
+    Также проверяет запросы вида "my -слово": каждый найденный трек содержит
+    "my" и не содержит исключенного слова. Возвращает список нарушений.
+
+    Таблицы каталога очищаются и заполняются заново - запускать на тестовой базе.
+    """
+    like_query = """
+        SELECT id, title FROM tracks
+        WHERE LOWER(title) LIKE %s OR LOWER(title) LIKE %s OR LOWER(title) LIKE %s OR LOWER(title) = %s
+        LIMIT %s
+    """
+
+    def search_like(conn, word):
+        with conn.cursor() as cur:
+            cur.execute(like_query, (f"% {word} %", f"{word} %", f"% {word}", word, limit))
+            return cur.fetchall()
+
+    def search_fts(conn, word):
+        return music_catalog.search_titles(conn, word, kinds=("track",), limit=limit)
+
+    rng = random.Random(42)
+    failures = []
+    print(f"{'треков':>10} {'слова':<8} {'вариант':<22} {'p50, мс':>9} {'p99, мс':>9}")
+    for scale in scales:
+        with ConnectionPool(dsn, minconn=1, maxconn=1) as pool, pool.connection() as conn:
+            with _quiet():
+                music_catalog.create_music_db(conn)
+            _seed_music(conn, scale)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("ANALYZE tracks")
+                cur.execute(
+                    "SELECT split_part(title, ' ', 3) FROM tracks WHERE id = ANY(%s)",
+                    ([rng.randint(1, scale) for _ in range(queries)],)
+                )
+                rare = [row[0] for row in cur.fetchall()]
+            conn.autocommit = False
+
+            for words_title, words in (("частое", ["my"] * queries), ("редкие", rare)):
+                for title, func in (("LIKE, 4 шаблона", search_like), ("tsvector + GIN", search_fts)):
+                    latencies = _latencies_ms(func, [(conn, word) for word in words])
+                    conn.rollback()
+                    print(f"{scale:>10} {words_title:<8} {title:<22} {_percentile(latencies, 50):>9.2f} "
+                          f"{_percentile(latencies, 99):>9.2f}")
+
+            # Исключение должно отсекать трек во всех конфигурациях, а "my" - оставаться обязательным
+            with conn.cursor() as cur:
+                for word in rare[:10]:
+                    cur.execute(
+                        """
+                        SELECT COUNT(*),
+                               COUNT(*) FILTER (WHERE title ~* ('\m' || %(word)s || '\M')),
+                               COUNT(*) FILTER (WHERE title !~* '\mmy\M')
+                        FROM tracks
+                        WHERE title_tsv @@ music_title_tsq(%(query)s)
+                        """,
+                        {"word": word, "query": f"my -{word}"}
+                    )
+                    found, excluded, without_my = cur.fetchone()
+                    if not found or excluded or without_my:
+                        failures.append(f"{scale} треков, «my -{word}»: найдено {found}, с исключенным словом "
+                                        f"{excluded}, без «my» {without_my}")
+            conn.rollback()
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Исключения в поиске по названиям работают")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки number_book.py")
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="строка подключения к PostgreSQL")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    p = subparsers.add_parser("async", help="sync против asyncio: запросов в секунду")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    p.add_argument("--requests", type=int, default=2000)
+    p.add_argument("--pool-size", type=int, default=20)
+    p.add_argument("--clients", type=int, default=10000)
+
+    p = subparsers.add_parser("search", help="поиск по подстроке и нечеткий поиск: p50/p99")
+    p.add_argument("--scales", type=int, nargs="+", default=[10000, 1000000, 10000000])
+    p.add_argument("--queries", type=int, default=200)
+
+    p = subparsers.add_parser("writes", help="запись одним запросом против SELECT + запись")
+    p.add_argument("--calls", type=int, default=1000)
+
+    p = subparsers.add_parser("prepared", help="горячие функции с PREPARE/EXECUTE и без")
+    p.add_argument("--calls", type=int, default=2000)
+    p.add_argument("--clients", type=int, default=10000)
+
+    p = subparsers.add_parser("titles", help="поиск по названию: LIKE против полнотекстового индекса")
+    p.add_argument("--scales", type=int, nargs="+", default=[1000000, 3000000])
+    p.add_argument("--queries", type=int, default=50)
+
+    p = subparsers.add_parser("plans", help="регрессия планов (seq scan) и задержек, код возврата 1 при нарушениях")
+    p.add_argument("--scales", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p.add_argument("--runs", type=int, default=20)
+    p.add_argument("--budget-ms", type=float, default=50.0)
+    p.add_argument("--scan-budget-ms", type=float, default=5000.0)
+    p.add_argument("--min-rows", type=int, default=50000)
+
+    p = subparsers.add_parser("upsert", help="одновременный add_client с on_conflict, код возврата 1 при нарушениях")
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--emails", type=int, default=20)
+    p.add_argument("--phones", type=int, default=200, help="номеров в общем наборе на email")
+    p.add_argument("--batch", type=int, default=8, help="до стольких номеров в вызове")
+    p.add_argument("--calls", type=int, default=500, help="вызовов на поток")
+
+    p = subparsers.add_parser("replicas", help="маршрутизация чтений на реплики, код возврата 1 при нарушениях")
+    p.add_argument("--replica", action="append", default=[], help="DSN реплики, можно указать несколько раз")
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--policy", choices=("round_robin", "least_latency"), default="round_robin")
+    p.add_argument("--max-lag", type=float, default=5.0, help="допустимое отставание реплики, секунд")
+
+    p = subparsers.add_parser("partitions", help="обычные таблицы против секционированных: чтение, VACUUM, поиск")
+    p.add_argument("--clients", type=int, default=1000000)
+    p.add_argument("--partitions", type=int, default=16)
+    p.add_argument("--lookups", type=int, default=500)
+    p.add_argument("--keep", action="store_true", help="не удалять схемы bench_heap и bench_part")
+
+    p = subparsers.add_parser("changes", help="поток изменений: потери, задержка, цена журнала, код возврата 1 при нарушениях")
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--calls", type=int, default=200, help="клиентов на поток")
+
+    p = subparsers.add_parser("callerid", help="индекс определителя номера против базы, код возврата 1 при нарушениях")
+    p.add_argument("--clients", type=int, default=100000)
+    p.add_argument("--lookups", type=int, default=1000)
+    p.add_argument("--changes", type=int, default=1000, help="измененных клиентов между сборками")
+
+    p = subparsers.add_parser("multiget", help="get_clients против цикла lookup_client/find_client")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000])
+    p.add_argument("--clients", type=int, default=100000)
+    p.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args(argv)
+
+    if args.bench == "async":
+        bench_async(args.dsn, args.concurrency, args.requests, args.pool_size, args.clients)
+    elif args.bench == "search":
+        bench_search(args.dsn, args.scales, args.queries)
+    elif args.bench == "writes":
+        bench_writes(args.dsn, args.calls)
+    elif args.bench == "prepared":
+        bench_prepared(args.dsn, args.calls, args.clients)
+    elif args.bench == "titles":
+        failures = bench_titles(args.dsn, args.scales, args.queries)
+        return 1 if failures else 0
+    elif args.bench == "plans":
+        failures = bench_plans(args.dsn, args.scales, args.runs, args.budget_ms,
+                               args.scan_budget_ms, args.min_rows)
+        return 1 if failures else 0
+    elif args.bench == "replicas":
+        failures = bench_replicas(args.dsn, args.replica, args.calls, args.policy, args.max_lag)
+        return 1 if failures else 0
+    elif args.bench == "changes":
+        failures = bench_changes(args.dsn, args.threads, args.calls)
+        return 1 if failures else 0
+    elif args.bench == "callerid":
+        failures = bench_callerid(args.dsn, args.clients, args.lookups, args.changes)
+        return 1 if failures else 0
+    elif args.bench == "multiget":
+        bench_multiget(args.dsn, args.sizes, args.clients, args.runs)
+    elif args.bench == "partitions":
+        bench_partitions(args.dsn, args.clients, args.partitions, args.lookups, args.keep)
+    elif args.bench == "upsert":
+        failures = bench_upsert(args.dsn, args.threads, args.emails, args.phones, args.calls, args.batch)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
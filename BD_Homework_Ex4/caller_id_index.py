@@ -0,0 +1,395 @@
+"""
+Офлайн-индекс определителя номера: нормализованный номер -> клиент
+
+build_caller_id_index выгружает из phones и clients отсортированный по номеру
+файл-снимок, а CallerIdIndex отображает его в память (mmap) и отвечает на
+точные и префиксные запросы двоичным поиском без обращения к базе:
+
+    index = CallerIdIndex("callerid.idx")
+    index.lookup("+7 (999) 123-45-67")   # [("79991234567", 42, "Иван Петров")]
+    index.prefix("7999123", limit=10)
+
+Формат файла (little-endian):
+- заголовок HEADER: сигнатура, версия, число записей, смещение таблицы строк,
+  позиция журнала изменений (txid, id), на которой построен снимок, время сборки;
+- записи RECORD фиксированного размера, отсортированные по (номер, id клиента):
+  номер - 20 байт ASCII, дополненных нулями (как VARCHAR(20) phone_normalized),
+  id клиента, смещение и длина имени в таблице строк;
+- таблица строк: имена "Имя Фамилия" в UTF-8, одинаковые имена хранятся один раз.
+
+Повторная сборка инкрементальная: если в базе есть журнал изменений
+(миграция clients 3, см. change_feed.py), из него берутся клиенты, измененные
+после позиции снимка, и перечитываются только их номера, остальные записи
+переносятся из старого файла. Без журнала или при full=True снимок строится
+заново. Позиция снимка сохраняется в phonebook_change_consumers как позиция
+подписчика "caller-id:<имя файла>", чтобы prune_changes не удалил еще не
+учтенные события; если файл индекса больше не нужен, удалите эту строку.
+
+Новый файл пишется во временный файл рядом и подменяет старый через
+os.replace, поэтому читатели никогда не видят недописанный файл: открытое
+отображение продолжает указывать на прежний снимок, а reload() (или
+автоматическая проверка раз в check_interval секунд) переключает на новый.
+Одновременные сборки одного индекса выполняются по очереди (flock на
+path + ".lock").
+"""
+import contextlib
+import heapq
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: сборки одного индекса не должны идти одновременно
+    fcntl = None
+
+from number_book import normalize_phone
+
+MAGIC = b"PBCALLID"
+VERSION = 1
+PHONE_SIZE = 20
+
+# сигнатура, версия, число записей, смещение строк, txid и id позиции журнала, время сборки
+HEADER = struct.Struct("<8sIQQQQd")
+# номер, id клиента, смещение имени, длина имени
+RECORD = struct.Struct(f"<{PHONE_SIZE}sQII")
+
+_ROWS_SQL = """
+    SELECT p.phone_normalized, c.id, c.first_name || ' ' || c.last_name
+    FROM phones p
+    JOIN clients c ON c.id = p.client_id
+    {where}
+    ORDER BY p.phone_normalized COLLATE "C", c.id
+"""
+
+
+class _Snapshot:
+    """
+    Отображенный в память файл индекса с разобранным заголовком
+    """
+    __slots__ = ("mm", "count", "strings_offset", "watermark", "built_at", "identity")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER.size:
+                raise ValueError(f"Файл {path} не является индексом определителя номера")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+        magic, version, count, strings_offset, txid, change_id, built_at = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION or strings_offset != HEADER.size + count * RECORD.size \
+                or strings_offset > len(self.mm):
+            self.mm.close()
+            raise ValueError(f"Файл {path} не является индексом определителя номера версии {VERSION}")
+        self.count = count
+        self.strings_offset = strings_offset
+        self.watermark = (txid, change_id) if txid else None
+        self.built_at = built_at
+
+    def key(self, i):
+        offset = HEADER.size + i * RECORD.size
+        return self.mm[offset:offset + PHONE_SIZE]
+
+    def record(self, i):
+        phone, client_id, name_offset, name_size = RECORD.unpack_from(self.mm, HEADER.size + i * RECORD.size)
+        start = self.strings_offset + name_offset
+        return phone.rstrip(b"\0").decode("ascii"), client_id, self.mm[start:start + name_size].decode("utf-8")
+
+    def lower_bound(self, key):
+        """
+        Номер первой записи, ключ которой не меньше key
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+
+class CallerIdIndex:
+    """
+    Индекс определителя номера, отображенный в память (только чтение)
+
+    Можно использовать из нескольких потоков: каждый запрос работает с тем
+    снимком, который был текущим в начале запроса.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = _Snapshot(path)
+        self._checked_at = time.monotonic()
+
+    def reload(self):
+        """
+        Переключение на новый файл, если его подменила сборка; True, если файл сменился
+        """
+        self._checked_at = time.monotonic()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_dev, stat.st_ino, stat.st_mtime_ns) == self._snapshot.identity:
+            return False
+        # Прежнее отображение закроется сборщиком мусора, когда его перестанут использовать
+        self._snapshot = _Snapshot(self.path)
+        return True
+
+    def _current(self):
+        if self.check_interval is not None and time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self._snapshot
+
+    def lookup(self, phone):
+        """
+        Клиенты с номером phone (в любом формате): список кортежей (номер, id, имя)
+        """
+        try:
+            key = normalize_phone(phone).encode("ascii")
+        except ValueError:
+            return []
+        if len(key) > PHONE_SIZE:
+            return []
+        key = key.ljust(PHONE_SIZE, b"\0")
+
+        snapshot = self._current()
+        results = []
+        i = snapshot.lower_bound(key)
+        while i < snapshot.count and snapshot.key(i) == key:
+            results.append(snapshot.record(i))
+            i += 1
+        return results
+
+    def prefix(self, digits, limit=100):
+        """
+        Не больше limit записей, номер которых начинается с digits (цифры с кодом
+        страны, без нормализации 8 -> 7): список кортежей (номер, id, имя) по порядку номеров
+        """
+        key = re.sub(r"\D", "", str(digits)).encode("ascii")
+        if not key or len(key) > PHONE_SIZE:
+            return []
+
+        snapshot = self._current()
+        results = []
+        i = snapshot.lower_bound(key)
+        while i < snapshot.count and len(results) < limit and snapshot.key(i)[:len(key)] == key:
+            results.append(snapshot.record(i))
+            i += 1
+        return results
+
+    @property
+    def watermark(self):
+        return self._snapshot.watermark
+
+    @property
+    def built_at(self):
+        return self._snapshot.built_at
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def close(self):
+        self._snapshot.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _write_index(path, records, watermark):
+    """
+    Запись отсортированных записей (номер, id, имя) во временный файл и атомарная подмена path
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    # Уникальный временный файл: параллельная сборка не испортит чужой недописанный файл
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        # mkstemp создает файл с правами 0600 - читатели от другого пользователя его бы не открыли
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.fchmod(fd, mode)
+
+        names = {}  # имя -> (смещение, длина) в таблице строк
+        strings_size = 0
+        count = 0
+        with os.fdopen(fd, "wb") as f, tempfile.TemporaryFile(dir=directory) as strings:
+            f.write(bytes(HEADER.size))
+            for phone, client_id, name in records:
+                key = phone.encode("ascii")
+                if len(key) > PHONE_SIZE:
+                    # struct молча обрезал бы номер, и он нашелся бы не по тому ключу
+                    raise ValueError(f"номер '{phone}' клиента {client_id} длиннее {PHONE_SIZE} цифр")
+                location = names.get(name)
+                if location is None:
+                    encoded = name.encode("utf-8")
+                    location = names[name] = (strings_size, len(encoded))
+                    strings.write(encoded)
+                    strings_size += len(encoded)
+                f.write(RECORD.pack(key, client_id, *location))
+                count += 1
+
+            strings_offset = f.tell()
+            strings.seek(0)
+            shutil.copyfileobj(strings, f)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, count, strings_offset, *(watermark or (0, 0)), time.time()))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    # Переименование тоже должно пережить сбой питания
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return count
+
+
+@contextlib.contextmanager
+def _build_lock(path):
+    """
+    Исключительная блокировка сборки индекса (файл path + ".lock"): иначе сборка
+    из более старого снимка могла бы подменить файл после более новой
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _fetch_rows(conn, client_ids=None, batch_rows=50000):
+    """
+    Номера клиентов из базы в порядке (номер, id); client_ids=None - всех клиентов
+    """
+    where = "" if client_ids is None else "WHERE c.id = ANY(%s)"
+    # Серверный курсор: снимок миллионов номеров не держится в памяти целиком
+    with conn.cursor(name="caller_id_rows") as cur:
+        cur.itersize = batch_rows
+        cur.execute(_ROWS_SQL.format(where=where), (list(client_ids),) if client_ids is not None else None)
+        yield from cur
+
+
+def build_caller_id_index(conn, path, full=False, consumer=None, batch_rows=50000):
+    """
+    Сборка или обновление файла индекса определителя номера
+    consumer - имя подписчика журнала изменений для позиции снимка
+    (по умолчанию "caller-id:<имя файла>").
+    Возвращает словарь статистики или None при ошибке
+    """
+    consumer = consumer or f"caller-id:{os.path.basename(path)}"[:100]
+    started = time.perf_counter()
+    try:
+        # Старый файл читается под блокировкой: он же будет основой инкрементальной сборки
+        with _build_lock(path):
+            old = fetch = None
+            if not full and os.path.exists(path):
+                try:
+                    old = _Snapshot(path)
+                except ValueError as e:
+                    print(f"ℹ️ {e}, индекс будет построен заново")
+
+            conn.rollback()
+            try:
+                with conn.cursor() as cur:
+                    # Один снимок данных на все чтения: позиция журнала соответствует выгруженным строкам
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cur.execute("SELECT to_regclass('phonebook_changes') IS NOT NULL")
+                    has_log = cur.fetchone()[0]
+                    watermark = saved = None
+                    if has_log:
+                        # События транзакций старше xmin снимка уже отражены в данных
+                        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+                        watermark = (int(cur.fetchone()[0]), 0)
+                        cur.execute("SELECT txid::text, change_id FROM phonebook_change_consumers WHERE consumer = %s",
+                                    (consumer,))
+                        row = cur.fetchone()
+                        saved = (int(row[0]), row[1]) if row else None
+
+                    changed = None
+                    if old is not None and old.watermark is not None and watermark is not None:
+                        # Без сохраненной позиции события после снимка могли быть удалены prune_changes
+                        if saved is not None and saved <= old.watermark:
+                            cur.execute(
+                                "SELECT DISTINCT client_id FROM phonebook_changes WHERE (txid, id) > (%s::text::xid8, %s)",
+                                (str(old.watermark[0]), old.watermark[1])
+                            )
+                            changed = {row[0] for row in cur}
+                        else:
+                            print(f"ℹ️ Позиция журнала для {consumer} не сохранена, индекс будет построен заново")
+
+                if changed is not None:
+                    # Записи неизмененных клиентов из старого файла + свежие записи измененных
+                    kept = (record for record in old.records() if record[1] not in changed)
+                    fetch = _fetch_rows(conn, changed, batch_rows) if changed else None
+                    rows = heapq.merge(kept, fetch or (), key=lambda record: (record[0], record[1]))
+                else:
+                    fetch = rows = _fetch_rows(conn, None, batch_rows)
+
+                count = _write_index(path, rows, watermark)
+
+                if watermark is not None:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            INSERT INTO phonebook_change_consumers (consumer, txid, change_id)
+                            VALUES (%s, %s::text::xid8, %s)
+                            ON CONFLICT (consumer) DO UPDATE
+                            SET txid = EXCLUDED.txid, change_id = EXCLUDED.change_id, updated_at = CURRENT_TIMESTAMP
+                            """,
+                            (consumer, str(watermark[0]), watermark[1])
+                        )
+                conn.commit()
+            finally:
+                # Серверный курсор закрывается до отката, пока он еще действителен
+                if fetch is not None:
+                    fetch.close()
+                conn.rollback()
+                if old is not None:
+                    old.mm.close()
+
+        stats = {
+            "path": path,
+            "mode": "full" if changed is None else "incremental",
+            "records": count,
+            "changed_clients": len(changed) if changed is not None else None,
+            "bytes": os.path.getsize(path),
+            "seconds": time.perf_counter() - started,
+        }
+        if changed is None:
+            print(f"✅ Индекс определителя номера {path} построен: записей {count} за {stats['seconds']:.1f} с")
+        else:
+            print(f"✅ Индекс определителя номера {path} обновлен: изменено клиентов {len(changed)}, "
+                  f"записей {count} за {stats['seconds']:.1f} с")
+        return stats
+
+    except Exception as e:
+        print(f"❌ Ошибка при сборке индекса определителя номера: {e}")
+        return None
@@ -0,0 +1,205 @@
+"""
+Поток изменений телефонной книги для других процессов
+
+Триггеры clients и phones (миграция clients 3, number_book.CHANGE_LOG_SCHEMA)
+записывают каждое изменение в журнал phonebook_changes и будят подписчиков
+через LISTEN/NOTIFY. Подписчик читает события пачками и после обрыва
+соединения продолжает с той же позиции, поэтому индексаторам, кэшам и
+синхронизации с CRM не нужно перечитывать таблицы целиком:
+
+    async for batch in change_feed.subscribe(dsn, consumer="search-indexer"):
+        for change in batch:
+            if change.entity == "client" and change.op == "D":
+                index.remove(change.client_id)
+            else:
+                index.refresh(change.client_id)
+
+Позиция - пара (txid, id): события читаются в порядке транзакций и только из
+уже завершенных, поэтому событие транзакции, зафиксированной позже соседних,
+не теряется. Пока открыта пишущая транзакция, более новые события ждут ее
+завершения. Позиция постоянного подписчика (consumer) сохраняется в базе
+после обработки пачки: доставка "хотя бы один раз" - после сбоя во время
+обработки пачка придет повторно.
+
+Журнал растет на каждую запись; prune_changes удаляет события старше
+заданного срока, которые прочитали все постоянные подписчики.
+
+    python cli.py changes --consumer crm-sync
+"""
+import asyncio
+
+import asyncpg
+from psycopg2.extensions import parse_dsn
+
+CHANNEL = "phonebook_changes"
+
+_FETCH = """
+    SELECT id, txid::text, entity, op, client_id, value, old_value, changed_at
+    FROM phonebook_changes
+    WHERE (txid, id) > ($1::text::xid8, $2::bigint)
+      AND txid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY txid, id
+    LIMIT $3
+"""
+
+
+class Change:
+    """
+    Событие журнала: entity - "client" или "phone", op - "I", "U" или "D",
+    value - email клиента или нормализованный номер, old_value - прежнее
+    значение, если оно изменилось
+    """
+    __slots__ = ("id", "txid", "entity", "op", "client_id", "value", "old_value", "changed_at")
+
+    def __init__(self, id, txid, entity, op, client_id, value, old_value, changed_at):
+        self.id = id
+        self.txid = int(txid)
+        self.entity = entity
+        self.op = op
+        self.client_id = client_id
+        self.value = value
+        self.old_value = old_value
+        self.changed_at = changed_at
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "entity": self.entity,
+            "op": self.op,
+            "client_id": self.client_id,
+            "value": self.value,
+            "old_value": self.old_value,
+            "changed_at": self.changed_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f"Change({self.id}, {self.entity} {self.op} client {self.client_id}, {self.value!r})"
+
+
+def _connect_kwargs(dsn):
+    # asyncpg понимает только URI, поэтому строку libpq разбираем сами (как в async_number_book.py)
+    if dsn and "://" not in dsn:
+        options = parse_dsn(dsn)
+        if "dbname" in options:
+            options["database"] = options.pop("dbname")
+        return None, options
+    return dsn, {}
+
+
+async def _start_position(conn, consumer, from_start):
+    """
+    Сохраненная позиция подписчика; иначе начало журнала или текущий момент
+    """
+    if consumer is not None:
+        row = await conn.fetchrow(
+            "SELECT txid::text, change_id FROM phonebook_change_consumers WHERE consumer = $1", consumer
+        )
+        if row:
+            return int(row[0]), row[1]
+    if from_start:
+        return 0, 0
+    # События транзакций, которые еще не завершены, тоже будут прочитаны
+    xmin = await conn.fetchval("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    return int(xmin), 0
+
+
+async def _save_position(conn, consumer, position):
+    await conn.execute(
+        """
+        INSERT INTO phonebook_change_consumers (consumer, txid, change_id)
+        VALUES ($1, $2::text::xid8, $3)
+        ON CONFLICT (consumer) DO UPDATE
+        SET txid = EXCLUDED.txid, change_id = EXCLUDED.change_id, updated_at = CURRENT_TIMESTAMP
+        """,
+        consumer, str(position[0]), position[1]
+    )
+
+
+async def subscribe(dsn, consumer=None, batch_size=500, poll_interval=1.0, from_start=False,
+                    follow=True, max_backoff=30.0):
+    """
+    Асинхронный генератор пачек событий (списков Change, не больше batch_size)
+
+    consumer - имя постоянного подписчика: позиция хранится в базе, и новый
+    запуск продолжает с нее. Без consumer позиция живет в памяти (переживает
+    переподключения, но не перезапуск). Новый подписчик начинает с текущего
+    момента, при from_start=True - с начала журнала.
+    Уведомление NOTIFY будит подписчика сразу, а раз в poll_interval секунд
+    журнал проверяется и без него (события, ждавшие старой транзакции).
+    follow=False - завершиться, когда журнал прочитан до конца.
+    При обрыве соединения подписчик переподключается с паузой до max_backoff секунд.
+    """
+    uri, options = _connect_kwargs(dsn)
+    position = None
+    backoff = 0.5
+    while True:
+        try:
+            conn = await asyncpg.connect(uri, server_settings={"application_name": f"change_feed:{consumer or '-'}"},
+                                         **options)
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            print(f"❌ Поток изменений: нет соединения ({e}), повтор через {backoff:.1f} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+            continue
+
+        try:
+            wakeup = asyncio.Event()
+            await conn.add_listener(CHANNEL, lambda *args: wakeup.set())
+            if position is None:
+                position = await _start_position(conn, consumer, from_start)
+            backoff = 0.5
+
+            while True:
+                wakeup.clear()
+                rows = await conn.fetch(_FETCH, str(position[0]), position[1], batch_size)
+                if rows:
+                    batch = [Change(*row) for row in rows]
+                    yield batch
+                    # Пачка обработана - позиция сдвигается
+                    position = (batch[-1].txid, batch[-1].id)
+                    if consumer is not None:
+                        await _save_position(conn, consumer, position)
+                    if len(rows) == batch_size:
+                        continue
+                if not follow:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.AdminShutdownError, asyncpg.InterfaceError) as e:
+            print(f"❌ Поток изменений: соединение потеряно ({e}), повтор через {backoff:.1f} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+        finally:
+            if not conn.is_closed():
+                conn.terminate()
+
+
+def prune_changes(conn, retention_seconds=86400):
+    """
+    Удаление событий старше retention_seconds, уже прочитанных всеми
+    постоянными подписчиками; возвращает число удаленных событий
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM phonebook_changes
+                WHERE changed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM phonebook_change_consumers s
+                      WHERE (s.txid, s.change_id) < (phonebook_changes.txid, phonebook_changes.id)
+                  )
+                """,
+                (retention_seconds,)
+            )
+            deleted = cur.rowcount
+        conn.commit()
+        print(f"✅ Удалено событий журнала изменений: {deleted}")
+        return deleted
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при очистке журнала изменений: {e}")
+        return 0
@@ -0,0 +1,507 @@
+"""
+Командная строка телефонной книги для скриптов, cron и конвейеров
+
+Параметры подключения берутся из --dsn или переменной окружения
+NUMBER_BOOK_DSN. Данные читаются и выводятся в формате NDJSON (один JSON
+объект на строку), сообщения функций number_book.py идут в stderr
+(или отключаются ключом --quiet).
+
+    python cli.py migrate --music
+    python cli.py migrate --status
+    python cli.py import clients.csv
+    cat clients.ndjson | python cli.py add --batch - --atomic
+    python cli.py find --last-name Иванов
+    python cli.py find --id 10 --id 11 --id 12
+    python cli.py export > clients.ndjson
+    python cli.py export --format csv --compression gzip --workers 4 -o clients.csv.gz
+    python cli.py delete --id 10 --id 11
+    python cli.py changes --consumer crm-sync
+    python cli.py callerid callerid.idx --build
+    python cli.py callerid callerid.idx --phone "+7 999 123-45-67"
+    python cli.py bench prepared --calls 500
+
+Коды возврата: 0 - успех, 1 - ошибка (подключение, SQL, отмененная
+атомарная пачка), 2 - неверные аргументы, 3 - часть записей пачки не
+обработана, 4 - ничего не найдено, 130 - прервано Ctrl+C. Для changes,
+который читает поток до Ctrl+C, это штатная остановка с кодом 0: позиция
+подписчика сохраняется после каждой выведенной пачки.
+
+Драйвер PostgreSQL и number_book импортируются только при выполнении команды,
+поэтому --help и разбор аргументов не ждут загрузки psycopg2.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_PARTIAL = 3
+EXIT_NOT_FOUND = 4
+EXIT_INTERRUPTED = 130
+
+DEFAULT_DSN = "dbname=clients user=postgres host=localhost port=5432"
+
+
+class _Output:
+    """
+    Вывод результатов в NDJSON (stdout сохраняется до перенаправления сообщений)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def emit(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.stream.flush()
+
+
+def _connect(args):
+    import psycopg2
+
+    from instrumentation import InstrumentedConnection
+
+    try:
+        return psycopg2.connect(args.dsn, connection_factory=InstrumentedConnection)
+    except psycopg2.Error as e:
+        print(f"❌ Ошибка подключения к базе данных: {e}")
+        return None
+
+
+def _open_input(path):
+    return contextlib.nullcontext(sys.stdin) if path == "-" else open(path, encoding="utf-8")
+
+
+def _read_ndjson(stream):
+    """
+    Пары (номер строки, объект или исключение разбора); пустые строки пропускаются
+    """
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, e
+
+
+def _phones_list(phones):
+    return [] if not phones or phones == "нет телефона" else phones.split(", ")
+
+
+def _client_record(row):
+    client_id, first_name, last_name, email, phones = row[:5]
+    return {"id": client_id, "first_name": first_name, "last_name": last_name,
+            "email": email, "phones": _phones_list(phones)}
+
+
+def _run_batch(conn, stream, apply, atomic, out):
+    """
+    Выполнение пачки операций из NDJSON в одной транзакции
+
+    atomic=True - первая ошибка отменяет всю пачку (код 1), иначе каждая
+    запись выполняется в своей точке сохранения и ошибочные записи
+    пропускаются (код 3). По каждой записи выводится строка с результатом.
+    """
+    import psycopg2
+
+    failed = 0
+    done = []
+    with conn.cursor() as cur:
+        for line_no, item in _read_ndjson(stream):
+            if isinstance(item, Exception):
+                error = f"некорректный JSON: {item}"
+            else:
+                if not atomic:
+                    cur.execute("SAVEPOINT batch_item")
+                try:
+                    result = apply(cur, item)
+                    if not atomic:
+                        cur.execute("RELEASE SAVEPOINT batch_item")
+                    done.append(item)
+                    out.emit({"line": line_no, "ok": True, **result})
+                    continue
+                except (psycopg2.Error, KeyError, TypeError, ValueError) as e:
+                    if not atomic and not conn.closed:
+                        cur.execute("ROLLBACK TO SAVEPOINT batch_item")
+                    error = getattr(getattr(e, "diag", None), "message_primary", None) or str(e)
+
+            failed += 1
+            out.emit({"line": line_no, "ok": False, "error": error})
+            if atomic:
+                conn.rollback()
+                print(f"❌ Пачка отменена: ошибка в строке {line_no}")
+                return EXIT_ERROR, []
+
+    conn.commit()
+    print(f"✅ Обработано записей: {len(done)}, с ошибками: {failed}")
+    return (EXIT_PARTIAL if failed else EXIT_OK), done
+
+
+def cmd_migrate(args, out):
+    import migrations
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        if args.status:
+            for record in migrations.migration_status(conn):
+                out.emit(record)
+            return EXIT_OK
+        components = ("clients", "music") if args.music else ("clients",)
+        applied = migrations.migrate(conn, components, retry_skipped=args.retry_skipped)
+        if applied is None:
+            return EXIT_ERROR
+        for component, version, name in applied:
+            out.emit({"component": component, "version": version, "name": name})
+        if args.partitions:
+            import partitioning
+
+            stats = partitioning.migrate_to_partitioned(conn, args.partitions, args.batch_rows,
+                                                        drop_legacy=args.drop_legacy)
+            if stats is None:
+                return EXIT_ERROR
+            out.emit({"component": "clients", "layout": "partitioned", **stats})
+        return EXIT_OK
+    finally:
+        conn.close()
+
+
+def cmd_import(args, out):
+    import number_book
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        if args.source == "-":
+            source = (item for _, item in _read_ndjson(sys.stdin) if not isinstance(item, Exception))
+        else:
+            source = args.source
+        stats = number_book.import_clients(conn, source, chunk_size=args.chunk_size)
+        out.emit(stats)
+        return EXIT_PARTIAL if stats["rejected"] or stats["invalid"] or stats["invalid_phones"] else EXIT_OK
+    except OSError as e:
+        print(f"❌ Не удалось прочитать {args.source}: {e}")
+        return EXIT_ERROR
+    finally:
+        conn.close()
+
+
+def cmd_export(args, out):
+    import export
+
+    if args.workers > 1:
+        if args.output == "-":
+            print("❌ Параллельная выгрузка пишет в файлы, укажите -o")
+            return EXIT_USAGE
+        results = export.export_clients_parallel(args.dsn, args.output, args.workers, args.format,
+                                                 args.compression, args.page_size)
+        return EXIT_OK if results is not None else EXIT_ERROR
+
+    if args.output == "-" and args.format == "parquet":
+        print("❌ Parquet выгружается в каталог, укажите -o")
+        return EXIT_USAGE
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        target = out.stream.buffer if args.output == "-" else args.output
+        result = export.export_clients(conn, target, args.format, args.compression, args.page_size,
+                                       low=args.after_id or None)
+        if result is None:
+            return EXIT_ERROR
+        print(f"✅ Выгружено клиентов: {result['rows']}, последний id: {result['last_id']}")
+        return EXIT_OK
+    finally:
+        conn.close()
+
+
+def cmd_find(args, out):
+    import number_book
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        if args.exact or args.id:
+            if args.first_name or args.last_name:
+                print("❌ Точный поиск возможен только по --id, --email или --phone")
+                return EXIT_USAGE
+            if not args.id and args.email is None and args.phone is None:
+                print("❌ Для точного поиска укажите --id, --email или --phone")
+                return EXIT_USAGE
+            if args.id:
+                # Все id одним запросом, телефоны уже списком
+                clients = number_book.get_clients(conn, args.id)
+                for client in clients:
+                    out.emit(client.as_dict())
+                return EXIT_OK if clients else EXIT_NOT_FOUND
+            results = number_book.lookup_client(conn, email=args.email, phone=args.phone)
+        else:
+            results = number_book.find_client(conn, args.first_name, args.last_name, args.email, args.phone)
+        for row in results:
+            out.emit(_client_record(row))
+        return EXIT_OK if results else EXIT_NOT_FOUND
+    except ValueError as e:
+        print(f"❌ {e}")
+        return EXIT_USAGE
+    finally:
+        conn.close()
+
+
+def cmd_add(args, out):
+    import number_book
+
+    if not args.batch and not (args.first_name and args.last_name and args.email):
+        print("❌ Нужны --first-name, --last-name и --email или --batch")
+        return EXIT_USAGE
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        if not args.batch:
+            client_id = number_book.add_client(conn, args.first_name, args.last_name, args.email, args.phone,
+                                               on_conflict=args.on_conflict)
+            if client_id is None:
+                return EXIT_ERROR
+            out.emit({"id": client_id})
+            return EXIT_OK
+
+        def apply(cur, item):
+            first_name, last_name, email, phones = number_book._client_tuple(item)
+            if not (first_name and last_name and email):
+                raise ValueError("нужны first_name, last_name и email")
+            if args.on_conflict is None:
+                return {"id": number_book._insert_client(cur, first_name, last_name, email, phones)}
+            client_id, created = number_book._upsert_client(cur, first_name, last_name, email, args.on_conflict)
+            number_book._merge_phones(cur, client_id, phones)
+            return {"id": client_id, "created": created}
+
+        with _open_input(args.batch) as stream:
+            code, done = _run_batch(conn, stream, apply, args.atomic, out)
+        number_book._invalidate_cache(phones=[phone for item in done
+                                              for phone in number_book._client_tuple(item)[3]])
+        return code
+    finally:
+        conn.close()
+
+
+def cmd_delete(args, out):
+    import number_book
+
+    if not args.batch and not args.id:
+        print("❌ Нужен --id или --batch")
+        return EXIT_USAGE
+
+    conn = _connect(args)
+    if conn is None:
+        return EXIT_ERROR
+    try:
+        if not args.batch:
+            missing = 0
+            for client_id in args.id:
+                if number_book.delete_client(conn, client_id):
+                    out.emit({"id": client_id, "ok": True})
+                else:
+                    missing += 1
+                    out.emit({"id": client_id, "ok": False})
+            if missing == len(args.id):
+                return EXIT_NOT_FOUND
+            return EXIT_PARTIAL if missing else EXIT_OK
+
+        def apply(cur, item):
+            client_id = int(item["id"] if isinstance(item, dict) else item)
+            if number_book._delete_client(cur, client_id) is None:
+                raise ValueError(f"клиент с ID {client_id} не найден")
+            return {"id": client_id}
+
+        with _open_input(args.batch) as stream:
+            code, done = _run_batch(conn, stream, apply, args.atomic, out)
+        number_book._invalidate_cache([int(item["id"] if isinstance(item, dict) else item) for item in done])
+        return code
+    finally:
+        conn.close()
+
+
+def cmd_changes(args, out):
+    import asyncio
+
+    import change_feed
+
+    if args.prune is not None:
+        conn = _connect(args)
+        if conn is None:
+            return EXIT_ERROR
+        try:
+            out.emit({"pruned": change_feed.prune_changes(conn, args.prune * 3600)})
+            return EXIT_OK
+        finally:
+            conn.close()
+
+    async def follow():
+        async for batch in change_feed.subscribe(args.dsn, args.consumer, args.batch_size,
+                                                 from_start=args.from_start, follow=not args.once):
+            for change in batch:
+                out.emit(change.as_dict())
+
+    try:
+        asyncio.run(follow())
+    except KeyboardInterrupt:
+        # Ctrl+C - обычный способ остановить чтение потока
+        pass
+    return EXIT_OK
+
+
+def cmd_callerid(args, out):
+    import caller_id_index
+
+    if args.build:
+        conn = _connect(args)
+        if conn is None:
+            return EXIT_ERROR
+        try:
+            stats = caller_id_index.build_caller_id_index(conn, args.path, full=args.full)
+        finally:
+            conn.close()
+        if stats is None:
+            return EXIT_ERROR
+        out.emit(stats)
+        return EXIT_OK
+
+    if args.phone is None and args.prefix is None:
+        print("❌ Укажите --build, --phone или --prefix")
+        return EXIT_USAGE
+    # Поиск идет только по файлу индекса, без подключения к базе
+    try:
+        index = caller_id_index.CallerIdIndex(args.path, check_interval=None)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return EXIT_ERROR
+    with index:
+        if args.phone is not None:
+            results = index.lookup(args.phone)
+        else:
+            results = index.prefix(args.prefix, args.limit)
+        for phone, client_id, name in results:
+            out.emit({"phone": phone, "id": client_id, "name": name})
+    return EXIT_OK if results else EXIT_NOT_FOUND
+
+
+def cmd_bench(args, out):
+    import benchmarks
+
+    with contextlib.redirect_stdout(out.stream):
+        return benchmarks.main(["--dsn", args.dsn] + args.bench_args) or EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Телефонная книга на PostgreSQL: командная строка")
+    parser.add_argument("--dsn", default=os.environ.get("NUMBER_BOOK_DSN", DEFAULT_DSN),
+                        help="строка подключения (по умолчанию из NUMBER_BOOK_DSN)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не выводить сообщения в stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("migrate", help="создать или обновить структуру базы данных")
+    p.add_argument("--music", action="store_true", help="также схема музыкального каталога")
+    p.add_argument("--status", action="store_true", help="только вывести состояние миграций")
+    p.add_argument("--retry-skipped", action="store_true",
+                   help="повторить необязательные миграции, пропущенные ранее (например, без pg_trgm)")
+    p.add_argument("--partitions", type=int,
+                   help="перевести clients и phones на секционирование по хешу id с этим числом секций (без остановки записи)")
+    p.add_argument("--batch-rows", type=int, default=50000, help="порция переноса строк при --partitions")
+    p.add_argument("--drop-legacy", action="store_true", help="удалить старые таблицы после перехода")
+    p.set_defaults(handler=cmd_migrate)
+
+    p = subparsers.add_parser("import", help="массовый импорт клиентов из CSV/JSONL или NDJSON из stdin")
+    p.add_argument("source", help="путь к .csv/.jsonl или - для stdin")
+    p.add_argument("--chunk-size", type=int, default=10000)
+    p.set_defaults(handler=cmd_import)
+
+    p = subparsers.add_parser("export", help="потоковая выгрузка клиентов (COPY), по умолчанию NDJSON")
+    p.add_argument("-o", "--output", default="-",
+                   help="файл (по умолчанию stdout); прерванная выгрузка в файл продолжается при повторном запуске")
+    p.add_argument("--format", choices=("ndjson", "csv", "parquet"), default="ndjson")
+    p.add_argument("--compression", choices=("gzip", "zstd"))
+    p.add_argument("--workers", type=int, default=1, help="параллельная выгрузка частями в несколько файлов")
+    p.add_argument("--after-id", type=int, default=0, help="выгружать клиентов с id больше этого")
+    p.add_argument("--page-size", type=int, default=100000, help="клиентов в одной порции COPY")
+    p.set_defaults(handler=cmd_export)
+
+    p = subparsers.add_parser("find", help="поиск клиентов, результат в NDJSON")
+    p.add_argument("--id", type=int, action="append", help="можно указать несколько раз")
+    p.add_argument("--first-name")
+    p.add_argument("--last-name")
+    p.add_argument("--email")
+    p.add_argument("--phone")
+    p.add_argument("--exact", action="store_true", help="точное совпадение по email или телефону (--id ищет точно всегда)")
+    p.set_defaults(handler=cmd_find)
+
+    p = subparsers.add_parser("add", help="добавление клиента или пачки клиентов")
+    p.add_argument("--first-name")
+    p.add_argument("--last-name")
+    p.add_argument("--email")
+    p.add_argument("--phone", action="append", default=[], help="можно указать несколько раз")
+    p.add_argument("--batch", help="NDJSON файл или - для stdin")
+    p.add_argument("--atomic", action="store_true", help="вся пачка в одной транзакции без частичных успехов")
+    p.add_argument("--on-conflict", choices=("nothing", "update"),
+                   help="если email уже есть: оставить клиента или обновить имя; телефоны объединяются")
+    p.set_defaults(handler=cmd_add)
+
+    p = subparsers.add_parser("delete", help="удаление клиентов по id")
+    p.add_argument("--id", type=int, action="append", help="можно указать несколько раз")
+    p.add_argument("--batch", help='NDJSON ({"id": N} или N на строку), - для stdin')
+    p.add_argument("--atomic", action="store_true", help="вся пачка в одной транзакции без частичных успехов")
+    p.set_defaults(handler=cmd_delete)
+
+    p = subparsers.add_parser("changes", help="поток изменений клиентов и телефонов в NDJSON (до Ctrl+C)")
+    p.add_argument("--consumer", help="имя подписчика: позиция сохраняется в базе и продолжается при перезапуске")
+    p.add_argument("--from-start", action="store_true", help="новый подписчик читает журнал с начала")
+    p.add_argument("--once", action="store_true", help="завершиться, прочитав журнал до конца")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.add_argument("--prune", type=float, metavar="HOURS",
+                   help="удалить события старше HOURS часов, прочитанные всеми подписчиками")
+    p.set_defaults(handler=cmd_changes)
+
+    p = subparsers.add_parser("callerid", help="офлайн-индекс определителя номера: сборка и поиск без базы")
+    p.add_argument("path", help="файл индекса")
+    p.add_argument("--build", action="store_true", help="построить или обновить индекс (по журналу изменений)")
+    p.add_argument("--full", action="store_true", help="с --build: построить заново, не используя старый файл")
+    p.add_argument("--phone", help="клиенты с этим номером")
+    p.add_argument("--prefix", help="номера, начинающиеся с этих цифр")
+    p.add_argument("--limit", type=int, default=100)
+    p.set_defaults(handler=cmd_callerid)
+
+    p = subparsers.add_parser("bench", help="бенчмарки (аргументы передаются в benchmarks.py)")
+    p.add_argument("bench_args", nargs=argparse.REMAINDER)
+    p.set_defaults(handler=cmd_bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = _Output(sys.stdout)
+
+    # Сообщения функций (print) уходят в stderr, чтобы не смешиваться с NDJSON
+    messages = open(os.devnull, "w") if args.quiet else sys.stderr
+    try:
+        with contextlib.redirect_stdout(messages):
+            return args.handler(args, out)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        print(f"❌ Ошибка: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        if args.quiet:
+            messages.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
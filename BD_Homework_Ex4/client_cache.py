@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ClientCache:
+    """
+    LRU-кэш записей клиентов с ограничением по времени жизни (TTL)
+
+    Ключи: ("id", client_id), ("email", email) и ("phone", нормализованный номер).
+    По ключу ("id", ...) хранится сама запись клиента, по email и телефону -
+    кортеж id клиентов, записи которых берутся из того же кэша. Общее число
+    ключей не превышает max_size: при переполнении вытесняется давно не
+    использованный ключ.
+
+    Инвалидация точная: invalidate_client удаляет запись клиента и все ключи,
+    которые на нее ссылаются, invalidate_phone - результат поиска по номеру.
+
+    Чтение через кэш не атомарно: между промахом get и put запрос к базе мог
+    прочитать данные, которые другой поток уже изменил и инвалидировал. Поэтому
+    каждая инвалидация запоминает для ключа номер поколения, get возвращает
+    текущее поколение, а put не сохраняет результат, если какой-либо из его
+    ключей был инвалидирован после этого поколения.
+    """
+
+    def __init__(self, max_size=10000, ttl=60.0):
+        if max_size < 1:
+            raise ValueError("Размер кэша должен быть положительным")
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # ключ -> (срок годности, значение)
+        self._refs = {}  # id клиента -> множество ключей email/phone, ссылающихся на него
+        self._lock = threading.Lock()
+
+        self._generation = 0
+        self._invalidated = {}  # ключ -> поколение последней инвалидации
+        # Поколение, до которого инвалидированным считается любой ключ (clear и
+        # сброс _invalidated при переполнении)
+        self._floor = 0
+        self.stale_puts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        """
+        Удаление ключа вместе с обратными ссылками (под блокировкой)
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        kind, value = key
+        if kind == "id":
+            for ref in self._refs.pop(value, ()):
+                self._remove(ref)
+        else:
+            for client_id in entry[1]:
+                refs = self._refs.get(client_id)
+                if refs is not None:
+                    refs.discard(key)
+        return True
+
+    def _lookup(self, key, now):
+        """
+        Значение по ключу с учетом TTL (под блокировкой)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key):
+        """
+        Кортеж (список записей клиентов по ключу или None, если в кэше их нет; поколение)
+
+        Поколение передается в put вместе с результатом, прочитанным из базы
+        """
+        now = time.monotonic()
+        with self._lock:
+            value = self._lookup(key, now)
+            if value is not None and key[0] != "id":
+                records = [self._lookup(("id", client_id), now) for client_id in value]
+                value = None if any(record is None for record in records) else records
+            elif value is not None:
+                value = [value]
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value, self._generation
+
+    def _invalidated_since(self, key, generation):
+        """
+        Был ли ключ инвалидирован после поколения generation (под блокировкой)
+        """
+        return generation < self._floor or self._invalidated.get(key, -1) >= generation
+
+    def _bump(self, key):
+        """
+        Отметка инвалидации ключа новым поколением (под блокировкой)
+        """
+        if len(self._invalidated) >= self.max_size:
+            # Отметки не копятся бесконечно: все более ранние результаты
+            # считаются устаревшими, что лишь пропускает несколько put
+            self._floor = self._generation + 1
+            self._invalidated.clear()
+        self._invalidated[key] = self._generation
+        self._generation += 1
+
+    def put(self, key, records, generation):
+        """
+        Сохранение результата поиска по ключу; records - кортежи, где [0] - id клиента,
+        generation - поколение из get, вызванного перед чтением records из базы
+        """
+        if not records:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            keys = [key] + [("id", record[0]) for record in records]
+            if any(self._invalidated_since(k, generation) for k in keys):
+                # Запись изменилась, пока шел запрос: в кэш попали бы старые данные
+                self.stale_puts += 1
+                return
+            for record in records:
+                self._store(("id", record[0]), (expires, record))
+            if key[0] != "id":
+                ids = tuple(record[0] for record in records)
+                self._store(key, (expires, ids))
+                for client_id in ids:
+                    self._refs.setdefault(client_id, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _store(self, key, entry):
+        if key in self._entries and key[0] != "id":
+            self._remove(key)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+    def invalidate_client(self, client_id):
+        """
+        Удаление записи клиента и всех ключей email/phone, которые на нее ссылаются
+        """
+        with self._lock:
+            self._bump(("id", client_id))
+            if self._remove(("id", client_id)):
+                self.invalidations += 1
+
+    def invalidate_phone(self, normalized_phone):
+        """
+        Удаление результата поиска по номеру (например, номер появился у другого клиента)
+        """
+        with self._lock:
+            self._bump(("phone", normalized_phone))
+            if self._remove(("phone", normalized_phone)):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._refs.clear()
+            self._invalidated.clear()
+            self._floor = self._generation = self._generation + 1
+
+    def stats(self):
+        """
+        Счетчики кэша: попадания, промахи, вытеснения, истечения TTL, инвалидации,
+        отброшенные устаревшие результаты, размер
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
@@ -0,0 +1,293 @@
+"""
+Генератор синтетических данных для телефонной книги и музыкального каталога
+
+Данные детерминированы: одинаковые seed и размеры дают одинаковое содержимое.
+Строки формируются на лету и передаются в PostgreSQL через COPY FROM STDIN,
+поэтому память не зависит от объема (от десятков тысяч до сотен миллионов строк).
+Идентификаторы задаются явно, после загрузки последовательности сдвигаются.
+
+Запуск:
+    python data_generator.py --dsn "dbname=clients user=postgres" --clients 1000000
+    python data_generator.py --dsn "..." --tracks 10000000 --truncate --seed 7
+"""
+import argparse
+import io
+import os
+import random
+import time
+
+import psycopg2
+
+import music_catalog
+import number_book
+from number_book import _copy_value, normalize_phone
+
+DEFAULT_DSN = os.environ.get("NUMBER_BOOK_DSN", "dbname=clients user=postgres host=localhost port=5432")
+
+# (имя, транслитерация для email)
+FIRST_NAMES = [
+    ("Александр", "alexander"), ("Дмитрий", "dmitry"), ("Максим", "maxim"), ("Сергей", "sergey"),
+    ("Андрей", "andrey"), ("Алексей", "alexey"), ("Иван", "ivan"), ("Михаил", "mikhail"),
+    ("Никита", "nikita"), ("Егор", "egor"), ("Анна", "anna"), ("Мария", "maria"),
+    ("Елена", "elena"), ("Ольга", "olga"), ("Наталья", "natalia"), ("Татьяна", "tatiana"),
+    ("Екатерина", "ekaterina"), ("Анастасия", "anastasia"), ("Ирина", "irina"), ("Дарья", "daria"),
+]
+LAST_NAMES = [
+    ("Иванов", "ivanov"), ("Смирнов", "smirnov"), ("Кузнецов", "kuznetsov"), ("Попов", "popov"),
+    ("Васильев", "vasiliev"), ("Петров", "petrov"), ("Соколов", "sokolov"), ("Михайлов", "mikhailov"),
+    ("Новиков", "novikov"), ("Федоров", "fedorov"), ("Морозов", "morozov"), ("Волков", "volkov"),
+    ("Алексеев", "alekseev"), ("Лебедев", "lebedev"), ("Семенов", "semenov"), ("Егоров", "egorov"),
+    ("Павлов", "pavlov"), ("Козлов", "kozlov"), ("Степанов", "stepanov"), ("Николаев", "nikolaev"),
+]
+EMAIL_DOMAINS = ["example.com", "mail.example.org", "inbox.example.net", "corp.example.ru"]
+PHONE_FORMATS = ["+7 {a} {b}-{c}-{d}", "8 ({a}) {b}-{c}-{d}", "+7{a}{b}{c}{d}", "8-{a}-{b}-{c}{d}"]
+
+GENRES = ["Rock", "Pop", "Hip-Hop", "Jazz", "Electronic", "Classical", "Blues", "Metal", "Folk",
+          "Reggae", "Soul", "Funk", "Country", "Punk", "Indie", "R&B", "Techno", "House",
+          "Ambient", "Шансон", "Русский рок", "Поп-музыка", "Авторская песня", "Эстрада"]
+TITLE_WORDS = [
+    "my", "love", "night", "song", "blue", "dream", "heart", "fire", "city", "rain", "road",
+    "home", "light", "summer", "winter", "time", "world", "dance", "star", "sky", "river",
+    "мой", "ночь", "песня", "любовь", "город", "дождь", "небо", "дорога", "лето", "зима",
+    "свет", "время", "звезда", "река", "дом", "танец", "мир", "сердце", "ветер", "море",
+]
+_SYLLABLES = ["ka", "lo", "mi", "va", "ne", "ro", "tu", "sa", "di", "ko", "re", "na",
+              "li", "bo", "she", "go", "in", "ov", "ev", "an"]
+
+
+class _RowStream(io.TextIOBase):
+    """
+    Файлоподобный объект для copy_expert: строки COPY берутся из генератора по мере чтения
+    """
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ""
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = "\t".join(_copy_value(value) for value in row) + "\n"
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+            if 0 <= size <= length:
+                break
+        data = "".join(parts)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _copy(cur, table, columns, rows):
+    """
+    Потоковая загрузка строк в таблицу; возвращает число загруженных строк
+    """
+    stream = _RowStream(rows)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=1 << 16)
+    return stream.count
+
+
+def _reset_sequence(cur, table):
+    cur.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+    )
+
+
+def _next_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+
+def _phone(rng):
+    digits = f"{rng.randrange(900, 1000)}{rng.randrange(10 ** 7):07d}"
+    return rng.choice(PHONE_FORMATS).format(a=digits[:3], b=digits[3:6], c=digits[6:8], d=digits[8:])
+
+
+def _word(rng):
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _title(rng, words=(1, 4)):
+    parts = [rng.choice(TITLE_WORDS) if rng.random() < 0.7 else _word(rng)
+             for _ in range(rng.randint(*words))]
+    return " ".join(parts).capitalize()
+
+
+def generate_clients(conn, count, seed=42, max_phones=3, truncate=False):
+    """
+    Загрузка count синтетических клиентов и их телефонов (от 0 до max_phones)
+
+    Новые клиенты получают id после уже существующих, email уникален за счет id.
+    Возвращает словарь {"clients", "phones", "seconds", "rows_per_second"}
+    """
+    stats = {"clients": 0, "phones": 0, "seconds": 0.0, "rows_per_second": 0.0}
+    started = time.perf_counter()
+
+    try:
+        with conn.cursor() as cur:
+            if truncate:
+                cur.execute("TRUNCATE phones, clients RESTART IDENTITY CASCADE")
+            first_id = _next_id(cur, "clients")
+            first_phone_id = _next_id(cur, "phones")
+
+            def client_rows():
+                rng = random.Random(seed)
+                for client_id in range(first_id, first_id + count):
+                    first, first_latin = rng.choice(FIRST_NAMES)
+                    last, last_latin = rng.choice(LAST_NAMES)
+                    email = f"{first_latin}.{last_latin}.{client_id}@{rng.choice(EMAIL_DOMAINS)}"
+                    yield client_id, first, last, email
+
+            def phone_rows():
+                # Отдельный поток случайных чисел: телефоны не зависят от порядка чтения клиентов
+                rng = random.Random(seed + 1)
+                phone_id = first_phone_id
+                for client_id in range(first_id, first_id + count):
+                    seen = set()
+                    for _ in range(rng.randint(0, max_phones)):
+                        phone = _phone(rng)
+                        normalized = normalize_phone(phone)
+                        if normalized in seen:
+                            continue
+                        seen.add(normalized)
+                        yield phone_id, client_id, phone, normalized
+                        phone_id += 1
+
+            stats["clients"] = _copy(cur, "clients", ("id", "first_name", "last_name", "email"), client_rows())
+            stats["phones"] = _copy(cur, "phones", ("id", "client_id", "phone_number", "phone_normalized"),
+                                    phone_rows())
+            _reset_sequence(cur, "clients")
+            _reset_sequence(cur, "phones")
+        conn.commit()
+        if number_book._client_cache is not None:
+            number_book._client_cache.clear()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при генерации клиентов: {e}")
+        return stats
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["rows_per_second"] = (stats["clients"] + stats["phones"]) / max(stats["seconds"], 1e-9)
+    print(f"✅ Сгенерировано клиентов: {stats['clients']}, телефонов: {stats['phones']} "
+          f"({stats['rows_per_second']:.0f} строк/сек)")
+    return stats
+
+
+def generate_music(conn, tracks, seed=42, truncate=False):
+    """
+    Загрузка синтетического каталога из tracks треков
+
+    Остальные объемы выводятся из числа треков: альбомов в 10 раз меньше
+    (по 10 треков в среднем), исполнителей в 20 раз меньше, сборников в 100 раз
+    меньше (по 10-20 треков). Триггеры сводных таблиц на время загрузки
+    отключаются, сводные таблицы пересчитываются в конце одним запросом.
+    Возвращает словарь с числом строк по таблицам и временем загрузки
+    """
+    albums = max(1, tracks // 10)
+    artists = max(1, tracks // 20)
+    collections = max(1, tracks // 100)
+    stats = {}
+    started = time.perf_counter()
+
+    try:
+        with conn.cursor() as cur:
+            if truncate:
+                cur.execute("""
+                    TRUNCATE collectiontracks, collections, albumartists, artistgenres,
+                             tracks, albums, artists, genres, year_track_stats
+                    RESTART IDENTITY CASCADE
+                """)
+            for table in ("artistgenres", "tracks", "albums"):
+                cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+
+            genre_id = _next_id(cur, "genres")
+            artist_id = _next_id(cur, "artists")
+            album_id = _next_id(cur, "albums")
+            track_id = _next_id(cur, "tracks")
+            collection_id = _next_id(cur, "collections")
+            genre_ids = range(genre_id, genre_id + len(GENRES))
+            artist_ids = range(artist_id, artist_id + artists)
+            album_ids = range(album_id, album_id + albums)
+            track_ids = range(track_id, track_id + tracks)
+            collection_ids = range(collection_id, collection_id + collections)
+
+            rng = random.Random(seed)
+            stats["genres"] = _copy(cur, "genres", ("id", "name"), zip(genre_ids, GENRES))
+            stats["artists"] = _copy(cur, "artists", ("id", "name"), (
+                (i, _title(rng, (1, 3))) for i in artist_ids
+            ))
+            stats["albums"] = _copy(cur, "albums", ("id", "title", "release_year"), (
+                (i, _title(rng), rng.randint(1960, 2025)) for i in album_ids
+            ))
+            stats["tracks"] = _copy(cur, "tracks", ("id", "title", "duration", "album_id"), (
+                (i, _title(rng), int(rng.triangular(60, 900, 220)), rng.choice(album_ids)) for i in track_ids
+            ))
+            stats["collections"] = _copy(cur, "collections", ("id", "title", "release_year"), (
+                (i, _title(rng), rng.randint(1990, 2025)) for i in collection_ids
+            ))
+
+            def links(ids, targets, low, high):
+                for i in ids:
+                    for target in sorted(set(rng.choice(targets) for _ in range(rng.randint(low, high)))):
+                        yield target, i
+
+            stats["artistgenres"] = _copy(cur, "artistgenres", ("genre_id", "artist_id"),
+                                          links(artist_ids, genre_ids, 1, 3))
+            stats["albumartists"] = _copy(cur, "albumartists", ("artist_id", "album_id"),
+                                          links(album_ids, artist_ids, 1, 2))
+            stats["collectiontracks"] = _copy(cur, "collectiontracks", ("track_id", "collection_id"),
+                                              links(collection_ids, track_ids, 10, 20))
+
+            for table in ("genres", "artists", "albums", "tracks", "collections"):
+                _reset_sequence(cur, table)
+            for table in ("artistgenres", "tracks", "albums"):
+                cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            music_catalog._rebuild_stats(cur)
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при генерации каталога: {e}")
+        return stats
+
+    stats["seconds"] = time.perf_counter() - started
+    rows = sum(value for key, value in stats.items() if key != "seconds")
+    print(f"✅ Сгенерирован каталог: {stats['tracks']} треков, {stats['albums']} альбомов, "
+          f"{stats['artists']} исполнителей, {stats['collections']} сборников "
+          f"({rows / max(stats['seconds'], 1e-9):.0f} строк/сек)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация синтетических данных через COPY")
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="строка подключения к PostgreSQL")
+    parser.add_argument("--clients", type=int, default=0, help="число клиентов")
+    parser.add_argument("--max-phones", type=int, default=3, help="максимум телефонов у клиента")
+    parser.add_argument("--tracks", type=int, default=0, help="число треков каталога")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="очистить таблицы перед загрузкой")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.clients:
+            number_book.create_db(conn)
+            generate_clients(conn, args.clients, args.seed, args.max_phones, args.truncate)
+        if args.tracks:
+            music_catalog.create_music_db(conn)
+            generate_music(conn, args.tracks, args.seed, args.truncate)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from instrumentation import InstrumentedConnection
+
+
+class PoolTimeout(PoolError):
+    """
+    Не удалось получить соединение из пула за отведенное время
+    """
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений с PostgreSQL
+
+    Держит от minconn до maxconn соединений. Соединения, простаивающие дольше
+    max_idle секунд, закрываются (но не ниже minconn). Перед выдачей соединение,
+    простоявшее дольше check_interval секунд, проверяется запросом SELECT 1 и
+    при ошибке заменяется новым. Любая функция из number_book.py, принимающая
+    conn, может работать с соединением из пула:
+
+        pool = ConnectionPool("dbname=clients user=postgres", maxconn=8)
+        with pool.connection() as conn:
+            find_client(conn, last_name="Иванов")
+    """
+
+    def __init__(self, dsn=None, minconn=1, maxconn=10, max_idle=300.0,
+                 check_interval=30.0, timeout=30.0, cursor_factory=None, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Некорректные размеры пула: minconn={}, maxconn={}".format(minconn, maxconn))
+
+        self.dsn = extensions.make_dsn(dsn, **connect_kwargs)
+        self.cursor_factory = cursor_factory
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+        self._idle = []  # список (conn, время возврата в пул), последний - самый "свежий"
+        self._size = 0  # всего открытых соединений (свободные + выданные)
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=InstrumentedConnection,
+                                cursor_factory=self.cursor_factory)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _evict_idle(self, now):
+        """
+        Закрытие соединений, простаивающих дольше max_idle (под блокировкой)
+        """
+        if self.max_idle is None:
+            return
+        keep = []
+        # Самые старые соединения находятся в начале списка
+        for index, (conn, since) in enumerate(self._idle):
+            if now - since > self.max_idle and self._size > self.minconn:
+                self._close_quietly(conn)
+                self._size -= 1
+            else:
+                keep = self._idle[index:]
+                break
+        self._idle = keep
+
+    def getconn(self, timeout=None):
+        """
+        Получение соединения из пула; ждет освобождения не дольше timeout секунд
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("пул соединений закрыт")
+
+                now = time.monotonic()
+                self._evict_idle(now)
+
+                if self._idle:
+                    conn, since = self._idle.pop()
+                    break
+
+                if self._size < self.maxconn:
+                    # Резервируем место и открываем соединение вне блокировки
+                    self._size += 1
+                    conn, since = None, now
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolTimeout("нет свободных соединений в пуле (maxconn={})".format(self.maxconn))
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif time.monotonic() - since > self.check_interval and not self._is_healthy(conn):
+                self._close_quietly(conn)
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Возврат соединения в пул; незавершенная транзакция откатывается
+        """
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._close_quietly(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Контекстный менеджер: выдает соединение и возвращает его в пул
+        """
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        """
+        Текущее состояние пула: всего соединений, свободных и выданных
+        """
+        with self._cond:
+            idle = len(self._idle)
+            return {"size": self._size, "idle": idle, "in_use": self._size - idle}
+
+    def closeall(self):
+        """
+        Закрытие пула и всех свободных соединений
+        """
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.closeall()
@@ -0,0 +1,381 @@
+"""
+Потоковая выгрузка клиентов с телефонами через COPY ... TO STDOUT
+
+Форматы:
+- csv: колонки id, first_name, last_name, email, created_at, phones
+  (телефоны через ';' - тот же формат читает import_clients);
+- ndjson: по одному JSON объекту на строку (тоже читается import_clients);
+- parquet: колоночные файлы part-NNNNN.parquet в каталоге (нужен pyarrow).
+
+Данные выгружаются порциями по диапазонам id: каждая порция - один COPY
+(id > last_id AND id <= граница), поэтому память не зависит от размера
+таблицы. После каждой порции в файл контрольной точки записываются
+last_id и размер файла: прерванная выгрузка продолжается с того же места,
+а недописанный хвост файла отрезается. Сжатие gzip или zstd (нужен
+zstandard) выполняется отдельным потоком (member/frame) на каждую порцию,
+склеенные потоки распаковываются как один файл.
+
+export_clients_parallel делит диапазон id на части и выгружает их через
+несколько соединений в отдельные файлы, все - из одного снимка данных.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import extensions
+
+FORMATS = ("csv", "ndjson", "parquet")
+COMPRESSIONS = (None, "gzip", "zstd")
+
+_ROWS_SQL = """
+    SELECT c.id, c.first_name, c.last_name, c.email, c.created_at,
+           COALESCE(p.phones, '{{}}') AS phones
+    FROM clients c
+    LEFT JOIN LATERAL (
+        SELECT ARRAY_AGG(phone_number ORDER BY created_at, id) AS phones
+        FROM phones
+        WHERE client_id = c.id
+    ) p ON TRUE
+    WHERE c.id > {low} AND c.id <= {high}
+    ORDER BY c.id
+"""
+
+# Для NDJSON каждая строка - готовый JSON. В формате CSV с кавычкой и
+# разделителем, которых не бывает в JSON (\x01, \x02), COPY выводит текст
+# как есть, без экранирования обратных слэшей, которое добавил бы формат text
+_COPY_SQL = {
+    "csv": "COPY ({rows_sql}) TO STDOUT WITH (FORMAT csv{header})",
+    "ndjson": """
+        COPY (
+            SELECT row_to_json(r)::text
+            FROM ({rows_sql}) r
+        ) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')
+    """,
+}
+
+
+def _rows_sql(low, high, csv=False):
+    sql = _ROWS_SQL.format(low=int(low), high=int(high))
+    if csv:
+        sql = sql.replace("COALESCE(p.phones, '{}') AS phones",
+                          "COALESCE(array_to_string(p.phones, ';'), '') AS phones")
+    return sql
+
+
+def _open_compressed(raw, compression):
+    """
+    Обертка над файлом для одной порции: отдельный gzip member или zstd frame
+    """
+    if compression is None:
+        return None
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb")
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    raise ValueError(f"Неизвестное сжатие: {compression}")
+
+
+def _missing_dependency(fmt, compression):
+    """
+    Имя необязательного пакета, без которого выгрузка невозможна, или None
+    """
+    needed = []
+    if fmt == "parquet":
+        needed.append("pyarrow")
+    elif compression == "zstd":
+        needed.append("zstandard")
+    for name in needed:
+        try:
+            __import__(name)
+        except ImportError:
+            return name
+    return None
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _next_bound(cur, last_id, high, batch_rows):
+    """
+    Верхняя граница id для следующей порции не более чем из batch_rows клиентов
+    """
+    cur.execute(
+        """
+        SELECT MAX(id) FROM (
+            SELECT id FROM clients WHERE id > %s AND id <= %s ORDER BY id LIMIT %s
+        ) batch
+        """,
+        (last_id, high, batch_rows)
+    )
+    return cur.fetchone()[0]
+
+
+def _id_range(cur):
+    cur.execute("SELECT COALESCE(MIN(id), 1) - 1, COALESCE(MAX(id), 0) FROM clients")
+    return cur.fetchone()
+
+
+def _export_parquet(conn, path, compression, batch_rows, low, high, state, checkpoint, stats):
+    """
+    Выгрузка в каталог path файлами part-NNNNN.parquet по одному на порцию
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("first_name", pa.string()), ("last_name", pa.string()),
+        ("email", pa.string()), ("created_at", pa.timestamp("us")), ("phones", pa.list_(pa.string())),
+    ])
+    os.makedirs(path, exist_ok=True)
+
+    with conn.cursor() as cur:
+        while True:
+            bound = _next_bound(cur, state["last_id"], high, batch_rows)
+            if bound is None:
+                break
+            cur.execute(_rows_sql(state["last_id"], bound))
+            rows = cur.fetchall()
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays([pa.array(column, type=field.type)
+                                          for column, field in zip(columns, schema)], schema=schema)
+            part = os.path.join(path, f"part-{state['parts']:05d}.parquet")
+            pq.write_table(table, part, compression=compression or "snappy")
+
+            state["parts"] += 1
+            state["last_id"] = bound
+            stats["rows"] += len(rows)
+            stats["bytes"] += os.path.getsize(part)
+            if checkpoint:
+                _write_checkpoint(checkpoint, state)
+
+
+def export_clients(conn, path, fmt="csv", compression=None, batch_rows=100000,
+                   checkpoint=True, low=None, high=None):
+    """
+    Выгрузка клиентов с id в диапазоне (low, high] (по умолчанию - всех) в файл path
+
+    path может быть открытым бинарным потоком (например sys.stdout.buffer) -
+    тогда контрольная точка не ведется. checkpoint=True хранит состояние в
+    path + ".checkpoint"; при его наличии выгрузка продолжается, по окончании
+    файл контрольной точки удаляется.
+    Возвращает словарь {"rows", "bytes", "seconds", "last_id", "path"} или None при ошибке
+    """
+    if fmt not in FORMATS or compression not in COMPRESSIONS:
+        print(f"❌ Неизвестный формат или сжатие: {fmt}, {compression}")
+        return None
+    missing = _missing_dependency(fmt, compression)
+    if missing:
+        print(f"❌ Для выгрузки нужен пакет {missing}: pip install {missing}")
+        return None
+
+    stream = None if isinstance(path, str) else path
+    checkpoint_path = path + ".checkpoint" if checkpoint and stream is None else None
+    stats = {"rows": 0, "bytes": 0, "seconds": 0.0, "last_id": None, "path": path if stream is None else None}
+    started = time.perf_counter()
+
+    try:
+        with conn.cursor() as cur:
+            if low is None or high is None:
+                min_id, max_id = _id_range(cur)
+                low = min_id if low is None else low
+                high = max_id if high is None else high
+
+        state = _read_checkpoint(checkpoint_path) if checkpoint_path else None
+        if state and (state.get("format"), state.get("compression")) != (fmt, compression):
+            print("❌ Контрольная точка относится к выгрузке в другом формате")
+            return None
+        resumed = state is not None
+        if not resumed:
+            state = {"format": fmt, "compression": compression, "last_id": low, "high": high,
+                     "offset": 0, "parts": 0}
+        high = state["high"]
+
+        if fmt == "parquet":
+            if stream is not None:
+                raise ValueError("Parquet выгружается только в каталог")
+            _export_parquet(conn, path, compression, batch_rows, low, high, state, checkpoint_path, stats)
+        else:
+            if stream is None:
+                raw = open(path, "r+b" if resumed else "wb")
+                # Отрезаем то, что было дописано после последней контрольной точки
+                raw.truncate(state["offset"])
+                raw.seek(state["offset"])
+            else:
+                raw = stream
+            header = ", HEADER" if fmt == "csv" and not resumed else ""
+            try:
+                with conn.cursor() as cur:
+                    while True:
+                        bound = _next_bound(cur, state["last_id"], high, batch_rows)
+                        if bound is None:
+                            break
+                        sql = _COPY_SQL[fmt].format(rows_sql=_rows_sql(state["last_id"], bound, fmt == "csv"),
+                                                    header=header)
+
+                        writer = _open_compressed(raw, compression)
+                        cur.copy_expert(sql, writer or raw, size=1 << 16)
+                        if writer is not None:
+                            writer.close()
+                        raw.flush()
+                        header = ""
+
+                        stats["rows"] += max(cur.rowcount, 0)
+                        state["last_id"] = bound
+                        if stream is None:
+                            state["offset"] = raw.tell()
+                            os.fsync(raw.fileno())
+                            if checkpoint_path:
+                                _write_checkpoint(checkpoint_path, state)
+                stats["bytes"] = raw.tell() if stream is None else 0
+            finally:
+                if stream is None:
+                    raw.close()
+
+        conn.rollback()
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при выгрузке клиентов: {e}")
+        return None
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["last_id"] = state["last_id"]
+    if stream is None:
+        print(f"✅ Выгружено клиентов: {stats['rows']} в {path} "
+              f"({stats['rows'] / max(stats['seconds'], 1e-9):.0f} строк/сек)")
+    return stats
+
+
+def _part_path(path, index, fmt, compression):
+    if fmt == "parquet":
+        return os.path.join(path, f"range-{index:03d}")
+    base, ext = (path, "")
+    for suffix in (".gz", ".zst"):
+        if base.endswith(suffix):
+            base, ext = base[:-len(suffix)], suffix
+    root, dot_ext = os.path.splitext(base)
+    return f"{root}.part{index:03d}{dot_ext}{ext}"
+
+
+def export_clients_parallel(dsn, path, workers=4, fmt="csv", compression=None, batch_rows=100000):
+    """
+    Параллельная выгрузка: клиенты делятся на workers частей поровну, каждая
+    выгружается своим соединением в отдельный файл (path с суффиксом .partNNN).
+    Все соединения читают один снимок данных (pg_export_snapshot). Границы
+    частей (и low/high на момент снимка) сохраняются в path + ".manifest":
+    прерванную выгрузку можно перезапустить с теми же параметрами - части
+    сохранят свои диапазоны, завершенные не выгружаются заново, остальные
+    продолжатся со своих контрольных точек (уже из нового снимка). Изменить
+    число частей при перезапуске нельзя.
+    Возвращает список результатов export_clients по частям или None при ошибке
+    """
+    try:
+        leader = psycopg2.connect(dsn)
+    except psycopg2.Error as e:
+        print(f"❌ Ошибка подключения к базе данных: {e}")
+        return None
+
+    manifest_path = path + ".manifest"
+    try:
+        manifest = _read_checkpoint(manifest_path)
+        if manifest is not None and (manifest.get("format"), manifest.get("compression"), manifest.get("workers")) \
+                != (fmt, compression, workers):
+            print(f"❌ Незавершенная выгрузка {path} начата с другими параметрами "
+                  f"(формат {manifest.get('format')}, сжатие {manifest.get('compression')}, "
+                  f"частей {manifest.get('workers')}); продолжите с ними или удалите {manifest_path}")
+            return None
+
+        leader.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with leader.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot = cur.fetchone()[0]
+
+            if manifest is None:
+                low, high = _id_range(cur)
+                # Границы частей - квантили по числу строк, а не по значениям id:
+                # после удалений id идут с пропусками и равные отрезки дали бы перекос
+                cur.execute("SELECT COUNT(*) FROM clients")
+                total = cur.fetchone()[0]
+                bounds = [low]
+                for i in range(1, workers):
+                    rank = total * i // workers
+                    # Клиентов меньше, чем частей (или нет вовсе): у части нет своей границы
+                    if rank == 0:
+                        continue
+                    cur.execute("SELECT id FROM clients ORDER BY id OFFSET %s LIMIT 1", (rank - 1,))
+                    row = cur.fetchone()
+                    if row and row[0] > bounds[-1]:
+                        bounds.append(row[0])
+                bounds.append(high)
+                # Границы сохраняются до начала выгрузки: при перезапуске части
+                # продолжаются в тех же диапазонах, даже если клиентов стало больше или меньше
+                manifest = {"format": fmt, "compression": compression, "workers": workers,
+                            "low": low, "high": high,
+                            # Пустая таблица выгружается одной пустой частью
+                            "ranges": [[a, b] for a, b in zip(bounds, bounds[1:]) if a < b] or [[low, high]],
+                            "done": {}}
+                _write_checkpoint(manifest_path, manifest)
+        ranges = [tuple(bounds) for bounds in manifest["ranges"]]
+        manifest_lock = threading.Lock()
+
+        def run(index, bounds):
+            done = manifest["done"].get(str(index))
+            if done is not None:
+                return done
+            conn = psycopg2.connect(dsn)
+            try:
+                conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+                with conn.cursor() as cur:
+                    # Снимок лидера действителен, пока открыта его транзакция
+                    cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                part = _part_path(path, index, fmt, compression)
+                result = export_clients(conn, part, fmt, compression, batch_rows, low=bounds[0], high=bounds[1])
+            finally:
+                conn.close()
+            if result is not None:
+                # Завершенная часть не выгружается повторно при перезапуске
+                with manifest_lock:
+                    manifest["done"][str(index)] = result
+                    _write_checkpoint(manifest_path, manifest)
+            return result
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(ranges) or 1) as pool:
+            results = list(pool.map(run, range(len(ranges)), ranges))
+        seconds = time.perf_counter() - started
+
+        if any(result is None for result in results):
+            print("❌ Выгрузка части диапазона не удалась, перезапустите с теми же параметрами")
+            return None
+        os.remove(manifest_path)
+        rows = sum(result["rows"] for result in results)
+        print(f"✅ Параллельная выгрузка: {rows} клиентов, {len(results)} файлов "
+              f"({rows / max(seconds, 1e-9):.0f} строк/сек)")
+        return results
+
+    except Exception as e:
+        print(f"❌ Ошибка при параллельной выгрузке: {e}")
+        return None
+    finally:
+        leader.close()
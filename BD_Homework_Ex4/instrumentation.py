@@ -0,0 +1,348 @@
+"""
+Инструментирование функций number_book.py
+
+По умолчанию выключено: декоратор instrumented только проверяет глобальную
+переменную и вызывает функцию напрямую. После enable_instrumentation() для
+каждой операции собираются:
+
+- гистограмма полной длительности вызова и суммарное время внутри запросов
+  (разница - время Python: форматирование, вывод, разбор результатов);
+- число обращений к серверу (execute/copy), затронутых строк, ошибок SQL и повторов;
+  из обращений отдельно считаются PREPARE подготовленных запросов (prepared.py);
+- журнал медленных запросов: текст SQL без значений параметров и, при
+  explain=True, план EXPLAIN ANALYZE для медленных SELECT.
+
+Метрики выводятся в текстовом формате Prometheus (render_metrics) или
+отдаются по HTTP (start_metrics_server):
+
+    enable_instrumentation(slow_query_ms=50, explain=True)
+    start_metrics_server(9108)
+
+Запросы учитываются на соединениях InstrumentedConnection: их создают
+connect_to_db, ConnectionPool и cli.py, а для psycopg2.connect нужно передать
+connection_factory=InstrumentedConnection. Соединение при этом не меняется,
+поэтому его можно делить между потоками. Для остальных соединений и для
+соединений с собственным cursor_factory (DictCursor и т.п.) учитываются
+только число и длительность вызовов.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2.extensions
+from psycopg2 import sql
+
+logger = logging.getLogger("number_book.sql")
+
+# Границы корзин гистограммы, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_instrumentation = None
+_local = threading.local()
+
+
+class _OperationStats:
+    """
+    Накопленные метрики одной операции
+    """
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.errors = 0
+        self.retries = 0
+        self.slow_queries = 0
+        self.prepares = 0
+
+
+class _Call:
+    """
+    Счетчики текущего вызова (хранятся в потоке, пока выполняется операция)
+    """
+    __slots__ = ("operation", "db_seconds", "statements", "rows", "errors", "retries", "slow_queries", "prepares")
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.errors = 0
+        self.retries = 0
+        self.slow_queries = 0
+        self.prepares = 0
+
+
+class Instrumentation:
+    """
+    Хранилище метрик и настройки журнала медленных запросов
+    """
+
+    def __init__(self, slow_query_ms=100.0, explain=False, buckets=DEFAULT_BUCKETS, log=None):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self.buckets = tuple(buckets)
+        self.log = log or logger
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, call, seconds):
+        with self._lock:
+            stats = self._operations.get(call.operation)
+            if stats is None:
+                stats = self._operations[call.operation] = _OperationStats(self.buckets)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.db_seconds += call.db_seconds
+            stats.statements += call.statements
+            stats.rows += call.rows
+            stats.errors += call.errors
+            stats.retries += call.retries
+            stats.slow_queries += call.slow_queries
+            stats.prepares += call.prepares
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats.bucket_counts[index] += 1
+                    break
+
+    def snapshot(self):
+        """
+        Копия метрик: {операция: {"count", "seconds", "db_seconds", "statements", ...}}
+        """
+        with self._lock:
+            return {
+                name: {
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "db_seconds": stats.db_seconds,
+                    "statements": stats.statements,
+                    "rows": stats.rows,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "slow_queries": stats.slow_queries,
+                    "prepares": stats.prepares,
+                    "buckets": list(zip(self.buckets, stats.bucket_counts)),
+                }
+                for name, stats in self._operations.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+def _redact(query):
+    """
+    Текст запроса для журнала: шаблон с плейсхолдерами вместо значений, в одну строку
+    """
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """
+    Курсор, передающий время, число строк и ошибки каждого запроса в текущую операцию
+    """
+    # Исходный текст запроса, выполняемого через EXECUTE (задает prepared.execute)
+    source_query = None
+
+    def execute(self, query, vars=None):
+        call = getattr(_local, "call", None)
+        if call is None or _instrumentation is None:
+            return super().execute(query, vars)
+
+        if isinstance(query, str) and query.startswith("PREPARE "):
+            # Лишнее обращение при первом вызове запроса на соединении
+            call.prepares += 1
+
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            call.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            call.db_seconds += elapsed
+            call.statements += 1
+            if self.rowcount > 0:
+                call.rows += self.rowcount
+            if elapsed * 1000 >= _instrumentation.slow_query_ms:
+                call.slow_queries += 1
+                self._log_slow(call, query, vars, elapsed)
+
+    def copy_expert(self, statement, file, size=8192):
+        call = getattr(_local, "call", None)
+        if call is None or _instrumentation is None:
+            return super().copy_expert(statement, file, size)
+
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(statement, file, size)
+        except Exception:
+            call.errors += 1
+            raise
+        finally:
+            call.db_seconds += time.perf_counter() - started
+            call.statements += 1
+            if self.rowcount > 0:
+                call.rows += self.rowcount
+
+    def _log_slow(self, call, query, vars, elapsed):
+        if isinstance(query, sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode("utf-8", "replace")
+        # Для подготовленного запроса в журнал идет его исходный текст, а план
+        # получается через EXPLAIN EXECUTE имя(...) с теми же параметрами
+        text = _redact(self.source_query if self.source_query is not None else query)
+        instrumentation = _instrumentation
+        instrumentation.log.warning(
+            "медленный запрос в %s: %.1f мс, параметров: %d: %s",
+            call.operation, elapsed * 1000, len(vars) if vars else 0, text
+        )
+        if not (instrumentation.explain and text.upper().startswith("SELECT")):
+            return
+        if self.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        try:
+            # Повторное выполнение только для SELECT: у него нет побочных эффектов
+            with self.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            instrumentation.log.warning("план запроса в %s:\n%s", call.operation, plan)
+        except psycopg2.Error as e:
+            instrumentation.log.warning("не удалось получить план запроса в %s: %s", call.operation, e)
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    Соединение, выдающее InstrumentedCursor внутри инструментированных вызовов
+
+    Курсор выбирается по текущему потоку в момент создания, состояние
+    соединения не меняется. Явно заданный cursor_factory (при вызове cursor
+    или у соединения) не заменяется.
+    """
+
+    def cursor(self, *args, **kwargs):
+        if (len(args) < 2 and kwargs.get("cursor_factory") is None and self.cursor_factory is None
+                and getattr(_local, "call", None) is not None):
+            kwargs["cursor_factory"] = InstrumentedCursor
+        return super().cursor(*args, **kwargs)
+
+
+def instrumented(func):
+    """
+    Декоратор для функций вида func(conn, ...): при включенном инструментировании
+    вызов учитывается в метриках, а на InstrumentedConnection - и его запросы
+    """
+    operation = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _instrumentation is None or getattr(_local, "call", None) is not None:
+            return func(*args, **kwargs)
+
+        instrumentation = _instrumentation
+        call = _local.call = _Call(operation)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _local.call = None
+            instrumentation.record(call, elapsed)
+
+    return wrapper
+
+
+def record_retry():
+    """
+    Учет повтора внутри текущей операции (например, после конфликта сериализации)
+    """
+    call = getattr(_local, "call", None)
+    if call is not None:
+        call.retries += 1
+
+
+def enable_instrumentation(slow_query_ms=100.0, explain=False, buckets=DEFAULT_BUCKETS, log=None):
+    """
+    Включение сбора метрик; возвращает объект Instrumentation
+    """
+    global _instrumentation
+    _instrumentation = Instrumentation(slow_query_ms, explain, buckets, log)
+    return _instrumentation
+
+
+def disable_instrumentation():
+    global _instrumentation
+    _instrumentation = None
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def render_metrics(prefix="number_book"):
+    """
+    Метрики в текстовом формате Prometheus
+    """
+    if _instrumentation is None:
+        return ""
+
+    snapshot = _instrumentation.snapshot()
+    lines = [
+        f"# HELP {prefix}_operation_duration_seconds Полная длительность вызова функции",
+        f"# TYPE {prefix}_operation_duration_seconds histogram",
+    ]
+    for name, stats in sorted(snapshot.items()):
+        cumulative = 0
+        for bound, count in stats["buckets"]:
+            cumulative += count
+            lines.append(f'{prefix}_operation_duration_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_operation_duration_seconds_bucket{{operation="{name}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'{prefix}_operation_duration_seconds_sum{{operation="{name}"}} {stats["seconds"]:.6f}')
+        lines.append(f'{prefix}_operation_duration_seconds_count{{operation="{name}"}} {stats["count"]}')
+
+    counters = [
+        ("db_seconds", "operation_db_seconds_total", "Время внутри запросов к серверу", "{:.6f}"),
+        ("statements", "operation_statements_total", "Обращения к серверу (execute/copy)", "{}"),
+        ("rows", "operation_rows_total", "Затронутые и полученные строки", "{}"),
+        ("errors", "operation_errors_total", "Ошибки SQL", "{}"),
+        ("retries", "operation_retries_total", "Повторы операций", "{}"),
+        ("slow_queries", "operation_slow_queries_total", "Запросы дольше порога", "{}"),
+        ("prepares", "operation_prepares_total", "Подготовка запросов (PREPARE), входит в statements", "{}"),
+    ]
+    for key, metric, help_text, value_format in counters:
+        lines.append(f"# HELP {prefix}_{metric} {help_text}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for name, stats in sorted(snapshot.items()):
+            lines.append(f'{prefix}_{metric}{{operation="{name}"}} {value_format.format(stats[key])}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port=9108, host="127.0.0.1"):
+    """
+    HTTP-сервер метрик в фоновом потоке; возвращает сервер (остановка - server.shutdown())
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
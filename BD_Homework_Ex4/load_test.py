@@ -0,0 +1,198 @@
+"""
+Нагрузочный тест функций number_book.py
+
+N потоков в течение заданного времени вызывают add_client, find_client,
+change_client и delete_client в заданной пропорции через общий пул
+соединений. В конце выводятся пропускная способность и перцентили задержек
+по каждой операции. Данные лучше подготовить заранее через data_generator.py.
+
+Запуск:
+    python load_test.py --dsn "dbname=clients user=postgres" --threads 16 --duration 60 \
+        --mix add_client=10 find_client=70 change_client=15 delete_client=5
+"""
+import argparse
+import random
+import threading
+import time
+
+import number_book
+from benchmarks import DEFAULT_DSN, _percentile, _quiet
+from data_generator import FIRST_NAMES, LAST_NAMES, _phone
+from db_pool import ConnectionPool
+
+DEFAULT_MIX = {"add_client": 10, "find_client": 70, "change_client": 15, "delete_client": 5}
+
+
+class _LoadState:
+    """
+    Общие для потоков данные: известные email и id клиентов, созданных тестом
+    """
+
+    def __init__(self, emails, min_id, max_id):
+        self.emails = emails
+        self.min_id = min_id
+        self.max_id = max_id
+        self.created = []
+        self.lock = threading.Lock()
+
+    def add_created(self, client_id):
+        with self.lock:
+            self.created.append(client_id)
+
+    def pop_created(self, rng):
+        with self.lock:
+            if not self.created:
+                return None
+            index = rng.randrange(len(self.created))
+            self.created[index], self.created[-1] = self.created[-1], self.created[index]
+            return self.created.pop()
+
+
+def _operation(name, conn, rng, state, thread_index, counter):
+    """
+    Один вызов операции name со случайными аргументами; возвращает True при успехе
+    """
+    if name == "add_client":
+        first, _ = rng.choice(FIRST_NAMES)
+        last, _ = rng.choice(LAST_NAMES)
+        email = f"load.{thread_index}.{counter}.{time.time_ns()}@example.com"
+        client_id = number_book.add_client(conn, first, last, email, [_phone(rng)])
+        if client_id is not None:
+            state.add_created(client_id)
+        return client_id is not None
+
+    if name == "find_client":
+        if state.emails:
+            number_book.find_client(conn, email=rng.choice(state.emails))
+        else:
+            number_book.find_client(conn, last_name=rng.choice(LAST_NAMES)[0])
+        return True
+
+    if name == "change_client":
+        client_id = rng.randint(state.min_id, state.max_id)
+        return number_book.change_client(conn, client_id, last_name=rng.choice(LAST_NAMES)[0])
+
+    if name == "delete_client":
+        # Удаляются только клиенты, созданные тестом: исходные данные не убывают
+        client_id = state.pop_created(rng)
+        if client_id is None:
+            return True
+        return number_book.delete_client(conn, client_id)
+
+    raise ValueError(f"Неизвестная операция: {name}")
+
+
+def run_load(dsn, threads=8, duration=30.0, mix=None, seed=42, sample_emails=10000):
+    """
+    Запуск нагрузки; возвращает словарь
+    {"operations", "seconds", "throughput", "per_operation": {имя: {"count", "errors", "p50", ...}}}
+    """
+    mix = mix or DEFAULT_MIX
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    with ConnectionPool(dsn, minconn=threads, maxconn=threads) as pool:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(MIN(id), 1), COALESCE(MAX(id), 1) FROM clients")
+                min_id, max_id = cur.fetchone()
+                cur.execute("SELECT email FROM clients ORDER BY random() LIMIT %s", (sample_emails,))
+                emails = [row[0] for row in cur.fetchall()]
+            conn.rollback()
+        state = _LoadState(emails, min_id, max_id)
+
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        results_lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def worker(thread_index):
+            rng = random.Random(seed * 1000 + thread_index)
+            local = {name: [] for name in names}
+            local_errors = {name: 0 for name in names}
+            counter = 0
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                counter += 1
+                started = time.perf_counter()
+                try:
+                    with pool.connection() as conn:
+                        ok = _operation(name, conn, rng, state, thread_index, counter)
+                except Exception:
+                    ok = False
+                local[name].append((time.perf_counter() - started) * 1000)
+                if not ok:
+                    local_errors[name] += 1
+            with results_lock:
+                for name in names:
+                    latencies[name].extend(local[name])
+                    errors[name] += local_errors[name]
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        with _quiet():
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        seconds = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    report = {"operations": total, "seconds": seconds, "throughput": total / seconds, "per_operation": {}}
+    for name in names:
+        values = latencies[name]
+        report["per_operation"][name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": max(values, default=0.0),
+        }
+    return report
+
+
+def print_report(report, threads):
+    print(f"\n📈 {report['operations']} операций за {report['seconds']:.1f} сек, {threads} потоков: "
+          f"{report['throughput']:.0f} операций/сек")
+    print(f"{'операция':<15} {'вызовов':>9} {'ошибок':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    for name, row in report["per_operation"].items():
+        print(f"{name:<15} {row['count']:>9} {row['errors']:>7} {row['p50']:>9.2f} {row['p95']:>9.2f} "
+              f"{row['p99']:>9.2f} {row['max']:>9.2f}")
+
+
+def _mix_item(item):
+    """
+    Элемент --mix "операция=вес" (вес по умолчанию 1) -> (операция, вес)
+    """
+    name, _, weight = item.partition("=")
+    if name not in DEFAULT_MIX:
+        raise argparse.ArgumentTypeError(f"неизвестная операция: {name} (доступны: {', '.join(DEFAULT_MIX)})")
+    try:
+        value = float(weight or 1)
+    except ValueError:
+        value = None
+    if value is None or not 0 <= value < float("inf"):
+        raise argparse.ArgumentTypeError(f"вес операции {name} должен быть неотрицательным числом: {weight}")
+    return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест number_book.py")
+    parser.add_argument("--dsn", default=DEFAULT_DSN, help="строка подключения к PostgreSQL")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность, сек")
+    parser.add_argument("--mix", nargs="+", type=_mix_item, default=list(DEFAULT_MIX.items()),
+                        help="операция=вес, например find_client=70")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    mix = dict(args.mix)
+    if not sum(mix.values()) > 0:
+        parser.error("argument --mix: сумма весов операций должна быть положительной")
+
+    report = run_load(args.dsn, args.threads, args.duration, mix, args.seed)
+    print_report(report, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Версионные миграции схемы телефонной книги и музыкального каталога
+
+Применённые версии хранятся в таблице schema_migrations (компонент, версия).
+При старте достаточно одного запроса (schema_is_current): если все версии
+применены, DDL не выполняется вовсе. Недостающие миграции применяет migrate:
+
+- миграции выполняются под advisory-блокировкой, поэтому несколько
+  одновременно запущенных процессов не применяют их дважды;
+- CREATE INDEX выполняется как CREATE INDEX CONCURRENTLY вне транзакции и не
+  блокирует запись в таблицу; недостроенный (INVALID) индекс, оставшийся от
+  прерванной попытки, сначала удаляется. Для секционированной таблицы
+  (partitioning.py) индекс строится так на каждой секции и присоединяется к
+  индексу родительской таблицы;
+- остальные команды подряд идущими группами выполняются в транзакциях.
+
+Команды миграций идемпотентны (IF NOT EXISTS), поэтому базы, созданные до
+появления schema_migrations, переводятся на миграции тем же вызовом.
+Новое изменение схемы добавляется в MIGRATIONS следующей версией компонента;
+уже выпущенные версии не меняются.
+
+Компоненты: "clients" (таблицы number_book.py) и "music" (схема каталога из
+BD_Homework_Ex3/BD_Homework2_Create.sql, см. music_catalog.py).
+"""
+import re
+import time
+
+import psycopg2
+
+import music_catalog
+import number_book
+
+# Ключ advisory-блокировки, под которой применяются миграции
+LOCK_KEY = 4_270_020
+
+SCHEMA_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        component VARCHAR(50) NOT NULL,
+        version INTEGER NOT NULL,
+        name VARCHAR(200) NOT NULL,
+        skipped BOOLEAN NOT NULL DEFAULT FALSE,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (component, version)
+    )
+"""
+
+_CREATE_INDEX = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+_INDEX_TABLE = re.compile(r"\bON\s+(\w+)", re.IGNORECASE)
+
+
+class Migration:
+    """
+    Одна версия схемы компонента
+
+    steps - SQL-команды и функции вида step(cur), выполняемые по порядку.
+    optional=True - ошибка не прерывает миграции: версия отмечается пропущенной
+    (например, если на сервере нет расширения pg_trgm)
+    """
+
+    def __init__(self, component, version, name, steps, optional=False):
+        self.component = component
+        self.version = version
+        self.name = name
+        self.steps = list(steps)
+        self.optional = optional
+
+
+MIGRATIONS = [
+    Migration("clients", 1, "таблицы клиентов и телефонов", number_book.CLIENTS_SCHEMA),
+    Migration("clients", 2, "триграммные индексы (pg_trgm)", number_book.TRIGRAM_SCHEMA, optional=True),
+    Migration("clients", 3, "журнал изменений для подписчиков (change_feed.py)",
+              number_book.CHANGE_LOG_SCHEMA + number_book.CHANGE_LOG_TRIGGERS),
+    Migration("music", 1, "таблицы каталога и индексы",
+              music_catalog.MUSIC_SCHEMA + music_catalog.MUSIC_INDEXES),
+    Migration("music", 2, "полнотекстовый поиск по названиям", music_catalog.SEARCH_SCHEMA),
+    Migration("music", 3, "сводные таблицы и триггеры статистики",
+              music_catalog.STATS_TABLES + music_catalog.STATS_TRIGGERS
+              + music_catalog._trigger_statements() + [music_catalog._rebuild_stats]),
+    Migration("music", 4, "поиск по названиям: И и исключения для всех словоформ",
+              [music_catalog.TITLE_QUERY_FUNCTION]),
+]
+
+
+def schema_is_current(conn, components=("clients",)):
+    """
+    Проверка одним запросом, что все миграции компонентов применены
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT component, version FROM schema_migrations")
+            applied = set(cur.fetchall())
+        conn.commit()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return False
+    return all((m.component, m.version) in applied for m in MIGRATIONS if m.component in components)
+
+
+def _segments(steps):
+    """
+    Разбиение шагов на группы: (None, [команды]) для транзакции и
+    (имя индекса, команда) для CREATE INDEX CONCURRENTLY
+    """
+    segments = []
+    for step in steps:
+        match = _CREATE_INDEX.match(step) if isinstance(step, str) else None
+        if match:
+            statement = re.sub(r"\bINDEX\b", "INDEX CONCURRENTLY", step, count=1, flags=re.IGNORECASE)
+            segments.append((match.group(2), statement))
+        elif segments and segments[-1][0] is None:
+            segments[-1][1].append(step)
+        else:
+            segments.append((None, [step]))
+    return segments
+
+
+def _drop_invalid_index(cur, name):
+    cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        print(f"ℹ️ Удаляется недостроенный индекс {name}")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def _partitions(cur, table):
+    cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s) ORDER BY 1",
+                (table,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _create_index(cur, name, statement):
+    """
+    CREATE INDEX CONCURRENTLY; для секционированной таблицы - по секциям
+
+    CONCURRENTLY не поддерживается для секционированных таблиц, поэтому индекс
+    создается только на родительской таблице (ON ONLY, недействительный до
+    присоединения всех секций), строится на каждой секции и присоединяется
+    """
+    table = _INDEX_TABLE.search(statement).group(1)
+    partitions = _partitions(cur, table)
+    if not partitions:
+        _drop_invalid_index(cur, name)
+        cur.execute(statement)
+        return
+
+    parent = _INDEX_TABLE.sub(f"ON ONLY {table}", statement, count=1)
+    cur.execute(re.sub(r"\bINDEX CONCURRENTLY\b", "INDEX", parent, count=1))
+    cur.execute("""
+        SELECT i.indrelid::regclass::text
+        FROM pg_inherits h JOIN pg_index i ON i.indexrelid = h.inhrelid
+        WHERE h.inhparent = to_regclass(%s)
+    """, (name,))
+    attached = {row[0] for row in cur.fetchall()}
+    for partition in partitions:
+        if partition in attached:
+            continue
+        partition_index = f"{partition}_{name}"[:63]
+        _drop_invalid_index(cur, partition_index)
+        cur.execute(_INDEX_TABLE.sub(f"ON {partition}", statement.replace(name, partition_index, 1), count=1))
+        cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+def _apply(cur, migration):
+    """
+    Выполнение шагов миграции на соединении в режиме autocommit
+    """
+    for index_name, body in _segments(migration.steps):
+        if index_name is not None:
+            _create_index(cur, index_name, body)
+            continue
+
+        cur.execute("BEGIN")
+        try:
+            for step in body:
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def _lock(cur, poll_interval=0.2):
+    """
+    Захват advisory-блокировки миграций
+
+    Ожидание в pg_advisory_lock держит снимок данных, а CREATE INDEX
+    CONCURRENTLY в процессе, владеющем блокировкой, ждет завершения всех
+    таких снимков - получилась бы взаимная блокировка. Поэтому блокировка
+    запрашивается короткими попытками pg_try_advisory_lock
+    """
+    waiting = False
+    while True:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+        if cur.fetchone()[0]:
+            return
+        if not waiting:
+            print("ℹ️ Миграции применяет другой процесс, ожидание...")
+            waiting = True
+        time.sleep(poll_interval)
+
+
+def migrate(conn, components=("clients",), retry_skipped=False):
+    """
+    Применение недостающих миграций компонентов
+
+    Открытая транзакция соединения фиксируется: CREATE INDEX CONCURRENTLY
+    выполняется только вне транзакции. retry_skipped=True повторяет
+    необязательные миграции, пропущенные ранее.
+    Возвращает список примененных миграций [(компонент, версия, название)] или None при ошибке
+    """
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    applied = []
+    try:
+        with conn.cursor() as cur:
+            _lock(cur)
+            try:
+                cur.execute(SCHEMA_MIGRATIONS_TABLE)
+                # Перечитываем под блокировкой: другой процесс мог применить миграции
+                cur.execute("SELECT component, version, skipped FROM schema_migrations")
+                done = {(component, version): skipped for component, version, skipped in cur.fetchall()}
+
+                pending = [m for m in MIGRATIONS if m.component in components
+                           and ((m.component, m.version) not in done
+                                or (retry_skipped and done[(m.component, m.version)]))]
+                for migration in sorted(pending, key=lambda m: (m.component, m.version)):
+                    started = time.perf_counter()
+                    skipped = False
+                    try:
+                        _apply(cur, migration)
+                    except psycopg2.Error as e:
+                        if not migration.optional:
+                            raise
+                        skipped = True
+                        print(f"ℹ️ Миграция {migration.component} {migration.version} "
+                              f"({migration.name}) пропущена: {e.diag.message_primary or e}")
+
+                    cur.execute(
+                        """
+                        INSERT INTO schema_migrations (component, version, name, skipped)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (component, version) DO UPDATE
+                        SET skipped = EXCLUDED.skipped, applied_at = CURRENT_TIMESTAMP
+                        """,
+                        (migration.component, migration.version, migration.name, skipped)
+                    )
+                    if not skipped:
+                        applied.append((migration.component, migration.version, migration.name))
+                        print(f"✅ Миграция {migration.component} {migration.version} ({migration.name}) "
+                              f"применена за {time.perf_counter() - started:.2f} с")
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+
+        if not applied:
+            print("ℹ️ Схема базы данных актуальна")
+        return applied
+
+    except Exception as e:
+        print(f"❌ Ошибка при применении миграций: {e}")
+        return None
+    finally:
+        conn.autocommit = autocommit
+
+
+def ensure_schema(conn, components=("clients",)):
+    """
+    Проверка схемы при старте: один запрос, если схема актуальна, иначе migrate
+    """
+    if schema_is_current(conn, components):
+        return True
+    return migrate(conn, components) is not None
+
+
+def migration_status(conn):
+    """
+    Состояние всех миграций: список словарей {"component", "version", "name",
+    "applied_at", "skipped", "pending"}
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT component, version, skipped, applied_at FROM schema_migrations")
+            done = {(component, version): (skipped, applied_at)
+                    for component, version, skipped, applied_at in cur.fetchall()}
+        conn.commit()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        done = {}
+
+    return [
+        {
+            "component": m.component,
+            "version": m.version,
+            "name": m.name,
+            "applied_at": done.get((m.component, m.version), (None, None))[1],
+            "skipped": done.get((m.component, m.version), (False, None))[0],
+            "pending": (m.component, m.version) not in done,
+        }
+        for m in MIGRATIONS
+    ]
@@ -0,0 +1,564 @@
+"""
+Работа с музыкальным каталогом (схема из BD_Homework_Ex3/BD_Homework2_Create.sql)
+
+Запросы из BD_Homework3_Select_ex2_ex3_ex4.sql оформлены функциями. Агрегаты
+(количество исполнителей в жанре, количество и суммарная длительность треков
+альбома, количество треков по годам выпуска альбомов) хранятся в сводных
+таблицах и обновляются триггерами при каждом изменении треков, альбомов и
+связей, поэтому отчеты читают готовые значения, а не пересчитывают их.
+"""
+import psycopg2
+
+
+# Таблицы каталога (как в BD_Homework2_Create.sql)
+MUSIC_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS genres (
+        id SERIAL PRIMARY KEY NOT NULL,
+        name VARCHAR(100) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS artists (
+        id SERIAL PRIMARY KEY NOT NULL,
+        name VARCHAR(100) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS albums (
+        id SERIAL PRIMARY KEY NOT NULL,
+        title VARCHAR(100) NOT NULL,
+        release_year INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tracks (
+        id SERIAL PRIMARY KEY NOT NULL,
+        title VARCHAR(100) NOT NULL,
+        duration INTEGER NOT NULL,
+        album_id INTEGER NOT NULL REFERENCES albums(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS collections (
+        id SERIAL PRIMARY KEY NOT NULL,
+        title VARCHAR(100) NOT NULL,
+        release_year INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS artistgenres (
+        genre_id INTEGER NOT NULL REFERENCES genres(id),
+        artist_id INTEGER NOT NULL REFERENCES artists(id),
+        CONSTRAINT ag PRIMARY KEY (genre_id, artist_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS albumartists (
+        artist_id INTEGER NOT NULL REFERENCES artists(id),
+        album_id INTEGER NOT NULL REFERENCES albums(id),
+        CONSTRAINT aa PRIMARY KEY (artist_id, album_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS collectiontracks (
+        collection_id INTEGER NOT NULL REFERENCES collections(id),
+        track_id INTEGER NOT NULL REFERENCES tracks(id),
+        CONSTRAINT ct PRIMARY KEY (collection_id, track_id)
+    )
+    """,
+]
+
+# Индексы для обратного поиска по таблицам связей и внешних ключей
+# (первичные ключи ag, aa, ct покрывают поиск только по первому столбцу),
+# а также для фильтров и сортировок из запросов заданий 2 и 3
+MUSIC_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_artistgenres_artist ON artistgenres(artist_id)",
+    "CREATE INDEX IF NOT EXISTS idx_albumartists_album ON albumartists(album_id)",
+    "CREATE INDEX IF NOT EXISTS idx_collectiontracks_track ON collectiontracks(track_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tracks_album ON tracks(album_id)",
+    "CREATE INDEX IF NOT EXISTS idx_tracks_duration ON tracks(duration)",
+    "CREATE INDEX IF NOT EXISTS idx_albums_release_year ON albums(release_year)",
+    "CREATE INDEX IF NOT EXISTS idx_collections_release_year ON collections(release_year)",
+    "CREATE INDEX IF NOT EXISTS idx_artists_name ON artists(name)",
+]
+
+# Запрос для поиска по названиям: разбор websearch_to_tsquery в конфигурации
+# simple (И, "фразы" и -исключения сохраняются, стоп-слова не выбрасываются),
+# затем каждое слово заменяется на "слово | основа english | основа russian".
+# Каждое слово должно совпасть хотя бы в одной конфигурации, а исключение
+# отсекает все его формы. Объединять через || целые запросы разных
+# конфигураций нельзя: english и russian выбрасывают стоп-слова, и каждая
+# ветка ИЛИ теряет условия пользователя ("my -mom" находил названия без "my")
+TITLE_QUERY_FUNCTION = r"""
+    CREATE OR REPLACE FUNCTION music_title_tsq(query TEXT) RETURNS tsquery
+    LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE AS $$
+    DECLARE
+        result tsquery := websearch_to_tsquery('simple'::regconfig, query);
+        lexeme TEXT;
+        word TEXT;
+    BEGIN
+        FOR lexeme IN SELECT DISTINCT m[1] FROM regexp_matches(result::text, '(''(?:[^'']|'''')*'')', 'g') AS m LOOP
+            word := replace(substr(lexeme, 2, length(lexeme) - 2), '''''', '''');
+            result := ts_rewrite(result, lexeme::tsquery,
+                                 lexeme::tsquery
+                                 || plainto_tsquery('english'::regconfig, word)
+                                 || plainto_tsquery('russian'::regconfig, word));
+        END LOOP;
+        RETURN result;
+    END
+    $$
+"""
+
+# Полнотекстовый поиск по названиям. Вектор объединяет три конфигурации:
+# simple сохраняет слова как есть (в том числе стоп-слова вроде "my" и "мой"),
+# english и russian добавляют основы слов, поэтому "songs" находит "Song",
+# а "песни" - "Песня". Функции IMMUTABLE, поэтому по ним вычисляются столбцы
+SEARCH_SCHEMA = [
+    """
+    CREATE OR REPLACE FUNCTION music_title_tsv(title TEXT) RETURNS tsvector
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT to_tsvector('simple'::regconfig, title)
+            || to_tsvector('english'::regconfig, title)
+            || to_tsvector('russian'::regconfig, title)
+    $$
+    """,
+    TITLE_QUERY_FUNCTION,
+    # Вектор хранится в генерируемом столбце: ранжирование не пересчитывает его для каждой строки
+    """
+    ALTER TABLE tracks ADD COLUMN IF NOT EXISTS title_tsv tsvector
+        GENERATED ALWAYS AS (music_title_tsv(title)) STORED
+    """,
+    """
+    ALTER TABLE albums ADD COLUMN IF NOT EXISTS title_tsv tsvector
+        GENERATED ALWAYS AS (music_title_tsv(title)) STORED
+    """,
+    """
+    ALTER TABLE artists ADD COLUMN IF NOT EXISTS name_tsv tsvector
+        GENERATED ALWAYS AS (music_title_tsv(name)) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_tracks_title_fts ON tracks USING GIN (title_tsv)",
+    "CREATE INDEX IF NOT EXISTS idx_albums_title_fts ON albums USING GIN (title_tsv)",
+    "CREATE INDEX IF NOT EXISTS idx_artists_name_fts ON artists USING GIN (name_tsv)",
+]
+
+# Сводные таблицы с агрегатами
+STATS_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS genre_artist_stats (
+        genre_id INTEGER PRIMARY KEY REFERENCES genres(id) ON DELETE CASCADE,
+        artist_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS album_track_stats (
+        album_id INTEGER PRIMARY KEY REFERENCES albums(id) ON DELETE CASCADE,
+        track_count INTEGER NOT NULL DEFAULT 0,
+        total_duration BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS year_track_stats (
+        release_year INTEGER PRIMARY KEY,
+        track_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+# Триггеры уровня оператора с таблицами переходов: одно обновление сводных
+# таблиц на весь INSERT/UPDATE/DELETE (в том числе на COPY), а не на каждую строку
+STATS_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION music_artistgenres_stats() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO genre_artist_stats AS s (genre_id, artist_count)
+            SELECT genre_id, COUNT(*) FROM new_rows GROUP BY genre_id
+            ON CONFLICT (genre_id) DO UPDATE SET artist_count = s.artist_count + EXCLUDED.artist_count;
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE genre_artist_stats s SET artist_count = s.artist_count - d.cnt
+            FROM (SELECT genre_id, COUNT(*) AS cnt FROM old_rows GROUP BY genre_id) d
+            WHERE s.genre_id = d.genre_id;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION music_tracks_stats() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO album_track_stats AS s (album_id, track_count, total_duration)
+            SELECT album_id, COUNT(*), SUM(duration) FROM new_rows GROUP BY album_id
+            ON CONFLICT (album_id) DO UPDATE
+            SET track_count = s.track_count + EXCLUDED.track_count,
+                total_duration = s.total_duration + EXCLUDED.total_duration;
+
+            INSERT INTO year_track_stats AS y (release_year, track_count)
+            SELECT a.release_year, COUNT(*)
+            FROM new_rows n JOIN albums a ON a.id = n.album_id
+            GROUP BY a.release_year
+            ON CONFLICT (release_year) DO UPDATE SET track_count = y.track_count + EXCLUDED.track_count;
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE album_track_stats s
+            SET track_count = s.track_count - d.cnt,
+                total_duration = s.total_duration - d.total
+            FROM (SELECT album_id, COUNT(*) AS cnt, SUM(duration) AS total
+                  FROM old_rows GROUP BY album_id) d
+            WHERE s.album_id = d.album_id;
+
+            UPDATE year_track_stats y SET track_count = y.track_count - d.cnt
+            FROM (SELECT a.release_year, COUNT(*) AS cnt
+                  FROM old_rows o JOIN albums a ON a.id = o.album_id
+                  GROUP BY a.release_year) d
+            WHERE y.release_year = d.release_year;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION music_albums_stats() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        -- При смене года выпуска треки альбома переносятся в счетчик нового года
+        INSERT INTO year_track_stats AS y (release_year, track_count)
+        SELECT release_year, SUM(delta)
+        FROM (
+            SELECT o.release_year, -s.track_count AS delta
+            FROM old_rows o
+            JOIN new_rows n ON n.id = o.id
+            JOIN album_track_stats s ON s.album_id = o.id
+            WHERE o.release_year <> n.release_year
+            UNION ALL
+            SELECT n.release_year, s.track_count
+            FROM old_rows o
+            JOIN new_rows n ON n.id = o.id
+            JOIN album_track_stats s ON s.album_id = n.id
+            WHERE o.release_year <> n.release_year
+        ) changes
+        GROUP BY release_year
+        ON CONFLICT (release_year) DO UPDATE SET track_count = y.track_count + EXCLUDED.track_count;
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+
+# (таблица, функция, события); для каждого события создается отдельный триггер,
+# так как таблицы переходов допускаются только у триггеров с одним событием
+_TRIGGERS = [
+    ("artistgenres", "music_artistgenres_stats", ("INSERT", "UPDATE", "DELETE")),
+    ("tracks", "music_tracks_stats", ("INSERT", "UPDATE", "DELETE")),
+    ("albums", "music_albums_stats", ("UPDATE",)),
+]
+
+
+def _trigger_statements():
+    statements = []
+    for table, function, events in _TRIGGERS:
+        for event in events:
+            name = f"{table}_stats_{event.lower()}"
+            referencing = {
+                "INSERT": "NEW TABLE AS new_rows",
+                "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+                "DELETE": "OLD TABLE AS old_rows",
+            }[event]
+            statements.append(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            statements.append(
+                f"CREATE TRIGGER {name} AFTER {event} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+            )
+    return statements
+
+
+def create_music_db(conn):
+    """
+    Создание таблиц каталога, сводных таблиц и триггеров, которые их обновляют
+    Схема ведется миграциями (компонент "music" в migrations.py): при первой
+    установке сводные таблицы заполняются по текущим данным, а если все версии
+    уже применены, выполняется один запрос без DDL
+    """
+    # migrations импортирует схему из этого модуля, поэтому импорт здесь
+    import migrations
+
+    return migrations.ensure_schema(conn, ("music",))
+
+
+def _rebuild_stats(cur):
+    cur.execute("LOCK TABLE artistgenres, tracks, albums IN SHARE MODE")
+    cur.execute("TRUNCATE genre_artist_stats, album_track_stats, year_track_stats")
+    cur.execute("""
+        INSERT INTO genre_artist_stats (genre_id, artist_count)
+        SELECT genre_id, COUNT(*) FROM artistgenres GROUP BY genre_id
+    """)
+    cur.execute("""
+        INSERT INTO album_track_stats (album_id, track_count, total_duration)
+        SELECT album_id, COUNT(*), SUM(duration) FROM tracks GROUP BY album_id
+    """)
+    cur.execute("""
+        INSERT INTO year_track_stats (release_year, track_count)
+        SELECT a.release_year, COUNT(*)
+        FROM tracks t JOIN albums a ON a.id = t.album_id
+        GROUP BY a.release_year
+    """)
+
+
+def refresh_music_stats(conn):
+    """
+    Полный пересчет сводных таблиц (например, после загрузки данных с отключенными триггерами)
+    """
+    try:
+        with conn.cursor() as cur:
+            _rebuild_stats(cur)
+        conn.commit()
+        print("✅ Сводные таблицы каталога пересчитаны")
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при пересчете сводных таблиц: {e}")
+        return False
+
+
+def _report(conn, title, query, params=()):
+    """
+    Выполнение отчетного запроса с выводом результата
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            columns = [column.name for column in cur.description]
+            rows = cur.fetchall()
+
+        print(f"\n🎵 {title}")
+        print("-" * 70)
+        if not rows:
+            print("  нет данных")
+        for row in rows:
+            print("  " + " | ".join(f"{name}: {value}" for name, value in zip(columns, row)))
+        return rows
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при выполнении отчета: {e}")
+        return []
+
+
+# ЗАДАНИЕ 2
+
+def longest_tracks(conn):
+    """
+    2.1. Название и продолжительность самого длительного трека
+    """
+    return _report(conn, "Самый длительный трек", """
+        SELECT title, duration
+        FROM tracks
+        WHERE duration = (SELECT MAX(duration) FROM tracks)
+    """)
+
+
+def tracks_longer_than(conn, seconds=210):
+    """
+    2.2. Треки продолжительностью не менее seconds секунд
+    """
+    return _report(conn, f"Треки не короче {seconds} секунд", """
+        SELECT title, duration
+        FROM tracks
+        WHERE duration >= %s
+        ORDER BY duration
+    """, (seconds,))
+
+
+def collections_between(conn, year_from=2018, year_to=2020):
+    """
+    2.3. Сборники, вышедшие в период с year_from по year_to включительно
+    """
+    return _report(conn, f"Сборники {year_from}-{year_to} годов", """
+        SELECT title, release_year
+        FROM collections
+        WHERE release_year BETWEEN %s AND %s
+        ORDER BY release_year
+    """, (year_from, year_to))
+
+
+def single_word_artists(conn):
+    """
+    2.4. Исполнители, чье имя состоит из одного слова
+    """
+    return _report(conn, "Исполнители с именем из одного слова", """
+        SELECT name
+        FROM artists
+        WHERE name NOT LIKE '%% %%'
+    """)
+
+
+def tracks_with_word(conn, word="my"):
+    """
+    2.5. Треки, в названии которых есть слово word
+    """
+    word = word.lower()
+    return _report(conn, f"Треки со словом «{word}»", """
+        SELECT title
+        FROM tracks
+        WHERE LOWER(title) LIKE %s
+           OR LOWER(title) LIKE %s
+           OR LOWER(title) LIKE %s
+           OR LOWER(title) = %s
+    """, (f"% {word} %", f"{word} %", f"% {word}", word))
+
+
+# ЗАДАНИЕ 3 (агрегаты читаются из сводных таблиц)
+
+def artists_per_genre(conn):
+    """
+    3.1. Количество исполнителей в каждом жанре
+    """
+    return _report(conn, "Количество исполнителей в жанрах", """
+        SELECT g.name AS genre_name, COALESCE(s.artist_count, 0) AS artist_count
+        FROM genres g
+        LEFT JOIN genre_artist_stats s ON s.genre_id = g.id
+        ORDER BY artist_count DESC
+    """)
+
+
+def track_count_for_years(conn, year_from=2019, year_to=2020):
+    """
+    3.2. Количество треков, вошедших в альбомы year_from-year_to годов
+    """
+    rows = _report(conn, f"Треков в альбомах {year_from}-{year_to} годов", """
+        SELECT COALESCE(SUM(track_count), 0) AS track_count
+        FROM year_track_stats
+        WHERE release_year BETWEEN %s AND %s
+    """, (year_from, year_to))
+    return rows[0][0] if rows else 0
+
+
+def avg_track_duration_per_album(conn):
+    """
+    3.3. Средняя продолжительность треков по каждому альбому
+    """
+    return _report(conn, "Средняя продолжительность треков по альбомам", """
+        SELECT
+            a.title AS album_title,
+            ROUND(s.total_duration::numeric / s.track_count, 2) AS avg_duration_seconds,
+            CONCAT(
+                FLOOR(s.total_duration::numeric / s.track_count / 60), ' мин ',
+                ROUND((s.total_duration::numeric / s.track_count) %% 60), ' сек'
+            ) AS avg_duration_formatted,
+            s.track_count
+        FROM album_track_stats s
+        JOIN albums a ON a.id = s.album_id
+        WHERE s.track_count > 0
+        ORDER BY avg_duration_seconds DESC
+    """)
+
+
+def artists_without_albums_in(conn, year=2020):
+    """
+    3.4. Исполнители, которые не выпустили альбомы в году year
+    """
+    return _report(conn, f"Исполнители без альбомов {year} года", """
+        SELECT DISTINCT ar.name AS artist_name
+        FROM artists ar
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM albumartists aa
+            JOIN albums al ON aa.album_id = al.id
+            WHERE aa.artist_id = ar.id AND al.release_year = %s
+        )
+        ORDER BY ar.name
+    """, (year,))
+
+
+def collections_with_artist(conn, artist_name="The Beatles"):
+    """
+    3.5. Сборники, в которых присутствует исполнитель artist_name
+    """
+    return _report(conn, f"Сборники с исполнителем {artist_name}", """
+        SELECT DISTINCT
+            c.title AS collection_title,
+            c.release_year,
+            ar.name AS artist_name
+        FROM collections c
+        JOIN collectiontracks ct ON c.id = ct.collection_id
+        JOIN tracks t ON ct.track_id = t.id
+        JOIN albums al ON t.album_id = al.id
+        JOIN albumartists aa ON al.id = aa.album_id
+        JOIN artists ar ON aa.artist_id = ar.id
+        WHERE ar.name = %s
+        ORDER BY c.release_year
+    """, (artist_name,))
+
+
+# Поиск по названиям
+
+_SEARCH_SOURCES = {
+    "track": ("tracks", "title", "title_tsv"),
+    "album": ("albums", "title", "title_tsv"),
+    "artist": ("artists", "name", "name_tsv"),
+}
+
+
+def search_titles(conn, query, kinds=("track", "album", "artist"), limit=20):
+    """
+    Полнотекстовый поиск треков, альбомов и исполнителей по названию
+    Слова сравниваются целиком (знаки препинания - границы слов), с учетом
+    русских и английских словоформ; поддерживаются "фразы" и -исключения.
+    Возвращает список кортежей (kind, id, title, rank), лучшие совпадения первыми
+    """
+    unknown = [kind for kind in kinds if kind not in _SEARCH_SOURCES]
+    if unknown or not kinds:
+        print(f"❌ Неизвестные виды поиска: {', '.join(map(str, unknown)) or '(не указаны)'}; "
+              f"доступны: {', '.join(_SEARCH_SOURCES)}")
+        return []
+
+    parts = []
+    for kind in kinds:
+        table, column, vector = _SEARCH_SOURCES[kind]
+        parts.append(f"""
+            (SELECT '{kind}' AS kind, id, {column} AS title,
+                    ts_rank({vector}, music_title_tsq(%(query)s), 1) AS rank
+             FROM {table}
+             WHERE {vector} @@ music_title_tsq(%(query)s)
+             ORDER BY rank DESC, id
+             LIMIT %(limit)s)
+        """)
+
+    return _report(conn, f"Поиск «{query}»", f"""
+        SELECT kind, id, title, ROUND(rank::numeric, 4) AS rank
+        FROM ({" UNION ALL ".join(parts)}) found
+        ORDER BY rank DESC, kind, id
+        LIMIT %(limit)s
+    """, {"query": query, "limit": limit})
+
+
+def run_all_reports(conn):
+    """
+    Все отчеты заданий 2 и 3 подряд
+    """
+    longest_tracks(conn)
+    tracks_longer_than(conn)
+    collections_between(conn)
+    single_word_artists(conn)
+    tracks_with_word(conn)
+    artists_per_genre(conn)
+    track_count_for_years(conn)
+    avg_track_duration_per_album(conn)
+    artists_without_albums_in(conn)
+    collections_with_artist(conn)
+
+
+if __name__ == "__main__":
+    import sys
+
+    dsn = sys.argv[1] if len(sys.argv) > 1 else "dbname=music user=postgres host=localhost"
+    connection = psycopg2.connect(dsn)
+    try:
+        if create_music_db(connection):
+            run_all_reports(connection)
+    finally:
+        connection.close()
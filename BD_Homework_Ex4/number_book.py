@@ -1,23 +1,38 @@
+import csv
+import io
+import json
+import re
+import time
+
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from client_cache import ClientCache
+from db_pool import ConnectionPool
+import partitioning
+import prepared
+from instrumentation import InstrumentedConnection, instrumented, record_retry
 
 
-def create_database(db_name, user, password):
+def create_database(db_name, user, password, host="localhost", port="5432"):
     """
     Создает базу данных если она не существует
-    Использует контекстные менеджеры (with) для автоматического управления ресурсами
+    Использует контекстный менеджер (with) для курсора; соединение закрывается явно,
+    так как "with conn" в psycopg2 открывает транзакцию, в которой CREATE DATABASE недопустим
     """
     try:
         print(f"Попытка создания базы данных '{db_name}'...")
 
-        # Используем контекстный менеджер для подключения к postgres
-        with psycopg2.connect(
-                dbname="postgres",  # подключаемся к стандартной базе данных
-                user=user,
-                password=password,
-                host="localhost",
-                port="5432"
-        ) as conn:
+        # Подключаемся к стандартной базе данных postgres
+        conn = psycopg2.connect(
+            dbname="postgres",
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        try:
             # Устанавливаем autocommit для создания базы данных
             conn.autocommit = True
 
@@ -40,6 +55,8 @@ def create_database(db_name, user, password):
                     print(f"✅ База данных '{db_name}' создана успешно")
                 else:
                     print(f"ℹ️ База данных '{db_name}' уже существует")
+        finally:
+            conn.close()
 
         return True
 
@@ -56,9 +73,30 @@ def create_database(db_name, user, password):
         return False
 
 
-def connect_to_db(db_name, user, password):
+def create_pool(db_name, user, password, host="localhost", port="5432", minconn=1, maxconn=10, **options):
+    """
+    Создание пула соединений (см. db_pool.ConnectionPool)
+    Возвращает пул или None, если подключиться не удалось
     """
-    Подключение к базе данных с использованием контекстного менеджера
+    try:
+        return ConnectionPool(
+            dbname=db_name,
+            user=user,
+            password=password,
+            host=host,
+            port=port,
+            minconn=minconn,
+            maxconn=maxconn,
+            **options
+        )
+    except Exception as e:
+        print(f"❌ Ошибка подключения к базе данных: {e}")
+        return None
+
+
+def connect_to_db(db_name, user, password, host="localhost", port="5432"):
+    """
+    Подключение к базе данных
     Возвращает соединение, которое нужно закрыть вручную
     """
     try:
@@ -66,8 +104,9 @@ def connect_to_db(db_name, user, password):
             dbname=db_name,
             user=user,
             password=password,
-            host="localhost",
-            port="5432"
+            host=host,
+            port=port,
+            connection_factory=InstrumentedConnection
         )
         return conn
     except Exception as e:
@@ -75,134 +114,474 @@ def connect_to_db(db_name, user, password):
         return None
 
 
+# Структура таблиц клиентов (используется также в async_number_book.py)
+CLIENTS_SCHEMA = [
+    # Таблица клиентов
+    """
+    CREATE TABLE IF NOT EXISTS clients (
+        id SERIAL PRIMARY KEY,
+        first_name VARCHAR(50) NOT NULL,
+        last_name VARCHAR(50) NOT NULL,
+        email VARCHAR(100) UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Таблица телефонов
+    """
+    CREATE TABLE IF NOT EXISTS phones (
+        id SERIAL PRIMARY KEY,
+        client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+        phone_number VARCHAR(20) NOT NULL,
+        phone_normalized VARCHAR(20) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Индексы для ускорения поиска
+    """
+    CREATE INDEX IF NOT EXISTS idx_clients_name
+    ON clients(first_name, last_name)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_clients_email
+    ON clients(email)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_phones_client
+    ON phones(client_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_phones_number
+    ON phones(phone_number)
+    """,
+    # Нормализация номеров на стороне сервера (те же правила, что в normalize_phone)
+    r"""
+    CREATE OR REPLACE FUNCTION normalize_phone_number(phone TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE STRICT AS $$
+        SELECT CASE
+            WHEN d ~ '^8\d{10}$' THEN '7' || substr(d, 2)
+            WHEN d ~ '^9\d{9}$' THEN '7' || d
+            ELSE d
+        END
+        FROM (SELECT regexp_replace(phone, '\D', '', 'g') AS d) AS digits
+    $$
+    """,
+    # Заполнение нормализованных номеров в базах, созданных до появления колонки
+    """
+    ALTER TABLE phones ADD COLUMN IF NOT EXISTS phone_normalized VARCHAR(20)
+    """,
+    """
+    UPDATE phones SET phone_normalized = normalize_phone_number(phone_number)
+    WHERE phone_normalized IS NULL
+    """,
+    # text_pattern_ops позволяет использовать индекс и для поиска по префиксу (LIKE '7999%')
+    """
+    CREATE INDEX IF NOT EXISTS idx_phones_normalized
+    ON phones(phone_normalized text_pattern_ops)
+    """,
+    # Номер (в нормализованном виде) не повторяется у одного клиента. В базах,
+    # созданных до появления индекса, дубликаты сначала удаляются - остается
+    # самая ранняя запись
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_index
+            WHERE indexrelid = to_regclass('idx_phones_client_normalized') AND indisvalid
+        ) THEN
+            DELETE FROM phones p
+            USING phones q
+            WHERE p.client_id = q.client_id
+              AND p.phone_normalized = q.phone_normalized
+              AND p.id > q.id;
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_phones_client_normalized
+    ON phones(client_id, phone_normalized)
+    """,
+]
+
+def normalize_phone(phone):
+    """
+    Приведение номера телефона к каноническому виду: только цифры с кодом страны
+    (как в E.164, но без '+'). "+7 (999) 123-45-67" и "89991234567" дают "79991234567".
+    Правила совпадают с SQL-функцией normalize_phone_number.
+    """
+    digits = re.sub(r"\D", "", str(phone))
+    if not digits:
+        raise ValueError(f"номер телефона '{phone}' не содержит цифр")
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits.startswith("9"):
+        digits = "7" + digits
+    return digits
+
+
+# Необязательный кэш записей клиентов для lookup_client (см. enable_client_cache)
+_client_cache = None
+
+
+def enable_client_cache(max_size=10000, ttl=60.0):
+    """
+    Включение кэша клиентов для lookup_client
+    Кэш сбрасывается точечно всеми функциями, изменяющими клиентов и телефоны
+    """
+    global _client_cache
+    _client_cache = ClientCache(max_size=max_size, ttl=ttl)
+    return _client_cache
+
+
+def disable_client_cache():
+    global _client_cache
+    _client_cache = None
+
+
+def _invalidate_cache(client_ids=(), phones=()):
+    """
+    Сброс закэшированных клиентов и результатов поиска по номерам после изменения
+    """
+    if _client_cache is None:
+        return
+    for client_id in client_ids:
+        _client_cache.invalidate_client(client_id)
+    for phone in phones:
+        try:
+            _client_cache.invalidate_phone(normalize_phone(phone))
+        except ValueError:
+            pass
+
+
+# Триграммные GIN-индексы: позволяют использовать индекс для ILIKE '%...%'
+# в find_client и для нечеткого поиска в search_clients. Требуют расширения pg_trgm.
+TRIGRAM_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX IF NOT EXISTS idx_clients_first_name_trgm
+    ON clients USING gin (first_name gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_clients_last_name_trgm
+    ON clients USING gin (last_name gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_clients_email_trgm
+    ON clients USING gin (email gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_phones_number_trgm
+    ON phones USING gin (phone_number gin_trgm_ops)
+    """,
+]
+
+
+# Журнал изменений клиентов и телефонов для других процессов (change_feed.py).
+# Каждое изменение строки записывается компактным событием: сущность
+# (client/phone), операция (I/U/D), id клиента, email или нормализованный номер
+# и прежнее значение, если оно изменилось. txid - транзакция записи: подписчики
+# читают события в порядке (txid, id) только из завершенных транзакций, поэтому
+# событие транзакции, зафиксированной позже соседних, не пропускается.
+# pg_notify будит подписчиков при фиксации; одинаковые уведомления транзакции
+# сервер объединяет в одно
+CHANGE_LOG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS phonebook_changes (
+        id BIGSERIAL PRIMARY KEY,
+        txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+        entity VARCHAR(10) NOT NULL,
+        op CHAR(1) NOT NULL,
+        client_id INTEGER NOT NULL,
+        value VARCHAR(100),
+        old_value VARCHAR(100),
+        changed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_phonebook_changes_position
+    ON phonebook_changes(txid, id)
+    """,
+    # Позиции постоянных подписчиков: продолжение чтения после переподключения
+    """
+    CREATE TABLE IF NOT EXISTS phonebook_change_consumers (
+        consumer VARCHAR(100) PRIMARY KEY,
+        txid XID8 NOT NULL,
+        change_id BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Сущность передается аргументом триггера: у секционированной таблицы
+    # TG_TABLE_NAME - имя секции
+    """
+    CREATE OR REPLACE FUNCTION phonebook_log_change() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        row_data RECORD;
+        value TEXT;
+        old_value TEXT;
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+            RETURN NULL;
+        END IF;
+        row_data := CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END;
+        IF TG_ARGV[0] = 'client' THEN
+            value := row_data.email;
+            IF TG_OP = 'UPDATE' THEN
+                old_value := NULLIF(OLD.email, NEW.email);
+            END IF;
+            INSERT INTO phonebook_changes (entity, op, client_id, value, old_value)
+            VALUES ('client', left(TG_OP, 1), row_data.id, value, old_value);
+        ELSE
+            value := row_data.phone_normalized;
+            IF TG_OP = 'UPDATE' THEN
+                old_value := NULLIF(OLD.phone_normalized, NEW.phone_normalized);
+            END IF;
+            INSERT INTO phonebook_changes (entity, op, client_id, value, old_value)
+            VALUES ('phone', left(TG_OP, 1), row_data.client_id, value, old_value);
+        END IF;
+        PERFORM pg_notify('phonebook_changes', '');
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+
+# Триггеры журнала; создаются заново и при переходе на секционированные таблицы (partitioning.py)
+CHANGE_LOG_TRIGGERS = [
+    """
+    CREATE OR REPLACE TRIGGER clients_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON clients
+    FOR EACH ROW EXECUTE FUNCTION phonebook_log_change('client')
+    """,
+    """
+    CREATE OR REPLACE TRIGGER phones_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON phones
+    FOR EACH ROW EXECUTE FUNCTION phonebook_log_change('phone')
+    """,
+]
+
 def create_db(conn):
     """
     1. Функция, создающая структуру БД (таблицы)
+    Схема ведется миграциями (migrations.py): если все версии уже применены,
+    выполняется один запрос без DDL. Триграммные индексы создаются, если
+    доступно расширение pg_trgm
     """
-    try:
-        # Используем контекстные менеджеры для курсора
-        with conn.cursor() as cur:
-            # Создаем таблицу клиентов
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS clients (
-                    id SERIAL PRIMARY KEY,
-                    first_name VARCHAR(50) NOT NULL,
-                    last_name VARCHAR(50) NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    # migrations импортирует схему из этого модуля, поэтому импорт здесь
+    import migrations
 
-            # Создаем таблицу телефонов
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS phones (
-                    id SERIAL PRIMARY KEY,
-                    client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
-                    phone_number VARCHAR(20) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    return migrations.ensure_schema(conn, ("clients",))
 
-            # Создаем индексы для ускорения поиска
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_clients_name 
-                ON clients(first_name, last_name)
-            """)
 
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_clients_email 
-                ON clients(email)
-            """)
+# Режимы add_client при совпадении email: None - ошибка, "nothing" - оставить
+# существующего клиента, "update" - обновить имя и фамилию
+ON_CONFLICT_MODES = (None, "nothing", "update")
 
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_phones_client 
-                ON phones(client_id)
-            """)
 
-            cur.execute("""
-                CREATE INDEX IF NOT EXISTS idx_phones_number 
-                ON phones(phone_number)
-            """)
+def _merge_phones(cur, client_id, phones):
+    """
+    Добавление клиенту номеров, которых у него еще нет; возвращает число добавленных
 
-        conn.commit()
-        print("✅ Структура базы данных создана успешно")
-        return True
+    Номера вставляются одним запросом в порядке нормализованной формы: конкурентные
+    транзакции берут блокировки индекса в одном порядке и не блокируют друг друга
+    взаимно, а совпадения отбрасывает ON CONFLICT по (client_id, phone_normalized)
+    """
+    pairs = sorted(zip(*_unique_phones(phones)), key=lambda pair: pair[1])
+    if not pairs:
+        return 0
+    cur.execute(
+        """
+        INSERT INTO phones (client_id, phone_number, phone_normalized)
+        SELECT %s, w.num, w.norm
+        FROM unnest(%s::text[], %s::text[]) WITH ORDINALITY AS w(num, norm, ord)
+        ORDER BY w.ord
+        ON CONFLICT (client_id, phone_normalized) DO NOTHING
+        """,
+        (client_id, [pair[0] for pair in pairs], [pair[1] for pair in pairs])
+    )
+    return cur.rowcount
+
+
+def _insert_client(cur, first_name, last_name, email, phones=None):
+    """
+    Вставка клиента и его телефонов без фиксации транзакции; возвращает id клиента
+    """
+    cur.execute(
+        """
+        INSERT INTO clients (first_name, last_name, email)
+        VALUES (%s, %s, %s)
+        RETURNING id
+        """,
+        (first_name, last_name, email)
+    )
+
+    client_id = cur.fetchone()[0]
+
+    # Добавляем телефоны, если они есть
+    if phones:
+        _merge_phones(cur, client_id, phones)
+    return client_id
+
+
+# INSERT ... ON CONFLICT (email) для обычной и секционированной раскладки
+# (partitioning.py). У секционированной таблицы нет уникального индекса по
+# email: конфликт определяется по реестру client_emails, а id клиента
+# выделяется вместе с записью реестра. xmax = 0 только у только что вставленной
+# строки (у секционированной таблицы системные столбцы в RETURNING недоступны -
+# проверяется запись реестра)
+_UPSERT_CLIENT = {
+    (False, "update"): """
+        INSERT INTO clients (first_name, last_name, email)
+        VALUES (%(first_name)s, %(last_name)s, %(email)s)
+        ON CONFLICT (email) DO UPDATE
+        SET first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name
+        RETURNING id, xmax = 0
+    """,
+    (False, "nothing"): """
+        INSERT INTO clients (first_name, last_name, email)
+        VALUES (%(first_name)s, %(last_name)s, %(email)s)
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id
+    """,
+    (True, "update"): """
+        WITH reserved AS (
+            INSERT INTO client_emails (email, client_id)
+            VALUES (%(email)s, nextval('clients_id_seq'))
+            ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+            RETURNING client_id, xmax = 0 AS created
+        )
+        INSERT INTO clients (id, first_name, last_name, email)
+        SELECT client_id, %(first_name)s, %(last_name)s, %(email)s FROM reserved
+        ON CONFLICT (id) DO UPDATE
+        SET first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name
+        RETURNING id, (SELECT created FROM reserved)
+    """,
+    (True, "nothing"): """
+        WITH reserved AS (
+            INSERT INTO client_emails (email, client_id)
+            VALUES (%(email)s, nextval('clients_id_seq'))
+            ON CONFLICT (email) DO NOTHING
+            RETURNING client_id
+        )
+        INSERT INTO clients (id, first_name, last_name, email)
+        SELECT client_id, %(first_name)s, %(last_name)s, %(email)s FROM reserved
+        RETURNING id
+    """,
+}
 
-    except Exception as e:
-        conn.rollback()
-        print(f"❌ Ошибка при создании таблиц: {e}")
-        return False
 
+def _upsert_client(cur, first_name, last_name, email, on_conflict):
+    """
+    Вставка клиента через INSERT ... ON CONFLICT (email) без фиксации транзакции
+    Возвращает (id, создан ли клиент); (None, False), если email занят и on_conflict=None
+    """
+    partitioned = partitioning.is_partitioned(cur.connection)
+    params = {"first_name": first_name, "last_name": last_name, "email": email}
+    if on_conflict == "update":
+        prepared.execute(cur, _UPSERT_CLIENT[partitioned, "update"], params)
+        return cur.fetchone()
 
-def add_client(conn, first_name, last_name, email, phones=None):
+    while True:
+        prepared.execute(cur, _UPSERT_CLIENT[partitioned, "nothing"], params)
+        row = cur.fetchone()
+        if row:
+            return row[0], True
+        if on_conflict is None:
+            return None, False
+
+        # Отдельный запрос видит клиента, зафиксированного конкурентной транзакцией;
+        # FOR SHARE не дает удалить его, пока добавляются телефоны
+        prepared.execute(cur, "SELECT id FROM clients WHERE email = %s FOR SHARE", (email,))
+        row = cur.fetchone()
+        if row:
+            return row[0], False
+        # Клиента удалили между запросами - вставляем заново
+        record_retry()
+
+
+@instrumented
+def add_client(conn, first_name, last_name, email, phones=None, on_conflict=None):
     """
     2. Функция, позволяющая добавить нового клиента
+
+    on_conflict задает поведение, если клиент с таким email уже есть:
+    None - ошибка (возвращается None), "nothing" - данные клиента не меняются,
+    "update" - обновляются имя и фамилия. В обоих режимах к клиенту добавляются
+    телефоны, которых у него еще нет, и возвращается его id. Проверка email и
+    вставка выполняются одним запросом, без неудачной транзакции при совпадении.
     """
+    if on_conflict not in ON_CONFLICT_MODES:
+        print(f"❌ Неизвестный режим on_conflict: {on_conflict}")
+        return None
+
     try:
         with conn.cursor() as cur:
-            # Добавляем клиента
-            cur.execute(
-                """
-                INSERT INTO clients (first_name, last_name, email)
-                VALUES (%s, %s, %s)
-                RETURNING id
-                """,
-                (first_name, last_name, email)
-            )
-
-            client_id = cur.fetchone()[0]
+            client_id, created = _upsert_client(cur, first_name, last_name, email, on_conflict)
+            if client_id is None:
+                conn.rollback()
+                print(f"❌ Ошибка: клиент с email '{email}' уже существует")
+                return None
 
-            # Добавляем телефоны, если они есть
-            if phones:
-                for phone in phones:
-                    cur.execute(
-                        """
-                        INSERT INTO phones (client_id, phone_number)
-                        VALUES (%s, %s)
-                        """,
-                        (client_id, phone)
-                    )
+            added = _merge_phones(cur, client_id, phones) if phones else 0
 
             conn.commit()
-            print(f"✅ Клиент {first_name} {last_name} добавлен (ID: {client_id})")
+            _invalidate_cache([] if created else [client_id], phones or [])
+            if created:
+                print(f"✅ Клиент {first_name} {last_name} добавлен (ID: {client_id})")
+            elif on_conflict == "update":
+                print(f"✅ Клиент с email '{email}' обновлен (ID: {client_id}), добавлено телефонов: {added}")
+            else:
+                print(f"ℹ️ Клиент с email '{email}' уже существует (ID: {client_id}), добавлено телефонов: {added}")
             return client_id
 
-    except psycopg2.IntegrityError as e:
+    except psycopg2.errors.InvalidColumnReference as e:
+        # ON CONFLICT (email) без уникального индекса: таблицы перевели на
+        # секционированную раскладку, пока соединение было открыто
         conn.rollback()
-        if "unique constraint" in str(e).lower() and "email" in str(e).lower():
-            print(f"❌ Ошибка: клиент с email '{email}' уже существует")
-        else:
-            print(f"❌ Ошибка при добавлении клиента: {e}")
+        if partitioning.layout_changed(conn):
+            return add_client(conn, first_name, last_name, email, phones, on_conflict)
+        print(f"❌ Ошибка при добавлении клиента: {e}")
         return None
     except Exception as e:
         conn.rollback()
-        print(f"❌ Ошибка: {e}")
+        print(f"❌ Ошибка при добавлении клиента: {e}")
         return None
 
 
+@instrumented
 def add_phone(conn, client_id, phone):
     """
     3. Функция, позволяющая добавить телефон для существующего клиента
     """
     try:
-        # Проверяем существует ли клиент
-        with conn.cursor() as cur:
-            cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
-            if not cur.fetchone():
-                print(f"❌ Ошибка: клиент с ID {client_id} не найден")
-                return False
-
         with conn.cursor() as cur:
-            # Добавляем телефон
-            cur.execute(
+            # Проверка клиента и вставка одним запросом: если клиента нет,
+            # SELECT не вернет строк и ничего не будет вставлено
+            prepared.execute(
+                cur,
                 """
-                INSERT INTO phones (client_id, phone_number)
-                VALUES (%s, %s)
+                INSERT INTO phones (client_id, phone_number, phone_normalized)
+                SELECT id, %s, %s FROM clients WHERE id = %s
+                ON CONFLICT (client_id, phone_normalized) DO NOTHING
+                RETURNING id
                 """,
-                (client_id, phone)
+                (phone, normalize_phone(phone), client_id)
             )
+            inserted = cur.fetchone()
+            if not inserted:
+                # Номер уже есть у клиента или клиента нет
+                prepared.execute(cur, "SELECT 1 FROM clients WHERE id = %s", (client_id,))
+                exists = cur.fetchone()
 
             conn.commit()
+            if not inserted:
+                if exists:
+                    print(f"ℹ️ Телефон {phone} уже есть у клиента с ID: {client_id}")
+                    return True
+                print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+                return False
+            _invalidate_cache([client_id], [phone])
+
             print(f"✅ Телефон {phone} добавлен клиенту с ID: {client_id}")
             return True
 
@@ -212,55 +591,62 @@ def add_phone(conn, client_id, phone):
         return False
 
 
+@instrumented
 def change_client(conn, client_id, first_name=None, last_name=None, email=None, phones=None):
     """
     4. Функция, позволяющая изменить данные о клиенте
+    Проверка существования, обновление данных и телефонов выполняются одним запросом
     """
     try:
-        # Проверяем существует ли клиент
-        with conn.cursor() as cur:
-            cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
-            if not cur.fetchone():
-                print(f"❌ Ошибка: клиент с ID {client_id} не найден")
-                return False
-
         # Формируем запрос на обновление данных клиента
         updates = []
-        params = []
+        params = {"client_id": client_id}
 
         if first_name is not None:
-            updates.append("first_name = %s")
-            params.append(first_name)
+            updates.append("first_name = %(first_name)s")
+            params["first_name"] = first_name
 
         if last_name is not None:
-            updates.append("last_name = %s")
-            params.append(last_name)
+            updates.append("last_name = %(last_name)s")
+            params["last_name"] = last_name
 
         if email is not None:
-            updates.append("email = %s")
-            params.append(email)
+            updates.append("email = %(email)s")
+            params["email"] = email
 
+        # target - обновленный (или заблокированный для изменения телефонов) клиент;
+        # если клиента нет, target пуст и остальные части запроса ничего не делают
         if updates:
-            params.append(client_id)
-            query = f"UPDATE clients SET {', '.join(updates)} WHERE id = %s"
-
-            with conn.cursor() as cur:
-                cur.execute(query, tuple(params))
+            query = f"""
+                WITH target AS (
+                    UPDATE clients SET {', '.join(updates)}
+                    WHERE id = %(client_id)s
+                    RETURNING id
+                )"""
+        else:
+            query = """
+                WITH target AS (
+                    SELECT id FROM clients WHERE id = %(client_id)s FOR UPDATE
+                )"""
 
-        # Обновляем телефоны, если они предоставлены
+        # Обновляем телефоны, если они предоставлены: удаляются только
+        # отсутствующие в новом списке, добавляются только новые
         if phones is not None:
-            with conn.cursor() as cur:
-                # Удаляем все существующие телефоны
-                cur.execute("DELETE FROM phones WHERE client_id = %s", (client_id,))
+            params["numbers"], params["normalized"] = _unique_phones(phones)
+            query += ", " + _REPLACE_PHONES_CTES
 
-                # Добавляем новые телефоны
-                for phone in phones:
-                    cur.execute(
-                        "INSERT INTO phones (client_id, phone_number) VALUES (%s, %s)",
-                        (client_id, phone)
-                    )
+        query += " SELECT id FROM target"
+
+        with conn.cursor() as cur:
+            prepared.execute(cur, query, params)
+            found = cur.fetchone()
 
         conn.commit()
+        _invalidate_cache([client_id], phones or [])
+        if not found:
+            print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+            return False
+
         print(f"✅ Данные клиента с ID {client_id} обновлены")
         return True
 
@@ -274,31 +660,147 @@ def change_client(conn, client_id, first_name=None, last_name=None, email=None,
         return False
 
 
-def delete_phone(conn, client_id, phone):
+def _unique_phones(phones):
     """
-    5. Функция, позволяющая удалить телефон для существующего клиента
+    Номера и их нормализованные формы без повторов (по нормализованной форме)
+    """
+    numbers, normalized = [], []
+    for phone in phones:
+        canonical = normalize_phone(phone)
+        if canonical not in normalized:
+            numbers.append(phone)
+            normalized.append(canonical)
+    return numbers, normalized
+
+
+# Замена телефонов клиентов из CTE target(id) на список %(numbers)s / %(normalized)s.
+# Удаляются только номера, которых нет в новом списке, и добавляются только
+# отсутствующие у клиента, поэтому совпадающие строки (и их created_at) не трогаются.
+_REPLACE_PHONES_CTES = """
+    deleted AS (
+        DELETE FROM phones p
+        USING target t
+        WHERE p.client_id = t.id
+          AND NOT (p.phone_normalized = ANY(%(normalized)s::text[]))
+        RETURNING 1
+    ), inserted AS (
+        INSERT INTO phones (client_id, phone_number, phone_normalized)
+        SELECT t.id, w.num, w.norm
+        FROM target t
+        CROSS JOIN unnest(%(numbers)s::text[], %(normalized)s::text[])
+            WITH ORDINALITY AS w(num, norm, ord)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM phones p
+            WHERE p.client_id = t.id AND p.phone_normalized = w.norm
+        )
+        ORDER BY t.id, w.ord
+        ON CONFLICT (client_id, phone_normalized) DO NOTHING
+        RETURNING 1
+    )
+"""
+
+
+def _replace_phones(cur, client_ids, phones):
+    """
+    Замена списка телефонов у клиентов client_ids одним запросом
+    Возвращает (удалено, добавлено)
+    """
+    numbers, normalized = _unique_phones(phones)
+    cur.execute(
+        "WITH target AS (SELECT id FROM clients WHERE id = ANY(%(client_ids)s)), "
+        + _REPLACE_PHONES_CTES
+        + " SELECT (SELECT COUNT(*) FROM deleted), (SELECT COUNT(*) FROM inserted)",
+        {"client_ids": list(client_ids), "numbers": numbers, "normalized": normalized}
+    )
+    return cur.fetchone()
+
+
+@instrumented
+def change_clients_phones(conn, client_ids, phones=None, add=None, remove=None):
+    """
+    Вспомогательная функция: одинаковое изменение телефонов у многих клиентов
+    за один запрос к серверу
+
+    phones - новый полный список телефонов (как в change_client), либо
+    add/remove - номера, которые нужно добавить и удалить. Несуществующие id
+    пропускаются. Возвращает словарь {"removed": n, "added": n} или None при ошибке.
     """
     try:
-        # Проверяем существует ли клиент
         with conn.cursor() as cur:
-            cur.execute("SELECT id FROM clients WHERE id = %s", (client_id,))
-            if not cur.fetchone():
-                print(f"❌ Ошибка: клиент с ID {client_id} не найден")
-                return False
+            if phones is not None:
+                removed, added = _replace_phones(cur, client_ids, phones)
+            else:
+                add_numbers, add_normalized = _unique_phones(add or [])
+                remove_normalized = [normalize_phone(phone) for phone in remove or []]
+                cur.execute("""
+                    WITH deleted AS (
+                        DELETE FROM phones p
+                        WHERE p.client_id = ANY(%(client_ids)s)
+                          AND p.phone_normalized = ANY(%(remove)s::text[])
+                        RETURNING 1
+                    ), inserted AS (
+                        INSERT INTO phones (client_id, phone_number, phone_normalized)
+                        SELECT c.id, w.num, w.norm
+                        FROM clients c
+                        CROSS JOIN unnest(%(numbers)s::text[], %(normalized)s::text[])
+                            WITH ORDINALITY AS w(num, norm, ord)
+                        WHERE c.id = ANY(%(client_ids)s)
+                          AND NOT EXISTS (
+                              SELECT 1 FROM phones p
+                              WHERE p.client_id = c.id AND p.phone_normalized = w.norm
+                          )
+                        ORDER BY c.id, w.ord
+                        ON CONFLICT (client_id, phone_normalized) DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT (SELECT COUNT(*) FROM deleted), (SELECT COUNT(*) FROM inserted)
+                """, {"client_ids": list(client_ids), "remove": remove_normalized,
+                      "numbers": add_numbers, "normalized": add_normalized})
+                removed, added = cur.fetchone()
+
+        conn.commit()
+        _invalidate_cache(client_ids, (phones if phones is not None else add) or [])
+        print(f"✅ Телефоны обновлены у {len(client_ids)} клиент(ов): удалено {removed}, добавлено {added}")
+        return {"removed": removed, "added": added}
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при обновлении телефонов: {e}")
+        return None
 
+
+@instrumented
+def delete_phone(conn, client_id, phone):
+    """
+    5. Функция, позволяющая удалить телефон для существующего клиента
+    """
+    try:
         with conn.cursor() as cur:
-            # Удаляем телефон
-            cur.execute(
+            # Проверка клиента и удаление телефона (по нормализованному номеру) одним запросом
+            prepared.execute(
+                cur,
                 """
-                DELETE FROM phones 
-                WHERE client_id = %s AND phone_number = %s
+                WITH target AS (
+                    SELECT id FROM clients WHERE id = %s
+                ), deleted AS (
+                    DELETE FROM phones p
+                    USING target t
+                    WHERE p.client_id = t.id AND p.phone_normalized = %s
+                    RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM target), (SELECT COUNT(*) FROM deleted)
                 """,
-                (client_id, phone)
+                (client_id, normalize_phone(phone))
             )
+            found, deleted = cur.fetchone()
 
             conn.commit()
+            _invalidate_cache([client_id])
 
-            if cur.rowcount > 0:
+            if not found:
+                print(f"❌ Ошибка: клиент с ID {client_id} не найден")
+                return False
+            elif deleted > 0:
                 print(f"✅ Телефон {phone} удален у клиента с ID: {client_id}")
                 return True
             else:
@@ -311,28 +813,177 @@ def delete_phone(conn, client_id, phone):
         return False
 
 
+def _phone_batches(pairs, chunk_size):
+    """
+    Разбиение пар (client_id, phone) на порции с нормализацией номеров
+    Выдает списки (порядковый номер, client_id, phone, нормализованный номер или None)
+    """
+    chunk = []
+    for index, (client_id, phone) in enumerate(pairs):
+        try:
+            normalized = normalize_phone(phone)
+        except ValueError:
+            normalized = None
+        chunk.append((index, client_id, phone, normalized))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@instrumented
+def add_phones(conn, pairs, chunk_size=1000):
+    """
+    Вспомогательная функция: пакетное добавление телефонов
+
+    pairs - список пар (client_id, phone). Номера вставляются многострочным
+    INSERT ... VALUES (execute_values) порциями по chunk_size, каждая порция -
+    одна транзакция. Возвращает словарь: results - True/False для каждой пары,
+    missing_clients - id несуществующих клиентов, errors - число порций с ошибкой.
+    """
+    results = []
+    missing_clients = set()
+    errors = 0
+
+    for chunk in _phone_batches(pairs, chunk_size):
+        rows = [(index, client_id, phone, normalized)
+                for index, client_id, phone, normalized in chunk if normalized is not None]
+        missing = set()
+        try:
+            if rows:
+                with conn.cursor() as cur:
+                    missing = {row[0] for row in execute_values(
+                        cur,
+                        """
+                        WITH v (ord, client_id, phone_number, phone_normalized) AS (VALUES %s),
+                        inserted AS (
+                            INSERT INTO phones (client_id, phone_number, phone_normalized)
+                            SELECT v.client_id, v.phone_number, v.phone_normalized
+                            FROM v
+                            JOIN clients c ON c.id = v.client_id
+                            ORDER BY v.ord
+                            ON CONFLICT (client_id, phone_normalized) DO NOTHING
+                        )
+                        SELECT DISTINCT v.client_id
+                        FROM v
+                        WHERE NOT EXISTS (SELECT 1 FROM clients c WHERE c.id = v.client_id)
+                        """,
+                        rows,
+                        template="(%s, %s::integer, %s::varchar, %s::varchar)",
+                        page_size=len(rows),
+                        fetch=True
+                    )}
+                conn.commit()
+                _invalidate_cache({row[1] for row in rows}, [row[2] for row in rows])
+            ok = True
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка при добавлении телефонов: {e}")
+            errors += 1
+            ok = False
+
+        missing_clients |= missing
+        results.extend(ok and normalized is not None and client_id not in missing
+                       for _, client_id, _, normalized in chunk)
+
+    print(f"✅ Добавлено телефонов: {sum(results)} из {len(results)}")
+    if missing_clients:
+        print(f"ℹ️ Клиенты не найдены: {len(missing_clients)}")
+    return {"results": results, "missing_clients": sorted(missing_clients), "errors": errors}
+
+
+@instrumented
+def delete_phones(conn, pairs, chunk_size=1000):
+    """
+    Вспомогательная функция: пакетное удаление телефонов
+
+    pairs - список пар (client_id, phone). Удаление выполняется одним
+    DELETE ... USING (VALUES ...) на порцию из chunk_size пар, каждая порция -
+    одна транзакция. Результат такой же, как у add_phones: results - был ли
+    удален номер, missing_clients - id несуществующих клиентов.
+    """
+    results = []
+    missing_clients = set()
+    errors = 0
+
+    for chunk in _phone_batches(pairs, chunk_size):
+        rows = [(index, client_id, normalized)
+                for index, client_id, _, normalized in chunk if normalized is not None]
+        deleted, missing = set(), set()
+        try:
+            if rows:
+                with conn.cursor() as cur:
+                    for kind, client_id, normalized in execute_values(
+                        cur,
+                        """
+                        WITH v (ord, client_id, phone_normalized) AS (VALUES %s),
+                        deleted AS (
+                            DELETE FROM phones p
+                            USING v
+                            WHERE p.client_id = v.client_id AND p.phone_normalized = v.phone_normalized
+                            RETURNING p.client_id, p.phone_normalized
+                        )
+                        SELECT 'deleted', client_id, phone_normalized FROM deleted
+                        UNION ALL
+                        SELECT DISTINCT 'missing', v.client_id, NULL
+                        FROM v
+                        WHERE NOT EXISTS (SELECT 1 FROM clients c WHERE c.id = v.client_id)
+                        """,
+                        rows,
+                        template="(%s, %s::integer, %s::varchar)",
+                        page_size=len(rows),
+                        fetch=True
+                    ):
+                        if kind == "deleted":
+                            deleted.add((client_id, normalized))
+                        else:
+                            missing.add(client_id)
+                conn.commit()
+                _invalidate_cache({row[1] for row in rows})
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Ошибка при удалении телефонов: {e}")
+            errors += 1
+
+        missing_clients |= missing
+        results.extend((client_id, normalized) in deleted for _, client_id, _, normalized in chunk)
+
+    print(f"✅ Удалено телефонов: {sum(results)} из {len(results)}")
+    if missing_clients:
+        print(f"ℹ️ Клиенты не найдены: {len(missing_clients)}")
+    return {"results": results, "missing_clients": sorted(missing_clients), "errors": errors}
+
+
+def _delete_client(cur, client_id):
+    """
+    Удаление клиента без фиксации транзакции; возвращает (first_name, last_name) или None
+    """
+    # Телефоны удалятся каскадно; имя возвращается тем же запросом
+    prepared.execute(
+        cur,
+        "DELETE FROM clients WHERE id = %s RETURNING first_name, last_name",
+        (client_id,)
+    )
+    return cur.fetchone()
+
+
+@instrumented
 def delete_client(conn, client_id):
     """
     6. Функция, позволяющая удалить существующего клиента
     """
     try:
-        # Проверяем существует ли клиент
         with conn.cursor() as cur:
-            cur.execute("SELECT id, first_name, last_name FROM clients WHERE id = %s", (client_id,))
-            client = cur.fetchone()
+            client = _delete_client(cur, client_id)
+            conn.commit()
+            _invalidate_cache([client_id])
 
             if not client:
                 print(f"❌ Ошибка: клиент с ID {client_id} не найден")
                 return False
 
-            client_name = f"{client[1]} {client[2]}"
-
-        with conn.cursor() as cur:
-            # Удаляем клиента (телефоны удалятся каскадно)
-            cur.execute("DELETE FROM clients WHERE id = %s", (client_id,))
-            conn.commit()
-
-            print(f"✅ Клиент '{client_name}' (ID: {client_id}) удален")
+            print(f"✅ Клиент '{client[0]} {client[1]}' (ID: {client_id}) удален")
             return True
 
     except Exception as e:
@@ -341,6 +992,7 @@ def delete_client(conn, client_id):
         return False
 
 
+@instrumented
 def find_client(conn, first_name=None, last_name=None, email=None, phone=None):
     """
     7. Функция, позволяющая найти клиента по его данным
@@ -351,7 +1003,7 @@ def find_client(conn, first_name=None, last_name=None, email=None, phone=None):
             query = """
                 SELECT DISTINCT c.id, c.first_name, c.last_name, c.email, 
                        COALESCE(
-                           STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at),
+                           STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at, p.id),
                            'нет телефона'
                        ) as phones
                 FROM clients c
@@ -375,12 +1027,18 @@ def find_client(conn, first_name=None, last_name=None, email=None, phone=None):
                 params.append(f'%{email}%')
 
             if phone:
-                query += " AND p.phone_number ILIKE %s"
-                params.append(f'%{phone}%')
+                digits = re.sub(r"\D", "", phone)
+                if digits:
+                    # Номер может быть записан в любом формате - ищем и по цифрам
+                    query += " AND (p.phone_number ILIKE %s OR p.phone_normalized LIKE %s)"
+                    params.extend([f'%{phone}%', f'%{digits}%'])
+                else:
+                    query += " AND p.phone_number ILIKE %s"
+                    params.append(f'%{phone}%')
 
             query += " GROUP BY c.id ORDER BY c.id"
 
-            cur.execute(query, params)
+            prepared.execute(cur, query, params)
             results = cur.fetchall()
 
             if results:
@@ -403,57 +1061,605 @@ def find_client(conn, first_name=None, last_name=None, email=None, phone=None):
         return []
 
 
-def display_all_clients(conn):
+@instrumented
+def lookup_client(conn, client_id=None, email=None, phone=None):
     """
-    Вспомогательная функция: отображение всех клиентов
+    Вспомогательная функция: точный поиск клиента по id, email или номеру телефона
+    через кэш (если он включен enable_client_cache)
+
+    В отличие от find_client ищет только точное совпадение, поэтому результат
+    можно кэшировать. Возвращает список кортежей (id, first_name, last_name, email, phones).
+    """
+    try:
+        # Телефоны выбираются коррелированным подзапросом по c.id
+        phones_condition, params = "p.client_id = c.id", ()
+        if client_id is not None:
+            key, condition, value = ("id", client_id), "c.id = %s", client_id
+            # Явный id позволяет отсечь лишние секции phones (partitioning.py) еще при планировании
+            phones_condition, params = "p.client_id = %s", (client_id,)
+        elif email is not None:
+            key, condition, value = ("email", email), "c.email = %s", email
+        elif phone is not None:
+            normalized = normalize_phone(phone)
+            key = ("phone", normalized)
+            condition = "c.id IN (SELECT client_id FROM phones WHERE phone_normalized = %s)"
+            value = normalized
+        else:
+            raise ValueError("нужно указать client_id, email или phone")
+
+        cache = _client_cache
+        results, generation = cache.get(key) if cache is not None else (None, None)
+        if results is None:
+            with conn.cursor() as cur:
+                prepared.execute(cur, f"""
+                    SELECT c.id, c.first_name, c.last_name, c.email,
+                           COALESCE(
+                               (SELECT STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at, p.id)
+                                FROM phones p WHERE {phones_condition}),
+                               'нет телефона'
+                           ) AS phones
+                    FROM clients c
+                    WHERE {condition}
+                    ORDER BY c.id
+                """, params + (value,))
+                results = cur.fetchall()
+            if cache is not None:
+                cache.put(key, results, generation)
+
+        if results:
+            for found_id, first_name, last_name, found_email, phones in results:
+                print(f"👤 ID: {found_id} - {first_name} {last_name}, {found_email}, телефоны: {phones}")
+        else:
+            print("🔍 Клиент не найден")
+        return results
+
+    except Exception as e:
+        print(f"❌ Ошибка при поиске клиента: {e}")
+        return []
+
+
+class Client:
+    """
+    Запись клиента из get_clients: phones - список номеров в порядке добавления
+    (пустой, если телефонов нет)
+    """
+    __slots__ = ("id", "first_name", "last_name", "email", "created_at", "phones")
+
+    def __init__(self, id, first_name, last_name, email, created_at, phones):
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.email = email
+        self.created_at = created_at
+        self.phones = phones
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "email": self.email,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "phones": self.phones,
+        }
+
+    def __repr__(self):
+        return f"Client({self.id}, {self.first_name} {self.last_name}, {self.email}, {self.phones})"
+
+
+@instrumented
+def get_clients(conn, ids):
+    """
+    Вспомогательная функция: получение клиентов по списку id одним запросом
+
+    Телефоны собираются на сервере в массив (ARRAY_AGG), строку разбирать не нужно.
+    Возвращает список Client в порядке ids (повторы - один раз, несуществующие id пропускаются).
     """
     try:
+        ids = list(dict.fromkeys(int(client_id) for client_id in ids))
+        if not ids:
+            return []
+
         with conn.cursor() as cur:
-            cur.execute("""
+            prepared.execute(cur, """
                 SELECT c.id, c.first_name, c.last_name, c.email, c.created_at,
+                       COALESCE(p.phones, '{}') AS phones
+                FROM clients c
+                LEFT JOIN LATERAL (
+                    SELECT ARRAY_AGG(phone_number ORDER BY created_at, id) AS phones
+                    FROM phones
+                    WHERE client_id = c.id
+                ) p ON TRUE
+                WHERE c.id = ANY(%s::bigint[])
+            """, (ids,))
+            found = {row[0]: Client(*row) for row in cur.fetchall()}
+
+        results = [found[client_id] for client_id in ids if client_id in found]
+        print(f"🔍 Найдено клиентов: {len(results)} из {len(ids)}")
+        return results
+
+    except Exception as e:
+        print(f"❌ Ошибка при получении клиентов: {e}")
+        return []
+
+
+@instrumented
+def find_client_by_phone(conn, phone, prefix=False, limit=100):
+    """
+    Вспомогательная функция: поиск клиента по номеру телефона (определитель номера)
+
+    Номер нормализуется и ищется по индексу idx_phones_normalized: точное
+    совпадение или, при prefix=True, все номера, начинающиеся с указанных цифр.
+    Возвращает список кортежей (id, first_name, last_name, email, phones).
+    """
+    try:
+        if prefix:
+            digits = re.sub(r"\D", "", phone)
+            if not digits:
+                raise ValueError(f"номер телефона '{phone}' не содержит цифр")
+            # Российский префикс 8 соответствует коду страны 7
+            if digits.startswith("8") and not phone.strip().startswith("+"):
+                digits = "7" + digits[1:]
+            condition, value = "phone_normalized LIKE %s", digits + "%"
+        else:
+            condition, value = "phone_normalized = %s", normalize_phone(phone)
+
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT c.id, c.first_name, c.last_name, c.email,
                        COALESCE(
-                           STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at),
+                           (SELECT STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at, p.id)
+                            FROM phones p WHERE p.client_id = c.id),
                            'нет телефона'
-                       ) as phones,
-                       COUNT(p.id) as phone_count
+                       ) AS phones
                 FROM clients c
-                LEFT JOIN phones p ON c.id = p.client_id
-                GROUP BY c.id, c.created_at
+                WHERE c.id IN (
+                    SELECT client_id FROM phones WHERE {condition} LIMIT %s
+                )
                 ORDER BY c.id
-            """)
+            """, (value, limit))
+            results = cur.fetchall()
 
-            clients = cur.fetchall()
+        if results:
+            print(f"\n📟 Номер {phone}: найдено {len(results)} клиент(ов)")
+            for client_id, first_name, last_name, email, phones in results:
+                print(f"  ID: {client_id} - {first_name} {last_name}, {email}, телефоны: {phones}")
+        else:
+            print(f"\n📟 Номер {phone}: клиенты не найдены")
+        return results
+
+    except Exception as e:
+        print(f"❌ Ошибка при поиске по номеру телефона: {e}")
+        return []
+
+
+@instrumented
+def search_clients(conn, name, limit=10, threshold=0.3):
+    """
+    Вспомогательная функция: нечеткий поиск клиентов по имени и фамилии
+    с учетом опечаток (триграммное сходство pg_trgm)
+
+    Каждое слово из name сравнивается с именем и фамилией; результаты
+    упорядочены по убыванию суммарного сходства. Возвращает список кортежей
+    (id, first_name, last_name, email, phones, score).
+    """
+    words = name.split()[:3]
+    if not words:
+        return []
+
+    try:
+        with conn.cursor() as cur:
+            # Порог сходства для оператора %, только в пределах этой транзакции
+            cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", (str(threshold),))
 
-            if not clients:
-                print("\n📭 В базе данных нет клиентов")
-                return
+            score = " + ".join(
+                ["GREATEST(similarity(c.first_name, %s), similarity(c.last_name, %s))"] * len(words)
+            )
+            condition = " OR ".join(["c.first_name %% %s OR c.last_name %% %s"] * len(words))
+            params = [word for word in words for _ in range(2)]
+
+            cur.execute(f"""
+                SELECT c.id, c.first_name, c.last_name, c.email,
+                       COALESCE(
+                           (SELECT STRING_AGG(p.phone_number, ', ' ORDER BY p.created_at, p.id)
+                            FROM phones p WHERE p.client_id = c.id),
+                           'нет телефона'
+                       ) AS phones,
+                       ROUND(({score})::numeric / %s, 3) AS score
+                FROM clients c
+                WHERE {condition}
+                ORDER BY score DESC, c.id
+                LIMIT %s
+            """, params + [len(words)] + params + [limit])
+            results = cur.fetchall()
+
+        if results:
+            print(f"\n🔍 Найдено {len(results)} похожих клиент(ов):")
+            print("-" * 70)
+            for client_id, first_name, last_name, email, phones, rank in results:
+                print(f"  ID: {client_id} (сходство {rank})")
+                print(f"    Имя: {first_name} {last_name}")
+                print(f"    Email: {email}")
+                print(f"    Телефоны: {phones}")
+                print("    " + "-" * 40)
+        else:
+            print("\n🔍 Похожие клиенты не найдены")
+        return results
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при поиске клиентов: {e}")
+        return []
+
+
+def iter_clients(conn, page_size=1000, after_id=0):
+    """
+    Вспомогательная функция: постраничный (keyset) обход всех клиентов
+
+    Генератор читает клиентов страницами по page_size записей условием
+    id > последний_id, поэтому в памяти находится не больше одной страницы,
+    а каждая страница читается по первичному ключу независимо от ее номера.
+    Выдает кортежи (id, first_name, last_name, email, created_at, phones, phone_count).
+    """
+    last_id = after_id
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.id, c.first_name, c.last_name, c.email, c.created_at,
+                       COALESCE(p.phones, 'нет телефона') AS phones,
+                       COALESCE(p.phone_count, 0) AS phone_count
+                FROM (
+                    SELECT * FROM clients
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                ) c
+                LEFT JOIN LATERAL (
+                    SELECT STRING_AGG(phone_number, ', ' ORDER BY created_at, id) AS phones,
+                           COUNT(*) AS phone_count
+                    FROM phones
+                    WHERE client_id = c.id
+                ) p ON TRUE
+                ORDER BY c.id
+            """, (last_id, page_size))
+            page = cur.fetchall()
 
-            print("\n" + "=" * 70)
-            print("📋 СПИСОК ВСЕХ КЛИЕНТОВ")
-            print("=" * 70)
+        yield from page
 
-            total_clients = 0
-            total_phones = 0
+        if len(page) < page_size:
+            return
+        last_id = page[-1][0]
 
-            for client in clients:
-                client_id, first_name, last_name, email, created_at, phones, phone_count = client
-                total_clients += 1
-                total_phones += phone_count if phone_count else 0
 
-                print(f"\n👤 ID: {client_id}")
-                print(f"   Имя: {first_name} {last_name}")
-                print(f"   Email: {email}")
-                print(f"   Телефоны: {phones}")
-                print(f"   Количество телефонов: {phone_count}")
-                print(f"   Дата регистрации: {created_at.strftime('%Y-%m-%d %H:%M')}")
+def display_all_clients(conn, page_size=1000):
+    """
+    Вспомогательная функция: отображение всех клиентов
+    Клиенты читаются постранично через iter_clients, поэтому память не зависит от размера таблицы
+    """
+    try:
+        total_clients = 0
+        total_phones = 0
+
+        for client in iter_clients(conn, page_size):
+            if total_clients == 0:
+                print("\n" + "=" * 70)
+                print("📋 СПИСОК ВСЕХ КЛИЕНТОВ")
+                print("=" * 70)
+
+            client_id, first_name, last_name, email, created_at, phones, phone_count = client
+            total_clients += 1
+            total_phones += phone_count
+
+            print(f"\n👤 ID: {client_id}")
+            print(f"   Имя: {first_name} {last_name}")
+            print(f"   Email: {email}")
+            print(f"   Телефоны: {phones}")
+            print(f"   Количество телефонов: {phone_count}")
+            print(f"   Дата регистрации: {created_at.strftime('%Y-%m-%d %H:%M')}")
+
+        if not total_clients:
+            print("\n📭 В базе данных нет клиентов")
+            return
 
-            print("\n" + "=" * 70)
-            print(f"📊 ИТОГО: {total_clients} клиент(ов), {total_phones} телефон(ов)")
-            print("=" * 70)
+        print("\n" + "=" * 70)
+        print(f"📊 ИТОГО: {total_clients} клиент(ов), {total_phones} телефон(ов)")
+        print("=" * 70)
 
     except Exception as e:
         print(f"❌ Ошибка при получении клиентов: {e}")
 
+
+def _copy_value(value):
+    """
+    Экранирование значения для текстового формата COPY
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _read_clients_source(source):
+    """
+    Вспомогательная функция: построчное чтение клиентов из CSV/JSONL файла
+    или любого итерируемого объекта
+
+    Каждый клиент возвращается как кортеж (first_name, last_name, email, phones).
+    В CSV ожидаются колонки first_name, last_name, email, phones
+    (телефоны перечисляются через ';').
+    """
+    if isinstance(source, str):
+        if source.endswith(".csv"):
+            with open(source, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    phones = [p for p in (row.get("phones") or "").split(";") if p.strip()]
+                    yield row.get("first_name"), row.get("last_name"), row.get("email"), phones
+        else:
+            with open(source, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield _client_tuple(json.loads(line))
+        return
+
+    for item in source:
+        yield _client_tuple(item)
+
+
+def _client_tuple(item):
+    """
+    Приведение словаря или кортежа к виду (first_name, last_name, email, phones)
+    """
+    if isinstance(item, dict):
+        return (item.get("first_name"), item.get("last_name"),
+                item.get("email"), item.get("phones") or [])
+    first_name, last_name, email, *rest = item
+    return first_name, last_name, email, (rest[0] if rest else None) or []
+
+
+@instrumented
+def import_clients(conn, source, chunk_size=10000, max_rejected=1000):
+    """
+    Вспомогательная функция: массовый импорт клиентов и их телефонов через COPY
+
+    source - путь к CSV/JSONL файлу или итерируемый объект (словари или кортежи).
+    Данные читаются порциями по chunk_size клиентов: каждая порция загружается
+    через COPY FROM STDIN во временные таблицы, после чего одним запросом
+    переносится в clients и phones (сгенерированные id сопоставляются на
+    стороне сервера). Каждая порция фиксируется отдельной транзакцией, поэтому
+    память ограничена размером порции.
+
+    Клиенты с уже существующим email (в базе или выше в той же порции)
+    отклоняются, не прерывая загрузку. Так же отклоняются отдельные телефоны
+    без цифр или длиннее колонок phones (20 символов), а клиент импортируется
+    (invalid_phones, rejected_phones - {"email", "phone"}).
+    Возвращает словарь со статистикой.
+    """
+    stats = {"imported": 0, "phones": 0, "rejected": 0, "invalid": 0, "invalid_phones": 0,
+             "rejected_emails": [], "rejected_phones": [], "seconds": 0.0, "rows_per_second": 0.0}
+    started = time.perf_counter()
+    # Импорт долгий - раскладка таблиц определяется заново, а не берется из прошлых вызовов
+    partitioning.forget(conn)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS import_clients_stage (
+                    seq INTEGER NOT NULL,
+                    first_name VARCHAR(50) NOT NULL,
+                    last_name VARCHAR(50) NOT NULL,
+                    email VARCHAR(100) NOT NULL
+                ) ON COMMIT DELETE ROWS
+            """)
+            # Номер без ограничения длины: слишком длинный номер не прерывает COPY
+            # всей порции, а отклоняется при переносе в phones
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS import_phones_stage (
+                    seq INTEGER NOT NULL,
+                    phone_number TEXT
+                ) ON COMMIT DELETE ROWS
+            """)
+        conn.commit()
+
+        chunk = []
+        for client in _read_clients_source(source):
+            first_name, last_name, email, phones = client
+            if not (first_name and last_name and email):
+                stats["invalid"] += 1
+                continue
+            chunk.append(client)
+            if len(chunk) >= chunk_size:
+                _import_chunk(conn, chunk, stats, max_rejected)
+                chunk = []
+        if chunk:
+            _import_chunk(conn, chunk, stats, max_rejected)
+
+    except Exception as e:
+        conn.rollback()
+        print(f"❌ Ошибка при импорте клиентов: {e}")
+
+    stats["seconds"] = time.perf_counter() - started
+    if stats["seconds"] > 0:
+        stats["rows_per_second"] = (stats["imported"] + stats["phones"]) / stats["seconds"]
+
+    print(f"✅ Импортировано клиентов: {stats['imported']}, телефонов: {stats['phones']} "
+          f"({stats['rows_per_second']:.0f} строк/сек)")
+    if stats["rejected"]:
+        print(f"ℹ️ Отклонено клиентов с повторяющимся email: {stats['rejected']}")
+    if stats["invalid"]:
+        print(f"ℹ️ Пропущено неполных записей: {stats['invalid']}")
+    if stats["invalid_phones"]:
+        print(f"ℹ️ Отклонено некорректных телефонов: {stats['invalid_phones']}")
+    return stats
+
+
+# Вставка первых вхождений email из порции импорта (см. _UPSERT_CLIENT)
+_IMPORT_CLIENTS = {
+    False: """
+        inserted AS (
+            INSERT INTO clients (first_name, last_name, email)
+            SELECT first_name, last_name, email FROM firsts ORDER BY seq
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id, email
+        )
+    """,
+    True: """
+        reserved AS (
+            INSERT INTO client_emails (email, client_id)
+            SELECT email, nextval('clients_id_seq') FROM firsts ORDER BY seq
+            ON CONFLICT (email) DO NOTHING
+            RETURNING email, client_id
+        ), inserted AS (
+            INSERT INTO clients (id, first_name, last_name, email)
+            SELECT r.client_id, f.first_name, f.last_name, f.email
+            FROM reserved r
+            JOIN firsts f ON f.email = r.email
+            RETURNING id, email
+        )
+    """,
+}
+
+
+def _import_chunk(conn, chunk, stats, max_rejected):
+    """
+    Загрузка одной порции клиентов в рамках одной транзакции
+    """
+    clients_buf = io.StringIO()
+    phones_buf = io.StringIO()
+    for seq, (first_name, last_name, email, phones) in enumerate(chunk):
+        clients_buf.write(
+            f"{seq}\t{_copy_value(first_name)}\t{_copy_value(last_name)}\t{_copy_value(email)}\n"
+        )
+        for phone in phones:
+            phones_buf.write(f"{seq}\t{_copy_value(phone)}\n")
+    clients_buf.seek(0)
+    phones_buf.seek(0)
+
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                "COPY import_clients_stage (seq, first_name, last_name, email) FROM STDIN",
+                clients_buf
+            )
+            cur.copy_expert(
+                "COPY import_phones_stage (seq, phone_number) FROM STDIN",
+                phones_buf
+            )
+
+            # Первое вхождение каждого email в порции вставляется, остальные
+            # (и уже существующие в базе) отклоняются через ON CONFLICT
+            cur.execute("""
+                WITH firsts AS (
+                    SELECT DISTINCT ON (email) seq, first_name, last_name, email
+                    FROM import_clients_stage
+                    ORDER BY email, seq
+                ), """ + _IMPORT_CLIENTS[partitioning.is_partitioned(conn)] + """, mapped AS (
+                    SELECT i.id, f.seq
+                    FROM inserted i
+                    JOIN firsts f ON f.email = i.email
+                ), staged_phones AS (
+                    -- Номер без цифр нормализуется в '' и совпал бы с другими такими же
+                    -- номерами клиента; длина ограничена колонками phones
+                    SELECT seq, phone_number, normalized,
+                           COALESCE(normalized <> '' AND length(normalized) <= 20
+                                    AND length(phone_number) <= 20, FALSE) AS valid
+                    FROM (
+                        SELECT seq, phone_number, normalize_phone_number(phone_number) AS normalized
+                        FROM import_phones_stage
+                    ) AS s
+                ), inserted_phones AS (
+                    INSERT INTO phones (client_id, phone_number, phone_normalized)
+                    SELECT m.id, s.phone_number, s.normalized
+                    FROM mapped m
+                    JOIN staged_phones s ON s.seq = m.seq
+                    WHERE s.valid
+                    ON CONFLICT (client_id, phone_normalized) DO NOTHING
+                    RETURNING 1
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM mapped),
+                    (SELECT COUNT(*) FROM inserted_phones),
+                    ARRAY(
+                        SELECT st.email FROM import_clients_stage st
+                        WHERE st.seq NOT IN (SELECT seq FROM mapped)
+                        ORDER BY st.seq
+                        LIMIT %s
+                    ),
+                    (SELECT COUNT(*) FROM import_clients_stage) - (SELECT COUNT(*) FROM mapped),
+                    ARRAY(
+                        SELECT json_build_object('email', st.email, 'phone', s.phone_number)
+                        FROM staged_phones s
+                        JOIN import_clients_stage st ON st.seq = s.seq
+                        WHERE NOT s.valid
+                        ORDER BY s.seq
+                        LIMIT %s
+                    ),
+                    (SELECT COUNT(*) FROM staged_phones WHERE NOT valid)
+            """, (max_rejected, max_rejected))
+            imported, phones, rejected_emails, rejected, rejected_phones, invalid_phones = cur.fetchone()
+
+        conn.commit()
+        if _client_cache is not None and phones:
+            # Новые номера могли появиться в любых закэшированных результатах поиска по телефону
+            _client_cache.clear()
+    except Exception:
+        conn.rollback()
+        raise
+
+    stats["imported"] += imported
+    stats["phones"] += phones
+    stats["rejected"] += rejected
+    stats["invalid_phones"] += invalid_phones
+    room = max_rejected - len(stats["rejected_emails"])
+    if room > 0:
+        stats["rejected_emails"].extend(rejected_emails[:room])
+    room = max_rejected - len(stats["rejected_phones"])
+    if room > 0:
+        stats["rejected_phones"].extend(rejected_phones[:room])
+
+
+def demo_functions(conn):
+    """
+    Демонстрация всех функций на временном клиенте, который в конце удаляется
+    """
+    print("\n" + "=" * 70)
+    print("🎬 ДЕМОНСТРАЦИЯ ФУНКЦИЙ")
+    print("=" * 70)
+
+    email = f"demo.{time.time_ns()}@example.com"
+
+    print("\n1️⃣  Добавление клиента с двумя телефонами")
+    client_id = add_client(conn, "Демо", "Клиентов", email, ["+7 900 000-00-01", "8 (900) 000-00-02"])
+    if client_id is None:
+        print("❌ Демонстрация прервана: не удалось добавить клиента")
+        return False
+
+    print("\n2️⃣  Добавление еще одного телефона")
+    add_phone(conn, client_id, "+7 900 000-00-03")
+
+    print("\n3️⃣  Поиск клиента по email и по номеру в другом формате")
+    find_client(conn, email=email)
+    find_client(conn, phone="89000000003")
+
+    print("\n4️⃣  Изменение фамилии и списка телефонов")
+    change_client(conn, client_id, last_name="Демонстрационный", phones=["+7 900 000-00-01", "+7 900 000-00-04"])
+    lookup_client(conn, client_id=client_id)
+
+    print("\n5️⃣  Удаление телефона")
+    delete_phone(conn, client_id, "+7 900 000-00-04")
+
+    print("\n6️⃣  Удаление клиента")
+    deleted = delete_client(conn, client_id)
+    find_client(conn, email=email)
+
+    print("\n✅ Демонстрация завершена" if deleted else "\n❌ Демонстрация завершена с ошибками")
+    return deleted
+
+
 def interactive_mode():
     """
     Интерактивный режим работы с базой данных
@@ -468,20 +1674,26 @@ def interactive_mode():
     user = input("   Имя пользователя: ").strip()
     password = input("   Пароль: ").strip()
 
-    # Создаем базу данных если её нет
-    if not create_database(db_name, user, password):
-        print("\n❌ Не удалось создать базу данных. Завершение работы.")
-        return
-
-    # Подключаемся к базе данных
-    conn = connect_to_db(db_name, user, password)
-    if not conn:
-        print("❌ Не удалось подключиться к базе данных. Завершение работы.")
+    # Подключаемся к базе данных через пул соединений; базу создаем,
+    # только если подключиться не удалось (например, ее еще нет)
+    pool = create_pool(db_name, user, password, maxconn=2)
+    if not pool:
+        if not create_database(db_name, user, password):
+            print("\n❌ Не удалось создать базу данных. Завершение работы.")
+            return
+        pool = create_pool(db_name, user, password, maxconn=2)
+        if not pool:
+            print("❌ Не удалось подключиться к базе данных. Завершение работы.")
+            return
+    conn = pool.getconn()
+
+    # Проверка версии схемы; миграции применяются, только если она устарела
+    if not create_db(conn):
+        print("❌ Не удалось подготовить структуру базы данных. Завершение работы.")
+        pool.putconn(conn)
+        pool.closeall()
         return
 
-    # Создаем таблицы
-    create_db(conn)
-
     print(f"\n✅ Подключение к базе данных '{db_name}' успешно!")
 
     # Главное меню
@@ -497,6 +1709,8 @@ def interactive_mode():
         print("6. ❌ Удалить клиента")
         print("7. 🔍 Найти клиента")
         print("8. 🎬 Демонстрация всех функций")
+        print("9. 🔎 Нечеткий поиск по имени")
+        print("10. 📟 Поиск клиента по номеру телефона")
         print("0. 🚪 Выход")
         print("=" * 70)
 
@@ -607,20 +1821,27 @@ def interactive_mode():
             find_client(conn, first_name, last_name, email, phone)
 
         elif choice == "8":
-            # Закрываем текущее соединение перед запуском демо
-            conn.close()
-            demo_functions()
-            # После демо нужно снова подключиться
-            conn = connect_to_db(db_name, user, password)
-            if not conn:
-                print("❌ Не удалось восстановить подключение после демо")
-                break
+            demo_functions(conn)
+
+        elif choice == "9":
+            print("\n🔎 НЕЧЕТКИЙ ПОИСК КЛИЕНТА")
+            name = input("   Имя и/или фамилия (допускаются опечатки): ").strip()
+            if name:
+                search_clients(conn, name)
+
+        elif choice == "10":
+            print("\n📟 ПОИСК ПО НОМЕРУ ТЕЛЕФОНА")
+            phone = input("   Номер телефона (или его начало): ").strip()
+            if phone:
+                prefix = input("   Искать по началу номера? (y/n): ").strip().lower() == "y"
+                find_client_by_phone(conn, phone, prefix=prefix)
 
         else:
             print("   ❌ Неверный выбор. Попробуйте снова.")
 
-    # Закрываем соединение
-    conn.close()
+    # Возвращаем соединение и закрываем пул
+    pool.putconn(conn)
+    pool.closeall()
     print("\n🔌 Соединение с базой данных закрыто")
 
 
@@ -0,0 +1,120 @@
+"""
+Реестр подготовленных запросов (PREPARE/EXECUTE) для часто вызываемых функций
+
+Запрос в формате psycopg2 (%s или %(name)s) при первом выполнении на
+соединении подготавливается командой PREPARE под именем, производным от его
+текста, а затем выполняется через EXECUTE: сервер не разбирает и не
+планирует его заново. Запросы, которые собираются из частей (фильтры
+find_client, поля change_client), дают по одному подготовленному запросу на
+каждую комбинацию - их немного, и каждая готовится один раз.
+
+Подготовленные запросы живут в сессии сервера, поэтому через пулер
+в режиме транзакций (pgbouncer transaction pooling) их нужно отключить:
+disable_prepared_statements(). После DISCARD ALL / DEALLOCATE ALL на
+соединении вызовите forget(conn).
+
+При включенном инструментировании (instrumentation.py) PREPARE
+учитывается как отдельное обращение к серверу (и в счетчике prepares),
+журнал медленных запросов показывает исходный текст запроса, а план
+берется через EXPLAIN ANALYZE EXECUTE.
+"""
+import hashlib
+import re
+import threading
+import weakref
+
+from instrumentation import InstrumentedCursor
+
+# Не больше стольких подготовленных запросов на соединение; остальные выполняются как обычно
+MAX_STATEMENTS_PER_CONNECTION = 256
+
+_enabled = True
+_registry = weakref.WeakKeyDictionary()  # соединение -> множество имен подготовленных запросов
+_lock = threading.Lock()
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def enable_prepared_statements():
+    global _enabled
+    _enabled = True
+
+
+def disable_prepared_statements():
+    global _enabled
+    _enabled = False
+
+
+def forget(conn):
+    """
+    Сброс реестра соединения (после DISCARD ALL, DEALLOCATE ALL или смены сессии)
+    """
+    with _lock:
+        _registry.pop(conn, None)
+
+
+def _positional(query, params):
+    """
+    Запрос с плейсхолдерами $1, $2, ... и значения параметров в их порядке
+    """
+    values = []
+    positions = {}
+    sequential = iter(params) if not isinstance(params, dict) else None
+
+    def replace(match):
+        if match.group(0) == "%%":
+            return "%"
+        name = match.group(1)
+        if name is None:
+            values.append(next(sequential))
+            return f"${len(values)}"
+        if name not in positions:
+            values.append(params[name])
+            positions[name] = len(values)
+        return f"${positions[name]}"
+
+    return _PLACEHOLDER.sub(replace, query), values
+
+
+def execute(cur, query, params=()):
+    """
+    Выполнение запроса через подготовленный на соединении курсора запрос
+    """
+    if not _enabled:
+        return cur.execute(query, params)
+
+    conn = cur.connection
+    name = "nb_" + hashlib.md5(query.encode("utf-8")).hexdigest()[:16]
+    with _lock:
+        names = _registry.get(conn)
+        if names is None:
+            names = _registry[conn] = set()
+        known = name in names
+        if not known and len(names) >= MAX_STATEMENTS_PER_CONNECTION:
+            return cur.execute(query, params)
+
+    text, values = _positional(query, params)
+    instrumented = isinstance(cur, InstrumentedCursor)
+    if not known:
+        cur.execute(f"PREPARE {name} AS {text}")
+        with _lock:
+            names.add(name)
+
+    if instrumented:
+        # Журнал медленных запросов покажет исходный текст, а не имя nb_...
+        cur.source_query = query
+    try:
+        if not values:
+            return cur.execute(f"EXECUTE {name}")
+        return cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(values))})", values)
+    finally:
+        if instrumented:
+            cur.source_query = None
+
+
+def prepared_count(conn):
+    """
+    Число запросов, подготовленных на соединении через этот реестр
+    """
+    with _lock:
+        return len(_registry.get(conn, ()))
@@ -0,0 +1,277 @@
+"""
+Маршрутизация запросов между основным сервером и репликами
+
+Операции чтения (find_client, lookup_client, get_clients,
+find_client_by_phone, search_clients, display_all_clients) выполняются на
+репликах потоковой репликации, все остальные функции - на основном сервере:
+
+    router = ReplicaRouter("host=db1 dbname=clients user=app",
+                           ["host=db2 dbname=clients user=app", "host=db3 dbname=clients user=app"],
+                           policy="least_latency", max_lag=5.0)
+    session = router.session()
+    router.run(number_book.add_client, "Иван", "Петров", "ivan@example.com", session=session)
+    router.run(number_book.find_client, email="ivan@example.com", session=session)
+
+Реплика выбирается по кругу (policy="round_robin") или с наименьшим временем
+отклика (policy="least_latency") среди тех, что отстают не больше max_lag
+секунд; состояние реплик проверяется не чаще раза в check_interval секунд.
+Реплика без потоковой репликации (нет строки streaming в pg_stat_wal_receiver)
+считается недоступной: ее отставание неизвестно.
+Если подходящих реплик нет, чтение идет на основной сервер.
+
+Чтение своих записей: после записи через сессию (session=...) запоминается
+позиция WAL основного сервера, и чтения этой сессии идут только на реплики,
+которые уже воспроизвели WAL до этой позиции (иначе - на основной сервер).
+
+Кэш клиентов (enable_client_cache) заполняется и при чтении с реплики,
+поэтому без сессии устаревшие данные могут жить в нем до истечения ttl.
+
+Локальная проверка с двумя экземплярами PostgreSQL:
+
+    pg_basebackup -h localhost -p 5432 -U postgres -D /tmp/replica -R -X stream
+    pg_ctl -D /tmp/replica -o "-p 5433" start
+    python benchmarks.py --dsn "port=5432 ..." replicas --replica "port=5433 ..."
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from db_pool import ConnectionPool
+
+POLICIES = ("round_robin", "least_latency")
+
+# Функции number_book.py, которые только читают данные
+READ_OPERATIONS = frozenset({
+    "find_client",
+    "lookup_client",
+    "get_clients",
+    "find_client_by_phone",
+    "search_clients",
+    "display_all_clients",
+})
+
+# Отставание NULL - реплика не получает WAL потоком (отключилась от основного
+# сервера или восстанавливается из архива): отстать она может на сколько угодно.
+# Без роли pg_read_all_stats в pg_stat_wal_receiver виден только pid процесса
+_LAG_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                                WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming') THEN NULL
+               -- Все полученное воспроизведено: основной сервер просто ничего не пишет
+               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+"""
+
+
+class Session:
+    """
+    Сессия чтения своих записей: позиция WAL последней записи на основном сервере
+    """
+    __slots__ = ("last_write_lsn",)
+
+    def __init__(self):
+        self.last_write_lsn = None
+
+
+class _Node:
+    """
+    Сервер (основной или реплика) с пулом соединений и результатами последней проверки
+    """
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.healthy = True
+        self.lag = 0.0
+        self.latency = None  # сглаженное время отклика, секунды
+        self.reads = 0
+        self.writes = 0
+
+
+class ReplicaRouter:
+    """
+    Пулы соединений к основному серверу и репликам с выбором сервера для каждой операции
+    """
+
+    def __init__(self, primary_dsn, replica_dsns=(), policy="round_robin", max_lag=5.0,
+                 check_interval=1.0, minconn=1, maxconn=10, **pool_options):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика выбора реплики: {policy}")
+
+        self.policy = policy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.primary = _Node("primary", ConnectionPool(primary_dsn, minconn=minconn, maxconn=maxconn,
+                                                       **pool_options))
+        self.replicas = []
+        for index, dsn in enumerate(replica_dsns):
+            # minconn=0: недоступная при старте реплика не мешает созданию роутера
+            pool = ConnectionPool(dsn, minconn=0, maxconn=maxconn, **pool_options)
+            self.replicas.append(_Node(f"replica{index + 1}", pool))
+
+        self._turn = itertools.count()
+        self._checked_at = 0.0
+        self._check_lock = threading.Lock()
+        self.refresh()
+
+    def session(self):
+        return Session()
+
+    def _check(self, node):
+        """
+        Проверка реплики: доступность, отставание и время отклика
+        """
+        started = time.perf_counter()
+        try:
+            with node.pool.connection(timeout=self.check_interval) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(_LAG_QUERY)
+                    in_recovery, lag = cur.fetchone()
+                conn.rollback()
+        except (psycopg2.Error, OSError) as e:
+            if node.healthy:
+                print(f"❌ {node.name} недоступна: {e}".strip())
+            node.healthy = False
+            return
+
+        elapsed = time.perf_counter() - started
+        node.latency = elapsed if node.latency is None else 0.7 * node.latency + 0.3 * elapsed
+        healthy = bool(in_recovery) and lag is not None
+        if not healthy and node.healthy:
+            if not in_recovery:
+                print(f"❌ {node.name} не является репликой (pg_is_in_recovery() = false), чтение с нее отключено")
+            else:
+                print(f"❌ {node.name} не получает WAL от основного сервера, чтение с нее отключено")
+        elif healthy and not node.healthy:
+            print(f"ℹ️ {node.name} снова доступна")
+        node.lag = float(lag) if lag is not None else float("inf")
+        node.healthy = healthy
+
+    def refresh(self, force=True):
+        """
+        Проверка реплик; без force - только если прошло больше check_interval секунд
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        # Проверку выполняет один поток, остальные используют прошлые результаты
+        if not self._check_lock.acquire(blocking=force):
+            return
+        try:
+            for node in self.replicas:
+                self._check(node)
+            self._checked_at = time.monotonic()
+        finally:
+            self._check_lock.release()
+
+    def _candidates(self):
+        nodes = [node for node in self.replicas if node.healthy and node.lag <= self.max_lag]
+        if self.policy == "least_latency":
+            return sorted(nodes, key=lambda node: node.latency if node.latency is not None else float("inf"))
+        if nodes:
+            shift = next(self._turn) % len(nodes)
+            nodes = nodes[shift:] + nodes[:shift]
+        return nodes
+
+    def _caught_up(self, conn, lsn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (lsn,))
+            caught_up = cur.fetchone()[0]
+        conn.rollback()
+        return bool(caught_up)
+
+    @contextmanager
+    def reader(self, session=None):
+        """
+        Соединение для чтения: подходящая реплика или основной сервер
+        """
+        self.refresh(force=False)
+        lsn = session.last_write_lsn if session is not None else None
+
+        chosen = None
+        for node in self._candidates():
+            try:
+                conn = node.pool.getconn(timeout=self.check_interval)
+            except (psycopg2.Error, OSError):
+                node.healthy = False
+                continue
+            try:
+                if lsn is None or self._caught_up(conn, lsn):
+                    chosen = (node, conn)
+                    break
+            except psycopg2.Error:
+                node.pool.putconn(conn, discard=True)
+                node.healthy = False
+                continue
+            node.pool.putconn(conn)
+
+        if chosen is None:
+            node = self.primary
+            conn = node.pool.getconn()
+        else:
+            node, conn = chosen
+
+        node.reads += 1
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            node.pool.putconn(conn, discard=discard)
+
+    @contextmanager
+    def writer(self, session=None):
+        """
+        Соединение с основным сервером; после выхода позиция WAL запоминается в сессии
+        """
+        self.primary.writes += 1
+        with self.primary.pool.connection() as conn:
+            yield conn
+            if session is not None and not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_current_wal_insert_lsn()")
+                    session.last_write_lsn = cur.fetchone()[0]
+                conn.rollback()
+
+    def run(self, func, *args, session=None, **kwargs):
+        """
+        Вызов функции number_book.py вида func(conn, ...) на подходящем сервере
+        """
+        name = getattr(func, "__name__", "")
+        context = self.reader(session) if name in READ_OPERATIONS else self.writer(session)
+        with context as conn:
+            return func(conn, *args, **kwargs)
+
+    def stats(self):
+        """
+        Состояние серверов: список словарей {"name", "healthy", "lag", "latency_ms", "reads", "writes"}
+        """
+        return [
+            {
+                "name": node.name,
+                "healthy": node.healthy,
+                "lag": node.lag,
+                "latency_ms": node.latency * 1000 if node.latency is not None else None,
+                "reads": node.reads,
+                "writes": node.writes,
+            }
+            for node in [self.primary] + self.replicas
+        ]
+
+    def closeall(self):
+        for node in [self.primary] + self.replicas:
+            node.pool.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.closeall()